@@ -2,15 +2,29 @@ import sys
 import argparse
 import logging
 import requests
-from bs4 import BeautifulSoup
 import json
 import csv
 import os
 import time
 from datetime import datetime
-from urllib.parse import urlparse, urljoin
-from urllib.robotparser import RobotFileParser
-import jaconv
+from urllib.parse import urlparse
+from extractor import extract_content, get_absolute_url
+from robots_cache import robots_cache
+from rate_limiter import rate_limiter, crawl_interval
+from http_client import borrow_session
+from http_cache import http_cache, not_modified_result, is_not_modified
+from charset_detect import header_charset, decode_html
+from fetch_limits import (FetchLimitExceeded, DEADLINE_EXCEEDED, limited_result, request_timeout, start_deadline, deadline_passed,
+                          read_body, is_fetch_limited)
+from sinks import get_sink, save_to_json, save_to_csv, get_output_basename
+from parsers import parse_html
+from keyword_filter import compile_keyword_filter, FIELD_NAMES
+from normalizer import normalize_japanese_text, store_normalized_fields  # noqa: F401
+from near_dup import fingerprint_index, simhash, near_duplicate_result, is_near_duplicate
+from summary_cache import summary_cache
+from summarizer import (summarize_content, summarize_records, build_summary_prompt, get_summary_model,  # noqa: F401
+                        get_summary_client, prefilter_summary, LOCAL_MODEL)
+from config import NEAR_DUP_MODE, STORAGE_SINK, SUMMARY_CLIENT
 
 # ロギングの初期設定（後でverboseで変更可能）
 logging.basicConfig(
@@ -32,16 +46,12 @@ HEADERS = {
 REQUEST_DELAY = 1
 
 def check_robots_txt(url):
-    """robots.txtをチェックして、URLへのアクセスが許可されているかを確認する"""
+    """robots.txtをチェックして、URLへのアクセスが許可されているかを確認する
+
+    robots.txtはホストごとにキャッシュされ、有効期間内は再取得しない。
+    """
     try:
-        parsed_url = urlparse(url)
-        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-        
-        rp = RobotFileParser()
-        rp.set_url(robots_url)
-        rp.read()
-        
-        can_fetch = rp.can_fetch(HEADERS['User-Agent'], url)
+        can_fetch = robots_cache.can_fetch(url, HEADERS['User-Agent'], headers=HEADERS)
         if not can_fetch:
             logging.warning(f"robots.txtによりアクセスが制限されています: {url}")
         return can_fetch
@@ -50,198 +60,72 @@ def check_robots_txt(url):
         # エラーが発生した場合はアクセスを許可する（寛容なアプローチ）
         return True
 
-def get_absolute_url(base_url, relative_url):
-    """相対URLを絶対URLに変換する"""
-    if not relative_url:
-        return None
-    if relative_url.startswith(('http://', 'https://')):
-        return relative_url
-    return urljoin(base_url, relative_url)
+def extract_page(url, html, min_text_length=50, parser=None, truncated=False):
+    """取得したHTMLからデータを抽出し、(データ, 本文のSimHash)を返す
 
-def save_to_json(data, filename):
-    """データをJSON形式で保存する"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-    logging.info(f"✅ JSONファイルを保存しました: {filename}")
+    解析と抽出のCPUの処理だけを行い、保存はしない（パイプラインでは別のプロセスで実行する）。
+    ほぼ同じ内容の検出が無効な場合、SimHashはNone。
+    truncatedがTrue（本文を上限のバイト数で切り詰めた）の場合は、データに'truncated': Trueを加える。
+    """
+    soup = parse_html(html, parser) # soupオブジェクトを作ることでページのタイトルやリンクなどを簡単に
+    
+    # データを抽出
+    data = extract_content(soup, url, min_text_length)
+    if truncated:
+        data['truncated'] = True
+    fingerprint = simhash(data.get('content')) if fingerprint_index else None
+    return data, fingerprint
 
-def save_to_csv(data, filename):
-    """データをCSV形式で保存する"""
-    # CSVのヘッダー
-    fieldnames = list(data.keys())
-    
-    with open(filename, 'w', encoding='utf-8', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        # リスト型のデータをカンマ区切りの文字列に変換
-        csv_data = {}
-        for key, value in data.items():
-            if isinstance(value, list):
-                csv_data[key] = ','.join(value)
-            else:
-                csv_data[key] = value
-        
-        writer.writerow(csv_data)
-    logging.info(f"✅ CSVファイルを保存しました: {filename}")
+def store_page(url, data, fingerprint=None, output_dir='data', sink=None, normalized=None):
+    """抽出したデータを保存先に保存する
 
-def extract_content(soup, url, min_text_length=50):
-    """Webページからコンテンツを抽出する汎用関数"""
-    data = {}
-    
-    # URLを追加
-    data['url'] = url
-    
-    # タイトルの取得
-    data['title'] = soup.title.text.strip() if soup.title else "No Title"
-    logging.info(f"ページのタイトル: {data['title']}")
-    
-    # Open Graph タグからのタイトル取得（代替手段）
-    if data['title'] == "No Title":
-        og_title = soup.find('meta', property='og:title')
-        if og_title:
-            data['title'] = og_title.get('content', 'No Title')
-            logging.info(f"Open Graph タイトル: {data['title']}")
-    
-    # メタデータの取得
-    # 通常のメタ説明
-    meta_description = soup.find('meta', attrs={'name': 'description'})  #<meta name="description" content="ページの説明"> を探す。
-    if meta_description:
-        data['description'] = meta_description.get('content', '')
-        logging.info(f"ページの説明: {data['description'][:100]}...")
-    else:
-        # Open Graph 説明
-        og_description = soup.find('meta', property='og:description')
-        if og_description:
-            data['description'] = og_description.get('content', '')
-            logging.info(f"Open Graph 説明: {data['description'][:100]}...")
-        else:
-            data['description'] = ""
-    
-    # 本文の取得
-    logging.info("ページ本文を抽出中...")
-    
-    # 様々なコンテンツ抽出方法を試す
-    content_candidates = []
-    
-    # 方法1: 記事/コンテンツらしき要素を探す
-    for selector in ['article', '.article', '#article', '.content', '#content', '.main', '#main', 'main', 'section', '.section', '#section']:
-        elements = soup.select(selector)
-        if elements:
-            for element in elements:
-                content_candidates.append(element.get_text(strip=True))
-    
-    # 方法2: 段落を取得
-    paragraphs = []
-    for p in soup.find_all('p'):
-        text = p.text.strip()
-        if len(text) > min_text_length:
-            paragraphs.append(text)
-    
-    if paragraphs:
-        content_candidates.append("\n\n".join(paragraphs))
-    
-    # 方法3: divで囲まれた大きなテキストブロックを探す
-    for div in soup.find_all('div'):
-        text = div.get_text(strip=True)
-        if len(text) > min_text_length * 5:  # より大きなテキストブロック
-            content_candidates.append(text)
-    
-    # 方法4: schema.org構造化データを探す
-    schema_elements = soup.find_all('script', type='application/ld+json')
-    for element in schema_elements:
-        try:
-            schema_data = json.loads(element.string)
-            if isinstance(schema_data, dict):
-                # 記事コンテンツを探す
-                article_body = schema_data.get('articleBody')
-                if article_body:
-                    content_candidates.append(article_body)
-        except Exception as e:
-            logging.warning(f"schema.orgデータの解析中にエラーが発生しました: {e}")
-    
-    # 最も長いコンテンツ候補を選択
-    if content_candidates:
-        data['content'] = max(content_candidates, key=len)
-        logging.info(f"本文を抽出しました（{len(data['content'])}文字）")
-        logging.info(f"プレビュー: {data['content'][:150]}...")
-    else:
-        data['content'] = ""
-        logging.warning("本文が見つかりませんでした")
-    
-    # 画像URLの取得
-    logging.info("画像を抽出中...")
-    
-    images = []
-    
-    # Open Graph 画像を探す
-    og_image = soup.find('meta', property='og:image')
-    if og_image:
-        img_url = og_image.get('content', '')
-        if img_url:
-            images.append({
-                'url': img_url,
-                'alt': 'Open Graph Image'
-            })
-    
-    # 通常の画像を探す
-    for img in soup.find_all('img'):
-        src = img.get('src', '')
-        if src:
-            # 相対URLを絶対URLに変換
-            abs_src = get_absolute_url(url, src)
-            if abs_src:
-                # 画像の代替テキストを取得
-                alt = img.get('alt', '')
-                
-                images.append({
-                    'url': abs_src,
-                    'alt': alt
-                })
-    
-    # 画像URLのリストを作成
-    data['images'] = [img['url'] for img in images]
-    
-    if images:
-        logging.info(f"画像を{len(images)}枚見つけました")
-        for i, img in enumerate(images[:5]):  # 最初の5枚だけ表示
-            logging.info(f"画像 {i+1}: {img['url']}")
-        if len(images) > 5:
-            logging.info(f"...他 {len(images) - 5} 枚")
-    else:
-        logging.warning("画像が見つかりませんでした")
-    
-    # リンクの取得
-    logging.info("リンクを抽出中...")
-    
-    links = []
-    for a in soup.find_all('a', href=True):
-        href = a.get('href', '')
-        if href and not href.startswith(('#', 'javascript:', 'mailto:')):
-            # 相対URLを絶対URLに変換
-            abs_href = get_absolute_url(url, href)
-            if abs_href:
-                link_text = a.get_text(strip=True)
-                links.append({
-                    'url': abs_href,
-                    'text': link_text
-                })
-    
-    # リンクURLのリストを作成
-    data['links'] = [link['url'] for link in links]
-    
-    if links:
-        logging.info(f"リンクを{len(links)}個見つけました")
-        for i, link in enumerate(links[:5]):  # 最初の5個だけ表示
-            logging.info(f"リンク {i+1}: {link['text']} - {link['url']}")
-        if len(links) > 5:
-            logging.info(f"...他 {len(links) - 5} 個")
-    else:
-        logging.warning("リンクが見つかりませんでした")
-    
-    return data
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    normalizedには正規化済みのタイトル・説明・本文を渡せる（省略時はここで正規化する）。
+    戻り値は抽出したデータに保存先（location）を加えたもの。
+    """
+    # 保存済みのスナップショットとほぼ同じ内容なら、全体は保存しない（参照だけを保存するかスキップする）
+    match = fingerprint_index.find(url, fingerprint) if fingerprint is not None and fingerprint_index else None
+    if match:
+        logging.info(f"ほぼ同じ内容のスナップショットがあります（距離: {match['distance']}）: {match['basename']}")
+        result = near_duplicate_result(data, match)
+        if NEAR_DUP_MODE == 'reference':
+            reference = {key: value for key, value in result.items() if key != 'links'}
+            get_sink(output_dir, sink).write(reference)
+        return result
+    
+    # 保存先に保存（filesはJSONとCSV、jsonlはセグメントに追記）
+    location = get_sink(output_dir, sink).write(data)
+    if fingerprint is not None and fingerprint_index:
+        fingerprint_index.add(url, fingerprint, location)
+    
+    # キーワードの再フィルタリングや全文検索のために、正規化したテキストを保存しておく
+    store_normalized_fields(data, normalized)
+    
+    # 保存先（filesはファイルパス、jsonl / parquetはレコードID）を加えて返す（タスクの結果はこれで保存したページを参照する）
+    return {**data, 'location': location}
+
+def process_page(url, html, output_dir='data', min_text_length=50, parser=None, sink=None, truncated=False):
+    """取得したHTMLからデータを抽出し、保存先に保存する（extract_pageとstore_pageを続けて行う）
+
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    戻り値は抽出したデータに保存先（location）を加えたもの。
+    """
+    data, fingerprint = extract_page(url, html, min_text_length, parser, truncated)
+    return store_page(url, data, fingerprint, output_dir, sink)
+
+def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DELAY, user_agent=None, parser=None, use_cache=True, rate_limit=True,
+                   sink=None):
+    """指定されたURLのWebサイトをスクレイピングする
 
-def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DELAY, user_agent=None):
-    """指定されたURLのWebサイトをスクレイピングする"""
+    parserでHTMLパーサーのバックエンドを指定できる（省略時は環境変数SCRAPER_PARSER）。
+    use_cacheがTrueの場合は条件付きGETを行い、前回から更新されていないページは
+    解析も保存もせずにnot_modified_result()を返す。
+    rate_limitがFalseの場合は、呼び出し側でレート制限の予約を済ませているものとして待機しない。
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    本文は少しずつ読み、上限（SCRAPER_FETCH_MAX_BYTES）を超えた分は切り詰めるか（'truncated': True）、
+    取得をやめて{'status': 'oversized'}を返す。リクエスト全体の期限（SCRAPER_FETCH_DEADLINE）を過ぎた場合は
+    {'status': 'deadline_exceeded'}を返す（fetch_limits.py）。
+    """
     logging.info(f"{url} のスクレイピングを開始しました！")
     
     # ユーザーエージェントの設定
@@ -249,6 +133,7 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
     if user_agent:
         headers['User-Agent'] = user_agent
     
+    deadline = None
     try:
         # robots.txtをチェック
         if not check_robots_txt(url):
@@ -257,34 +142,44 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
         
         logging.info("Webページを取得中...")
         
-        # リクエスト前に待機（レート制限）
-        if delay > 0:
-            logging.info(f"{delay}秒間待機中...")
-            time.sleep(delay)
+        # ドメインごとのレート制限（delayとrobots.txtのCrawl-delayの大きい方の間隔を空ける）
+        if rate_limit:
+            interval = crawl_interval(delay, robots_cache.lookup(url), headers['User-Agent'])
+            rate_limiter.wait(url, interval)
+        
+        # 前回の取得結果があれば条件付きGETにする
+        cache = http_cache if use_cache else None
+        if cache:
+            headers.update(cache.conditional_headers(url))
+        
+        # プロセスで共有するSessionのプールから借りて、同じホストへの接続を再利用する
+        # （本文はstream=Trueで少しずつ読み、読み終えてから接続をプールに返す）
+        deadline = start_deadline()
+        with borrow_session() as session:
+            response = session.get(url, headers=headers, timeout=request_timeout(), stream=True)
+            if response.status_code != 200:
+                response.close()
+                content = b''
+            else:
+                content, truncated = read_body(response, deadline=deadline)
         
-        response = requests.get(url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            logging.info(f"ページは前回の取得から更新されていません: {url}")
+            return not_modified_result(url)
         
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser") # soupオブジェクトを作ることでページのタイトルやリンクなどを簡単に
-            
-            # データを抽出
-            data = extract_content(soup, url, min_text_length)
-            
-            # 保存用のディレクトリを作成
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # ドメイン名を取得してファイル名に使用
-            domain = urlparse(url).netloc.replace('.', '_')
-            
-            # タイムスタンプを含むファイル名を生成
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            json_filename = f"{output_dir}/{domain}_{timestamp}.json"
-            csv_filename = f"{output_dir}/{domain}_{timestamp}.csv"
-            
-            # JSONとCSVに保存
-            save_to_json(data, json_filename)
-            save_to_csv(data, csv_filename)
+            if truncated:
+                logging.warning(f"本文が上限を超えたため、先頭{len(content)}バイトだけを解析します: {url}")
+            if cache and cache.is_unchanged(url, content):
+                logging.info(f"ページの内容は前回の取得から変わっていません: {url}")
+                cache.store(url, response.headers, content)
+                return not_modified_result(url)
             
+            # 文字コードはヘッダー・BOM・<meta>・ホストごとのキャッシュ・先頭だけの判定の順に決める（charset_detect.py）
+            html = decode_html(content, header_charset(response.headers.get('Content-Type')), url)
+            data = process_page(url, html, output_dir, min_text_length, parser, sink, truncated)
+            if cache and data:
+                cache.store(url, response.headers, content, data.get('links'))
             return data
             
         else:
@@ -299,11 +194,18 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
                 logging.error("サーバーエラーが発生しました。後でもう一度試してください。")
             return None
 
-    except requests.exceptions.Timeout:
-        logging.error(f"タイムアウトエラー: {url}")
-        return None
-    except requests.exceptions.ConnectionError:
-        logging.error(f"接続エラー: {url}")
+    except FetchLimitExceeded as e:
+        logging.warning(f"{e}: {url}")
+        return limited_result(url, e)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        # 読み込みのタイムアウトが期限の後に起きた場合は、期限切れとして扱う
+        if deadline_passed(deadline):
+            logging.warning(f"取得の期限を過ぎました: {url}")
+            return limited_result(url, FetchLimitExceeded(DEADLINE_EXCEEDED, str(e)))
+        if isinstance(e, requests.exceptions.Timeout):
+            logging.error(f"タイムアウトエラー: {url}")
+        else:
+            logging.error(f"接続エラー: {url}")
         return None
     except requests.exceptions.RequestException as e:
         logging.error(f"リクエストエラー: {e}")
@@ -314,106 +216,50 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
     finally:
         logging.info("スクレイピング完了！")
 
-def normalize_japanese_text(text):
-    """日本語テキストを正規化する
-    
-    ひらがな、カタカナ、漢字などの異なる文字種を統一的に扱うための正規化を行います。
-    現在の実装では、すべてのカタカナをひらがなに変換します。
-    """
-    if not text:
-        return text
-    
-    # カタカナをひらがなに変換
-    normalized_text = jaconv.z2h(text, kana=False, digit=True, ascii=True)  # 全角英数字を半角に変換
-    normalized_text = jaconv.kata2hira(normalized_text)  # カタカナをひらがなに変換
-    
-    return normalized_text
-
 def filter_content_by_keyword(data, keyword):
-    """キーワードに基づいてコンテンツをフィルタリングする"""
+    """キーワードに基づいてコンテンツをフィルタリングする
+
+    keywordはキーワードの式（「タイミー OR メルカリ」「A AND NOT B」など、keyword_filterを参照）か
+    キーワードのリスト。式はプロセスで1回だけコンパイルし、本文・タイトル・説明をそれぞれ1回だけ走査する。
+    一致した場合は、どのキーワードがどこに見つかったかをmatched_keywordsに加えたデータを返す。
+    """
     if not keyword:
         logging.warning("キーワードが指定されていません。すべてのコンテンツを返します。")
         return data
     
-    # キーワードを小文字に変換（大文字小文字を区別しない検索のため）
-    keyword_lower = keyword.lower()
-    # 日本語キーワードを正規化
-    normalized_keyword = normalize_japanese_text(keyword_lower)
-    
-    # コンテンツにキーワードが含まれているかチェック
-    if 'content' in data and data['content']:
-        content_lower = data['content'].lower()
-        normalized_content = normalize_japanese_text(content_lower)
-        if keyword_lower in content_lower or (normalized_keyword and normalized_keyword in normalized_content):
-            logging.info(f"キーワード '{keyword}' が本文に見つかりました。")
-            return data
-    
-    # タイトルにキーワードが含まれているかチェック
-    if 'title' in data and data['title']:
-        title_lower = data['title'].lower()
-        normalized_title = normalize_japanese_text(title_lower)
-        if keyword_lower in title_lower or (normalized_keyword and normalized_keyword in normalized_title):
-            logging.info(f"キーワード '{keyword}' がタイトルに見つかりました。")
-            return data
+    matched, hits = compile_keyword_filter(keyword).match(data)
     
-    # 説明にキーワードが含まれているかチェック
-    if 'description' in data and data['description']:
-        description_lower = data['description'].lower()
-        normalized_description = normalize_japanese_text(description_lower)
-        if keyword_lower in description_lower or (normalized_keyword and normalized_keyword in normalized_description):
-            logging.info(f"キーワード '{keyword}' が説明に見つかりました。")
-            return data
+    if matched:
+        for found_keyword, fields in hits.items():
+            locations = '・'.join(FIELD_NAMES[field] for field in fields)
+            logging.info(f"キーワード '{found_keyword}' が{locations}に見つかりました。")
+        return {**data, 'matched_keywords': hits}
     
-    logging.info(f"キーワード '{keyword}' が見つかりませんでした。")
+    logging.info(f"キーワード '{keyword}' に一致しませんでした。")
     return None
 
-def summarize_content(data, api_key, language='Japanese', max_length=200, style='bullet'):
-    """Gemini APIを使用してコンテンツを要約する"""
-    try:
-        import google.generativeai as genai
-        
-        # APIキーの設定
-        genai.configure(api_key=api_key)
-        
-        # モデルの選択
-        model = genai.GenerativeModel('models/gemini-1.5-pro')
-        
-        # 要約するコンテンツの準備
-        content_to_summarize = f"Title: {data.get('title', '')}\n"
-        if data.get('description'):
-            content_to_summarize += f"Description: {data.get('description')}\n"
-        if data.get('content'):
-            content_to_summarize += f"Content: {data.get('content')}\n"
-        
-        # 要約スタイルに基づいてプロンプトを作成
-        if style == 'bullet':
-            prompt = f"Summarize this text in {language} in 3-5 bullet points: \"{content_to_summarize}\""
-        elif style == 'paragraph':
-            prompt = f"Summarize this text in {language} in a short paragraph: \"{content_to_summarize}\""
-        elif style == 'headline':
-            prompt = f"Summarize this text in {language} in a single headline (30 characters or less): \"{content_to_summarize}\""
-        else:
-            prompt = f"Summarize this text in {language}: \"{content_to_summarize}\""
-        
-        # 生成パラメータの設定
-        generation_config = {
-            'temperature': 0.2,  # 決定的な出力のために低い温度
-            'max_output_tokens': max_length,  # 出力の長さ制限
-            'top_p': 0.95,  # 核サンプリング
-        }
-        
-        # 要約の生成
-        response = model.generate_content(prompt, generation_config=generation_config)
-        
-        # 要約を返す
-        return response.text
-        
-    except ImportError:
-        logging.error("google-generativeaiパッケージがインストールされていません。pip install google-generativeaiでインストールしてください。")
-        return None
-    except Exception as e:
-        logging.error(f"要約中にエラーが発生しました: {e}")
+def summarize_saved_record(record, api_key, output_dir='data', language='Japanese', max_length=200, style='bullet'):
+    """保存済みのページを要約し、保存先にsummaryのレコードとして追記して要約を返す（要約できなければNone）
+
+    要約のキューのワーカー（tasks.summarize_batch）と同じく、抽出型の要約で済むかを先に判定し、
+    Geminiで要約する場合はsummarize_records（レート制限と429の再試行を含む）を使う。
+    """
+    summary, needs_llm = prefilter_summary(record, style, max_length)
+    model = LOCAL_MODEL
+    if needs_llm:
+        if not api_key and SUMMARY_CLIENT != 'fake':
+            logging.error("Gemini APIキーが指定されていません。環境変数GEMINI_API_KEYで設定してください。")
+            return None
+        client = get_summary_client(api_key)
+        summary = summarize_records([record], api_key, language=language, max_length=max_length, style=style,
+                                   client=client, engine='gemini')[0]
+        model = client.model_name
+    if not summary:
         return None
+    sink = get_sink(output_dir)
+    sink.write({'url': record['url'], 'summary': summary, 'model': model}, kind='summary')
+    sink.flush()
+    return summary
 
 def main():
     import os
@@ -457,6 +303,21 @@ def main():
         logging.error("スクレイピングに失敗しました。")
         return
     
+    # 前回から更新されていない場合はフィルタリング・要約・保存を行わない
+    if is_not_modified(result):
+        logging.info("ページは前回の取得から更新されていないため、処理をスキップします。")
+        return
+    
+    # 保存済みのスナップショットとほぼ同じ内容の場合も同様
+    if is_near_duplicate(result):
+        logging.info("ページは保存済みのスナップショットとほぼ同じ内容のため、処理をスキップします。")
+        return
+    
+    # 上限（本文のサイズ・全体の期限）を超えて取得をやめた場合も同様
+    if is_fetch_limited(result):
+        logging.error(f"ページが取得の上限を超えたため、処理をスキップします（{result['status']}）。")
+        return
+    
     # キーワードでフィルタリング（環境変数から取得）
     filtered_result = None
     if keyword:
@@ -477,39 +338,30 @@ def main():
         
         # タイムスタンプを含むファイル名を生成
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        json_filename = f"{output_dir}/{domain}_{timestamp}_filtered.json"
-        csv_filename = f"{output_dir}/{domain}_{timestamp}_filtered.csv"
         
-        # 要約機能が有効な場合
+        # 先に保存先に保存する（filesの場合は_filteredの付いたJSONとCSV）。要約に失敗しても、ページは残る
+        sink = get_sink(output_dir)
+        sink.write(filtered_result, kind='filtered')
+        sink.flush()
+        
+        logging.info(f"フィルタリングされたデータを保存しました。")
+        
+        # 要約機能が有効な場合は、保存したページを要約し、summaryのレコードとして追記する
         if summarize:
-            if not api_key:
-                logging.error("Gemini APIキーが指定されていません。環境変数GEMINI_API_KEYで設定してください。")
-            else:
-                # コンテンツの要約
-                summary = summarize_content(
-                    filtered_result, 
-                    api_key, 
-                    language=summary_language,
-                    max_length=summary_length,
-                    style=summary_style
-                )
+            summary = summarize_saved_record(filtered_result, api_key, output_dir, language=summary_language,
+                                             max_length=summary_length, style=summary_style)
+            if summary:
+                logging.info(f"コンテンツの要約:\n{summary}")
+                if summary_cache:
+                    stats = summary_cache.stats()
+                    logging.info(f"要約のキャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件（ヒット率 {stats['hit_rate']:.0%}）")
                 
-                if summary:
-                    # 要約を結果に追加
-                    filtered_result['summary'] = summary
-                    logging.info(f"コンテンツの要約:\n{summary}")
-                    
-                    # 要約のみのファイルも保存
+                # 要約のみのファイルも保存（JSON Linesの保存先ではsummaryのレコードに含まれる）
+                if STORAGE_SINK == 'files':
                     summary_filename = f"{output_dir}/{domain}_{timestamp}_summary.txt"
                     with open(summary_filename, 'w', encoding='utf-8') as f:
                         f.write(summary)
                     logging.info(f"✅ 要約を保存しました: {summary_filename}")
-        
-        # JSONとCSVに保存
-        save_to_json(filtered_result, json_filename)
-        save_to_csv(filtered_result, csv_filename)
-        
-        logging.info(f"フィルタリングされたデータを保存しました。")
     else:
         logging.warning(f"キーワード '{keyword}' を含むコンテンツは見つかりませんでした。")
 
@@ -0,0 +1,164 @@
+import asyncio
+import functools
+import logging
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import (FETCH_CONCURRENCY, FETCH_PER_HOST, FETCH_MAX_BYTES, FETCH_OVERSIZE, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT,
+                    FETCH_DEADLINE)
+from fetch_limits import FetchLimitExceeded, DEADLINE_EXCEEDED, limited_result, start_deadline, deadline_passed, read_body_async
+from charset_detect import decode_html
+from robots_cache import ROBOTS_TIMEOUT, robots_cache
+from http_cache import http_cache, not_modified_result
+from rate_limiter import rate_limiter, crawl_interval
+
+class AsyncFetcher:
+    """複数URLを並行して取得する非同期クローラー
+
+    全体の同時接続数とホストごとの同時接続数を制限し、同じドメインへの
+    リクエストはrate_limiterでdelay秒（robots.txtのCrawl-delayの方が長ければその秒数）の
+    間隔を空ける。待機はドメインごとに行うため、あるドメインの待ち時間が
+    他のドメインの取得を止めることはない。
+    取得したHTMLはhandler(url, html)に渡され（スレッドプールで実行）、その戻り値が結果になる。
+    HTTPキャッシュが有効な場合は条件付きGETを行い、更新のないページはhandlerを呼ばずに
+    not_modified_result()を結果にする。
+    本文は少しずつ読み、max_bytesを超えた場合は切り詰めるか取得をやめる（oversize、fetch_limits.py）。
+    リクエスト全体（接続から本文の読み込みまで）の期限deadline秒を過ぎた場合は、{'status': 'deadline_exceeded'}を結果にする。
+    """
+
+    def __init__(self, handler, headers=None, concurrency=FETCH_CONCURRENCY, per_host=FETCH_PER_HOST,
+                 delay=0, check_robots=True, use_cache=True, connect_timeout=FETCH_CONNECT_TIMEOUT,
+                 read_timeout=FETCH_READ_TIMEOUT, deadline=FETCH_DEADLINE, max_bytes=FETCH_MAX_BYTES, oversize=FETCH_OVERSIZE):
+        self.handler = handler
+        self.headers = headers or {}
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.oversize = oversize
+        self.check_robots = check_robots
+        self.cache = http_cache if use_cache else None
+
+    async def fetch_all(self, urls):
+        """URLリストをすべて取得し、入力と同じ順番で結果のリストを返す（失敗したURLはNone）"""
+        self._global_limit = asyncio.Semaphore(self.concurrency)
+        self._host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self._robots = {}
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        # totalはリクエスト全体（本文の読み込みまで）の期限
+        timeout = aiohttp.ClientTimeout(total=self.deadline, connect=self.connect_timeout, sock_read=self.read_timeout)
+        async with aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout) as session:
+            self._session = session
+            return await asyncio.gather(*(self._fetch_one(url) for url in urls))
+
+    async def _fetch_one(self, url):
+        parsed_url = urlparse(url)
+        host = f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+        async with self._host_limits[host]:
+            rules = None
+            if self.check_robots:
+                rules = await self._get_rules(host, url)
+                if not rules.can_fetch(self.headers.get('User-Agent', '*'), url):
+                    logging.error(f"robots.txtによりアクセスが制限されています: {url}")
+                    return None
+
+            await self._wait_turn(url, rules)
+
+            async with self._global_limit:
+                headers = self.cache.conditional_headers(url) if self.cache else None
+                deadline = start_deadline(self.deadline)
+                try:
+                    async with self._session.get(url, headers=headers) as response:
+                        if response.status == 304:
+                            logging.info(f"ページは前回の取得から更新されていません: {url}")
+                            return not_modified_result(url)
+                        if response.status != 200:
+                            logging.error(f"HTTPエラー: {response.status} ({url})")
+                            return None
+                        body, truncated = await read_body_async(response, self.max_bytes, deadline, self.oversize)
+                        if truncated:
+                            logging.warning(f"本文が上限を超えたため、先頭{len(body)}バイトだけを解析します: {url}")
+                        if self.cache and self.cache.is_unchanged(url, body):
+                            logging.info(f"ページの内容は前回の取得から変わっていません: {url}")
+                            self.cache.store(url, response.headers, body)
+                            return not_modified_result(url)
+                        # 文字コードはContent-Typeのcharsetだけを見る（なければdecode_htmlでBOM・<meta>・先頭から判定する）
+                        encoding = response.charset
+                        response_headers = response.headers
+                except FetchLimitExceeded as e:
+                    logging.warning(f"{e}: {url}")
+                    return limited_result(url, e)
+                except asyncio.TimeoutError as e:
+                    # 接続と読み込みのタイムアウトはServerTimeoutError、全体の期限（total）はそれ以外のTimeoutError
+                    if not isinstance(e, aiohttp.ServerTimeoutError) or deadline_passed(deadline):
+                        logging.warning(f"取得の期限を過ぎました: {url}")
+                        return limited_result(url, FetchLimitExceeded(DEADLINE_EXCEEDED, str(e)))
+                    logging.error(f"タイムアウトエラー: {url}")
+                    return None
+                except aiohttp.ClientError as e:
+                    logging.error(f"リクエストエラー: {url} ({e})")
+                    return None
+                # 本文を処理に渡すまでは取得の枠を手放さない（パイプラインではキューが空くまで次の取得を待たせる）
+                pending = await self._hand_off(url, body, encoding, truncated)
+
+        try:
+            result = await pending
+        except Exception as e:
+            logging.error(f"例外発生: {url} ({e})")
+            return None
+        if result and self.cache:
+            self.cache.store(url, response_headers, body, result.get('links'))
+        return result
+
+    async def _hand_off(self, url, body, encoding, truncated=False):
+        """取得した本文を処理に渡し、結果を待つawaitableを返す（取得の枠を持ったまま呼ばれる）"""
+        return self._process(url, body, encoding, truncated)
+
+    async def _process(self, url, body, encoding, truncated=False):
+        """取得した本文を処理して結果を返す（パイプラインでは解析のプロセスに渡す）
+
+        truncatedがTrue（本文を切り詰めた）の場合は、handlerにtruncated=Trueを渡す。
+        """
+        # 解析と保存はCPU処理なので、イベントループを止めないようスレッドで実行する
+        html = decode_html(body, encoding, url)
+        loop = asyncio.get_running_loop()
+        if truncated:
+            return await loop.run_in_executor(None, functools.partial(self.handler, url, html, truncated=True))
+        return await loop.run_in_executor(None, self.handler, url, html)
+
+    async def _wait_turn(self, url, rules):
+        """ドメインのトークンを予約し、実行できる時刻まで待機する（他のホストの取得は止めない）"""
+        interval = crawl_interval(self.delay, rules, self.headers.get('User-Agent', '*'))
+        wait = rate_limiter.reserve(url, interval)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _get_rules(self, host, url):
+        """robots.txtのルールを返す（共有キャッシュになければ、1回の実行でホストごとに1度だけ取得する）"""
+        if host in self._robots:
+            return await self._robots[host]
+        rules = robots_cache.lookup(url)
+        if rules is None:
+            self._robots[host] = asyncio.ensure_future(self._read_robots(host))
+            rules = await self._robots[host]
+        return rules
+
+    async def _read_robots(self, host):
+        try:
+            async with self._session.get(f"{host}/robots.txt", timeout=aiohttp.ClientTimeout(total=ROBOTS_TIMEOUT)) as response:
+                body = await response.text(errors='replace') if response.status == 200 else None
+                return robots_cache.store(host, response.status, body)
+        except Exception as e:
+            logging.warning(f"robots.txtの確認中にエラーが発生しました: {e}")
+            return robots_cache.store(host, None)
+
+def fetch_urls(urls, handler, **kwargs):
+    """同期コード（Celeryタスクやコマンドライン）からAsyncFetcherを実行する"""
+    return asyncio.run(AsyncFetcher(handler, **kwargs).fetch_all(urls))
@@ -0,0 +1,115 @@
+"""文字コードの判定とデコードのベンチマーク
+
+bench_parsers.pyと同じくapp/dataの保存済みレコードからページを再構成し、UTF-8・Shift_JIS（CP932）・EUC-JPで
+エンコードしたうえで、文字コードの指定の仕方（HTTPヘッダー / <meta> / 指定なし）ごとに次を比べる。
+
+- requests: response.text（Content-Typeにcharsetがなければ、text/htmlはISO-8859-1としてデコードする）
+- full-detect: charsetがなければ本文全体を判定器に渡す（requestsのapparent_encodingと同じ）
+- charset_detect: ヘッダー・BOM・<meta>・UTF-8の確認・先頭だけの判定（ページごとに別のホストにして、キャッシュを使わない）
+- charset_detect+host: 同じホストのページを続けて判定する（ホストごとのキャッシュを使う）
+
+1ページあたりの時間と、元のHTMLと同じ文字列にデコードできたページ数を表示する。
+判定器はcchardet（faust-cchardet）があればそれを、なければcharset_normalizerを使う（charset_detect.pyと同じ）。
+
+使い方:
+    python bench_charset.py [--repeat 5] [--pad 0] [追加のHTMLファイル ...]
+"""
+import argparse
+import logging
+import time
+
+import requests
+from requests.compat import chardet
+from requests.utils import get_encoding_from_headers
+
+import charset_detect
+from bench_parsers import load_fixture_pages
+from charset_detect import HostCharsetCache, charset_source, header_charset
+
+ENCODINGS = ('utf-8', 'cp932', 'euc_jp')
+DECLARATIONS = ('header', 'meta', 'none')
+
+# <meta>に書く文字コード名（ページでよく使われる名前）
+META_NAMES = {'utf-8': 'utf-8', 'cp932': 'Shift_JIS', 'euc_jp': 'EUC-JP'}
+
+def build_variants(pages, pad=0):
+    """ページを文字コードと指定の仕方ごとにエンコードし、(文字コード, 指定, Content-Type, 本文, 期待する文字列)のリストを返す
+
+    padを指定すると、本文の後ろにpad個の段落を加えて大きなページにする。
+    """
+    variants = []
+    for _, _, page in pages:
+        if pad:
+            page = page.replace('</body>', ('<p>' + 'ページの末尾に追加した段落です。' * 20 + '</p>') * pad + '</body>', 1)
+        for encoding in ENCODINGS:
+            for declaration in DECLARATIONS:
+                meta = f'<meta charset="{META_NAMES[encoding]}">' if declaration == 'meta' else ''
+                html = page.replace('<meta charset="utf-8">', meta, 1)
+                # CP932・EUC-JPにない文字（©など）は文字参照にする
+                body = html.encode(encoding, errors='xmlcharrefreplace')
+                expected = body.decode(encoding)
+                content_type = f"text/html; charset={META_NAMES[encoding]}" if declaration == 'header' else 'text/html'
+                variants.append((encoding, declaration, content_type, body, expected))
+    return variants
+
+def decode_requests(body, content_type, url):
+    # HTTPAdapter.build_responseと同じく、ヘッダーから文字コードを決めてからtextを読む
+    response = requests.Response()
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    response.encoding = get_encoding_from_headers(response.headers)
+    return response.text
+
+def decode_full_detect(body, content_type, url):
+    encoding = header_charset(content_type) or chardet.detect(body)['encoding'] or 'utf-8'
+    return body.decode(encoding, errors='replace')
+
+def decode_charset_detect(body, content_type, url):
+    encoding, _ = charset_source(body, header_charset(content_type), url)
+    return body.decode(encoding, errors='replace')
+
+MODES = (
+    ('requests', decode_requests, False),
+    ('full-detect', decode_full_detect, False),
+    ('charset_detect', decode_charset_detect, False),
+    ('charset_detect+host', decode_charset_detect, True),
+)
+
+def measure(decode, variants, repeat, same_host):
+    """(指定の仕方ごとの1ページあたりの秒数, 正しくデコードできたページ数)を返す"""
+    elapsed = {declaration: 0.0 for declaration in DECLARATIONS}
+    correct = 0
+    for round_number in range(repeat):
+        charset_detect.host_charsets = HostCharsetCache()
+        for index, (encoding, declaration, content_type, body, expected) in enumerate(variants):
+            # 同じホストでは文字コードごとにホストを分ける（サイトごとに文字コードは同じことが多い）
+            host = f"{encoding}.example.com" if same_host else f"page{round_number}-{index}.example.com"
+            start = time.perf_counter()
+            text = decode(body, content_type, f"https://{host}/")
+            elapsed[declaration] += time.perf_counter() - start
+            if round_number == 0:
+                correct += text == expected
+    count = repeat * len(variants) / len(DECLARATIONS)
+    return {declaration: seconds / count for declaration, seconds in elapsed.items()}, correct
+
+def main():
+    parser = argparse.ArgumentParser(description='文字コードの判定とデコードのベンチマーク')
+    parser.add_argument('files', nargs='*', help='追加で計測するHTMLファイル')
+    parser.add_argument('--repeat', '-r', type=int, default=5, help='繰り返し回数（デフォルト: 5）')
+    parser.add_argument('--pad', type=int, default=0, help='ページの末尾に加える段落の数（大きなページの計測用、デフォルト: 0）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    variants = build_variants(load_fixture_pages(args.files), args.pad)
+    average_size = sum(len(body) for _, _, _, body, _ in variants) / len(variants)
+    print(f"{len(variants)}ページ（{' / '.join(ENCODINGS)} x {' / '.join(DECLARATIONS)}、平均 {average_size / 1024:.0f} KB）、"
+          f"判定器: {charset_detect._get_detector().__module__}")
+    print()
+    print(f"{'mode':<20} {'header ms':>10} {'meta ms':>10} {'none ms':>10}   correct")
+    for name, decode, same_host in MODES:
+        per_page, correct = measure(decode, variants, args.repeat, same_host)
+        print(f"{name:<20} {per_page['header'] * 1000:>10.3f} {per_page['meta'] * 1000:>10.3f} {per_page['none'] * 1000:>10.3f}"
+              f"   {correct}/{len(variants)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""HTTP取得方法のベンチマーク
+
+ローカルのテストサーバーに同じホストへのリクエストを繰り返し送り、
+requests.get（毎回新しい接続）と、プールされたSession（keep-alive）を比較する。
+テストサーバーは新しい接続ごとに--handshake-msだけ待機して、
+リモートサーバーとのTCP/TLSハンドシェイクの往復時間を模擬する。
+
+使い方:
+    python bench_http.py [--requests 50] [--handshake-ms 20]
+"""
+import argparse
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bench_parsers import load_fixture_pages
+from http_client import ACCEPT_ENCODING, create_session
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, page, handshake_delay):
+        super().__init__(address, BenchHandler)
+        self.page = page.encode('utf-8')
+        self.gzipped_page = gzip.compress(self.page)
+        try:
+            import brotli
+            self.brotli_page = brotli.compress(self.page)
+        except ImportError:
+            self.brotli_page = None
+        self.handshake_delay = handshake_delay
+        self.connections = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文が別パケットになったときの遅延ACKの影響を避ける
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # 新しい接続ごとにハンドシェイクの往復時間を模擬する
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake_delay)
+
+    def do_GET(self):
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        body = self.server.page
+        encoding = None
+        if 'br' in accept_encoding and self.server.brotli_page is not None:
+            body, encoding = self.server.brotli_page, 'br'
+        elif 'gzip' in accept_encoding:
+            body, encoding = self.server.gzipped_page, 'gzip'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def run(server, url, fetch, count):
+    """count回取得して、経過時間・新規接続数・転送バイト数を返す"""
+    server.connections = 0
+    server.bytes_sent = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        response = fetch(url)
+        response.raise_for_status()
+        response.text
+    return time.perf_counter() - start, server.connections, server.bytes_sent
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP取得方法のベンチマーク')
+    parser.add_argument('--requests', '-n', type=int, default=50, help='リクエスト数（デフォルト: 50）')
+    parser.add_argument('--handshake-ms', type=float, default=20, help='新規接続ごとに模擬する往復時間（ミリ秒、デフォルト: 20）')
+    args = parser.parse_args()
+
+    name, _, page = load_fixture_pages()[0]
+    server = BenchServer(('127.0.0.1', 0), page, args.handshake_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/pickup"
+
+    session = create_session()
+    cases = [
+        ('requests.get', lambda target: requests.get(target, headers={'Accept-Encoding': 'identity', 'Connection': 'close'}, timeout=30)),
+        ('requests.get (gzip)', lambda target: requests.get(target, headers={'Accept-Encoding': 'gzip'}, timeout=30)),
+        (f'pooled session ({ACCEPT_ENCODING})', lambda target: session.get(target, timeout=30)),
+    ]
+
+    print(f"ページ: {name}（{len(page.encode('utf-8'))}バイト）、{args.requests}リクエスト、ハンドシェイク {args.handshake_ms}ms")
+    print(f"{'case':<28} {'ms/request':>11} {'connections':>12} {'bytes/request':>14}")
+    results = {}
+    for label, fetch in cases:
+        elapsed, connections, sent = run(server, url, fetch, args.requests)
+        results[label] = elapsed
+        print(f"{label:<28} {elapsed / args.requests * 1000:>11.2f} {connections:>12} {sent // args.requests:>14}")
+    server.shutdown()
+
+    baseline = results[cases[0][0]]
+    pooled = results[cases[-1][0]]
+    print()
+    print(f"requests.getに対するプールされたSessionの速度: {baseline / pooled:.1f}倍")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""IO待ちのワーカーのプール（prefork / threads / gevent）のベンチマーク
+
+ローカルに応答の遅いモックサイトを立て、スケジュール実行と同じscrape_urlのタスクの本体を
+ワーカーのプールと同じ並行数で実行して、1プロセスで処理できるページ数と使用メモリを計測する。
+プールの種類ごとに別のプロセスで実行する（geventはプロセス全体にmonkey patchを当てるため）。
+
+- prefork: 1プロセスで1件ずつ処理する（Celeryのprefork。並行数を上げるにはその数のプロセスが要る）
+- threads: 1プロセスのスレッドのプールで並行に処理する（celery worker -P threads）
+- gevent: 1プロセスのグリーンスレッドで並行に処理する（celery worker -P gevent）
+
+結果のストア・URLのインデックス・HTTPキャッシュ・保存先（JSON Lines）は一時ディレクトリに作り、
+すべてのページが保存されたか（スレッドやグリーンスレッドで取りこぼしがないか）も確認する
+（ほぼ同じ内容のページは、保存先には参照だけが書かれ、結果のストアでは保存に数えない）。
+
+使い方:
+    python bench_io_worker.py [--urls 400] [--latency 0.2] [--concurrency 10 50 100 200]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PARAGRAPH = ('スキマバイトのアプリを運営する企業は、登録者数が前年の二倍を超えたと発表した。'
+             '飲食や物流の現場で短時間の仕事を探す人が増えており、企業は地方への展開を急いでいる。')
+
+def mock_page(path):
+    """パスごとに内容の異なる記事のページを返す（ほぼ同じ内容のページとして扱われないようにする）"""
+    number = path.strip('/').split('/')[-1]
+    paragraphs = ''.join(f"<p>記事{number}の{index}段落目。{PARAGRAPH}{number * (index + 1)}</p>" for index in range(8))
+    links = ''.join(f'<a href="/articles/{number}/{index}">関連記事{index}</a>' for index in range(5))
+    images = ''.join(f'<img src="/images/{number}/{index}.jpg" alt="画像{index}">' for index in range(3))
+    return (f"<html><head><title>記事 {number}</title><meta name=\"description\" content=\"記事{number}の説明\"></head>"
+            f"<body><article><h1>記事 {number}</h1>{paragraphs}{images}</article>{links}</body></html>")
+
+class MockHandler(BaseHTTPRequestHandler):
+    # keep-aliveの接続を使えるようにする
+    protocol_version = 'HTTP/1.1'
+    latency = 0.2
+
+    def do_GET(self):
+        if self.path == '/robots.txt':
+            body, status = b'', 404
+        else:
+            time.sleep(self.latency)
+            body, status = mock_page(self.path).encode('utf-8'), 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mock_site(latency):
+    """モックサイトを別スレッドで起動し、(サーバー, ベースURL)を返す"""
+    MockHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_worker(pool, concurrency, base_url, count, workdir):
+    """1つのプールでURLを取得し、結果をJSONで標準出力に書く（ベンチマークの子プロセス）"""
+    if pool == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    # 保存先とキャッシュを一時ディレクトリに作る（設定はimport時に読まれる）
+    os.environ.update({
+        'SCRAPER_SINK': 'jsonl',
+        'SCRAPER_SINK_COMPRESSION': 'none',
+        'SCRAPER_HTTP_CACHE_DIR': os.path.join(workdir, 'http'),
+        'SCRAPER_URL_INDEX_PATH': os.path.join(workdir, 'urls.sqlite3'),
+        'SCRAPER_NEAR_DUP_INDEX_PATH': os.path.join(workdir, 'fingerprints.sqlite3'),
+        'SCRAPER_NORMALIZED_CACHE_PATH': os.path.join(workdir, 'normalized.sqlite3'),
+        'SCRAPER_RESULT_STORE_PATH': os.path.join(workdir, 'results.sqlite3'),
+        'SCRAPER_HTTP_SESSION_POOL_SIZE': str(concurrency),
+        'SCRAPER_HTTP_POOL_MAXSIZE': str(concurrency),
+    })
+    import logging
+    import resource
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.disable(logging.CRITICAL)
+    import tasks
+    from http_client import session_pool
+    from result_store import result_store
+    from sinks import close_sinks, read_records
+
+    # ワーカーと同じように、タスクを並行に呼ぶ前にCeleryのアプリを確定しておく
+    tasks.app.finalize(auto=True)
+    output_dir = os.path.join(workdir, 'data')
+    urls = [f"{base_url}/articles/{number}" for number in range(count)]
+
+    def scrape(url):
+        return tasks.scrape_url(url, output_dir=output_dir, delay=0, sink='jsonl')
+
+    start = time.perf_counter()
+    if pool == 'gevent':
+        from gevent.pool import Pool
+        envelopes = list(Pool(concurrency).imap(scrape, urls))
+    elif pool == 'threads':
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            envelopes = list(executor.map(scrape, urls))
+    else:
+        envelopes = [scrape(url) for url in urls]
+    elapsed = time.perf_counter() - start
+
+    close_sinks()
+    result_store.flush()
+    statuses = {}
+    for envelope in envelopes:
+        statuses[envelope['status']] = statuses.get(envelope['status'], 0) + 1
+    print(json.dumps({
+        'elapsed': elapsed,
+        'statuses': statuses,
+        'stored': result_store.counts().get('saved', 0),
+        'sink_records': sum(1 for _ in read_records(output_dir)),
+        'sessions': session_pool.created,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+def measure(pool, concurrency, base_url, count):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', pool, '--base-url', base_url, '--urls', str(count),
+             '--workdir', workdir, '--concurrency', str(concurrency)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='IO待ちのワーカーのプールのベンチマーク')
+    parser.add_argument('--urls', '-n', type=int, default=400, help='取得するURL数（デフォルト: 400）')
+    parser.add_argument('--latency', type=float, default=0.2, help='モックサイトの応答時間（秒、デフォルト: 0.2）')
+    parser.add_argument('--concurrency', '-c', type=int, nargs='+', default=[10, 50, 100, 200], help='並行数（デフォルト: 10 50 100 200）')
+    parser.add_argument('--worker', choices=('prefork', 'threads', 'gevent'), help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.concurrency[0], args.base_url, args.urls, args.workdir)
+        return
+
+    server, base_url = start_mock_site(args.latency)
+    print(f"{args.urls}URL（応答 {args.latency}秒）")
+    print()
+    print(f"{'pool':<8} {'conc':>5} {'seconds':>8} {'pages/s':>8} {'RSS MB':>7} {'sessions':>8}  saved / near-dup / stored / sink")
+    # preforkは1プロセス（並行数1）の値。並行数cにはc個のプロセスとc倍のメモリが要る
+    runs = [('prefork', 1, max(1, args.urls // 10))]
+    runs += [(pool, concurrency, args.urls) for pool in ('threads', 'gevent') for concurrency in args.concurrency]
+    for pool, concurrency, count in runs:
+        try:
+            result = measure(pool, concurrency, base_url, count)
+        except subprocess.CalledProcessError as e:
+            print(f"{pool:<8} {concurrency:>5} 失敗: {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            continue
+        saved = result['statuses'].get('saved', 0)
+        near_duplicate = result['statuses'].get('near_duplicate', 0)
+        print(f"{pool:<8} {concurrency:>5} {result['elapsed']:>8.2f} {count / result['elapsed']:>8.1f} {result['max_rss_mb']:>7.0f} "
+              f"{result['sessions']:>8}  {saved} / {near_duplicate} / {result['stored']} / {result['sink_records']}")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""正規化テキストのキャッシュのベンチマーク
+
+app/dataに保存されたレコードを、新しいキーワードの式で再フィルタリングする時間を
+次の3通りで計測する（結果がすべて一致することも確認する）。
+
+- キャッシュなし: フィルタリングのたびにタイトル・説明・本文を正規化する（従来の動作）
+- 保存済み: 保存時に書き込んだ正規化テキストをSQLiteから読み込む（新しいプロセスでの再フィルタリング）
+- メモ: プロセス内のLRUから取り出す（同じプロセスでの繰り返しのフィルタリング）
+
+使い方:
+    python bench_normalize.py [--repeat 20]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+
+import normalizer
+from keyword_filter import KeywordFilter
+from normalizer import NormalizedTextCache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# 再フィルタリングに使うキーワードの式
+EXPRESSIONS = [
+    'タイミー',
+    'ﾀｲﾐｰ AND NOT 求人',
+    'メルカリ OR 楽天 OR ヤフー',
+    '(東京 OR 大阪) AND 株',
+    'スキマバイト, スポットワーク',
+    '政府 OR 総理 OR 国会',
+    'javascript',
+    '"ANN" | FNN | NNN',
+]
+
+def load_records():
+    """app/dataのJSONファイルからタイトル・説明・本文のあるレコードを読み込む"""
+    records = []
+    for filename in sorted(glob.glob(os.path.join(DATA_DIR, '*.json'))):
+        with open(filename, encoding='utf-8') as f:
+            record = json.load(f)
+        if isinstance(record, dict) and record.get('content'):
+            records.append(record)
+    return records
+
+def refilter(records, filters):
+    """すべてのレコードをすべての式でフィルタリングし、一致の結果を返す"""
+    return [keyword_filter.match(record) for keyword_filter in filters for record in records]
+
+def measure(records, filters, repeat, cache):
+    normalizer.normalized_text_cache = cache
+    results = refilter(records, filters)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        refilter(records, filters)
+    elapsed = time.perf_counter() - start
+    return results, elapsed / (repeat * len(records) * len(filters)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='正規化テキストのキャッシュのベンチマーク')
+    parser.add_argument('--repeat', '-r', type=int, default=20, help='繰り返し回数（デフォルト: 20）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    records = load_records()
+    filters = [KeywordFilter(expression) for expression in EXPRESSIONS]
+    characters = sum(len(record.get(field) or '') for record in records for field in normalizer.TEXT_FIELDS)
+    print(f"{len(records)}レコード（{characters}文字） x {len(filters)}式")
+    print()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'normalized.sqlite3')
+        # 保存時と同じように正規化テキストを書き込んでおく
+        writer = NormalizedTextCache(path)
+        for record in records:
+            writer.normalize_record(record)
+
+        expected, baseline = measure(records, filters, args.repeat, None)
+        # memo_size=0にして、毎回SQLiteから読み込む（新しいプロセスと同じ）
+        stored_results, stored = measure(records, filters, args.repeat, NormalizedTextCache(path, memo_size=0))
+        memo_results, memo = measure(records, filters, args.repeat, NormalizedTextCache(path))
+
+    mismatches = sum(1 for results in (stored_results, memo_results) if results != expected)
+    print(f"結果の不一致: {mismatches}件")
+    print()
+    print(f"{'mode':<10} {'ms/record/filter':>17} {'speedup':>8}")
+    for name, value in (('no cache', baseline), ('stored', stored), ('memo', memo)):
+        print(f"{name:<10} {value:>17.3f} {baseline / value:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""パーサーバックエンドのベンチマーク
+
+app/dataに保存されたスクレイピング結果からYahoo!ニュース風のHTMLページを再構成し、
+各バックエンドで抽出結果が一致することを確認したうえで、1ページあたりの
+解析時間と抽出時間を計測する。壊れたHTMLでのバックエンドごとの違いは、tests/test_parsers.pyで確かめる。
+
+使い方:
+    python bench_parsers.py [--repeat 20] [追加のHTMLファイル ...]
+"""
+import argparse
+import glob
+import html
+import json
+import logging
+import os
+import time
+
+from parsers import PARSER_BACKENDS, parse_html
+from extractor import extract_content
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def render_fixture_page(record, depth=12):
+    """保存済みレコードから、入れ子の深いニュースページ風のHTMLを作成する"""
+    esc = html.escape
+    links = record.get('links', [])
+    images = record.get('images', [])
+    half = len(links) // 2
+
+    # 本文を「。」ごとに段落へ分ける
+    sentences = [s + '。' for s in record.get('content', '').split('。') if s]
+    paragraphs = [''.join(sentences[i:i + 3]) for i in range(0, len(sentences), 3)]
+
+    parts = ['<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">',
+             f'<title>{esc(record.get("title", ""))}</title>',
+             f'<meta name="description" content="{esc(record.get("description", ""))}">']
+    if images:
+        parts.append(f'<meta property="og:image" content="{esc(images[0])}">')
+    parts.append('</head><body><div id="wrapper">')
+    parts.append('<header><nav><ul>')
+    for link in links[:half]:
+        parts.append(f'<li><a href="{esc(link)}">{esc(link.rstrip("/").rsplit("/", 1)[-1])}</a></li>')
+    parts.append('</ul></nav></header>')
+    parts.append('<div class="layout">' * depth)
+    parts.append('<main><article><div class="article_body">')
+    for paragraph in paragraphs:
+        parts.append(f'<p>{esc(paragraph)}</p>')
+    for image in images[1:]:
+        parts.append(f'<figure><img src="{esc(image)}" alt="画像"></figure>')
+    parts.append('</div></article></main>')
+    parts.append('<aside><section><ul>')
+    for link in links[half:]:
+        parts.append(f'<li><a href="{esc(link)}"><span>{esc(link.rstrip("/").rsplit("/", 1)[-1])}</span></a></li>')
+    parts.append('</ul></section></aside>')
+    parts.append('</div>' * depth)
+    parts.append('<footer><p>© LY Corporation</p></footer></div></body></html>')
+    return ''.join(parts)
+
+def load_fixture_pages(extra_files=()):
+    """app/dataのJSONから再構成したページと、追加のHTMLファイルを読み込む"""
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(DATA_DIR, '*.json'))):
+        with open(filename, encoding='utf-8') as f:
+            record = json.load(f)
+        pages.append((os.path.basename(filename), record.get('url', 'https://news.yahoo.co.jp/'), render_fixture_page(record)))
+    for filename in extra_files:
+        with open(filename, encoding='utf-8', errors='replace') as f:
+            pages.append((os.path.basename(filename), 'https://example.com/', f.read()))
+    return pages
+
+def main():
+    parser = argparse.ArgumentParser(description='パーサーバックエンドのベンチマーク')
+    parser.add_argument('files', nargs='*', help='追加で計測するHTMLファイル')
+    parser.add_argument('--repeat', '-r', type=int, default=20, help='1ページあたりの繰り返し回数（デフォルト: 20）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    pages = load_fixture_pages(args.files)
+
+    # 抽出結果がすべてのバックエンドで一致することを確認
+    mismatches = 0
+    for name, url, page in pages:
+        expected = extract_content(parse_html(page, 'html.parser'), url)
+        for backend in PARSER_BACKENDS[1:]:
+            if extract_content(parse_html(page, backend), url) != expected:
+                mismatches += 1
+                print(f"❌ 抽出結果が一致しません: {name} ({backend})")
+    print(f"{len(pages)}ページ x {len(PARSER_BACKENDS)}バックエンドを比較: 不一致 {mismatches}件")
+    print()
+
+    print(f"{'backend':<12} {'parse ms/page':>14} {'extract ms/page':>16} {'total ms/page':>14}")
+    for backend in PARSER_BACKENDS:
+        parse_time = 0.0
+        extract_time = 0.0
+        for _ in range(args.repeat):
+            for name, url, page in pages:
+                start = time.perf_counter()
+                document = parse_html(page, backend)
+                parsed = time.perf_counter()
+                extract_content(document, url)
+                parse_time += parsed - start
+                extract_time += time.perf_counter() - parsed
+        count = args.repeat * len(pages)
+        print(f"{backend:<12} {parse_time / count * 1000:>14.2f} {extract_time / count * 1000:>16.2f} {(parse_time + extract_time) / count * 1000:>14.2f}")
+
+if __name__ == '__main__':
+    main()
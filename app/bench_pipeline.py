@@ -0,0 +1,99 @@
+"""取得と解析を分けたパイプラインのベンチマーク
+
+ローカルのモックサイト（bench_io_worker.pyと同じ）から同じURLを取得して保存し、次を比べる。
+
+- async: AsyncFetcherで取得し、解析と保存をスレッドで行う（SCRAPER_FETCH_ENGINE=async）
+- pipeline N: 取得したページを解析のワーカーN個のプロセスで解析し、保存はこのプロセスで行う（SCRAPER_FETCH_ENGINE=pipeline）
+
+方式ごとに一時ディレクトリを使う別のプロセスで実行し、1秒あたりのページ数と、
+すべてのページが保存されたかを表示する。解析のワーカーの起動は計測に含めない。
+
+使い方:
+    python bench_pipeline.py [--urls 400] [--latency 0.05] [--concurrency 50] [--workers 1 2 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_io_worker import start_mock_site
+
+def run_mode(mode, workers, base_url, count, concurrency, queue_size, workdir):
+    """1つの方式でURLを取得し、結果をJSONで標準出力に書く（ベンチマークの子プロセス）"""
+    os.environ.update({
+        'SCRAPER_SINK': 'jsonl',
+        'SCRAPER_SINK_COMPRESSION': 'none',
+        'SCRAPER_URL_INDEX_PATH': os.path.join(workdir, 'urls.sqlite3'),
+        'SCRAPER_NEAR_DUP_INDEX_PATH': os.path.join(workdir, 'fingerprints.sqlite3'),
+        'SCRAPER_NORMALIZED_CACHE_PATH': os.path.join(workdir, 'normalized.sqlite3'),
+        'SCRAPER_RESULT_STORE_PATH': os.path.join(workdir, 'results.sqlite3'),
+    })
+    import logging
+
+    logging.disable(logging.CRITICAL)
+    import tasks
+    from sinks import close_sinks, read_records
+
+    output_dir = os.path.join(workdir, 'data')
+    urls = [f"{base_url}/articles/{number}" for number in range(count)]
+    fetch = tasks.page_fetcher(output_dir, sink='jsonl', pipeline=mode == 'pipeline', concurrency=concurrency, per_host=concurrency,
+                               use_cache=False, **({'workers': workers, 'queue_size': queue_size} if mode == 'pipeline' else {}))
+    if mode == 'pipeline':
+        # 解析のワーカーの起動（モジュールのimportを含む）は1度だけなので、計測から除く
+        from pipeline import get_parse_executor, parse_workers
+        executor = get_parse_executor(workers)
+        list(executor.map(parse_workers, [1] * (workers * 4)))
+
+    start = time.perf_counter()
+    results = fetch(urls)
+    elapsed = time.perf_counter() - start
+    close_sinks()
+    if mode == 'pipeline':
+        executor.shutdown(wait=True)
+    print(json.dumps({
+        'elapsed': elapsed,
+        'pages': sum(1 for result in results if result),
+        'sink_records': sum(1 for _ in read_records(output_dir)),
+    }))
+
+def measure(mode, workers, args, base_url):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', mode, '--workers', str(workers), '--base-url', base_url,
+             '--urls', str(args.urls), '--concurrency', str(args.concurrency), '--queue-size', str(args.queue_size), '--workdir', workdir],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='取得と解析を分けたパイプラインのベンチマーク')
+    parser.add_argument('--urls', '-n', type=int, default=400, help='取得するURL数（デフォルト: 400）')
+    parser.add_argument('--latency', type=float, default=0.05, help='モックサイトの応答時間（秒、デフォルト: 0.05）')
+    parser.add_argument('--concurrency', '-c', type=int, default=50, help='同時接続数（デフォルト: 50）')
+    parser.add_argument('--queue-size', type=int, default=64, help='解析を待つキューの長さ（デフォルト: 64）')
+    parser.add_argument('--workers', '-w', type=int, nargs='+', default=[1, 2, 4], help='解析のワーカー数（デフォルト: 1 2 4）')
+    parser.add_argument('--run', choices=('async', 'pipeline'), help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args.run, args.workers[0], args.base_url, args.urls, args.concurrency, args.queue_size, args.workdir)
+        return
+
+    server, base_url = start_mock_site(args.latency)
+    print(f"{args.urls}URL（応答 {args.latency}秒、同時接続 {args.concurrency}、CPU {os.cpu_count()}コア）")
+    print()
+    print(f"{'mode':<12} {'seconds':>8} {'pages/s':>8}   pages / sink")
+    for mode, workers in [('async', 0)] + [('pipeline', workers) for workers in args.workers]:
+        name = mode if mode == 'async' else f"pipeline {workers}"
+        result = measure(mode, workers, args, base_url)
+        print(f"{name:<12} {result['elapsed']:>8.2f} {args.urls / result['elapsed']:>8.1f}  "
+              f"{result['pages']} / {result['sink_records']}")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
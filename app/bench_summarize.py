@@ -0,0 +1,74 @@
+"""要約の並行処理のベンチマーク（APIを呼ばない負荷試験）
+
+FakeSummaryClient（応答にlatency秒かかる偽のクライアント）で、次の場合の要約の速さを計測する。
+
+- sequential: 1件ずつ要約する（従来の動作）
+- concurrent: concurrency件を並行に要約する
+- rpm limit: 並行に要約し、1分あたりのリクエスト数をrpm回に制限する
+- 429: 並行に要約し、一部のリクエストに429（リクエスト過多）を返す（再試行してすべて要約できることを確認する）
+- local: APIを使わない抽出型の要約（SCRAPER_SUMMARY_ENGINE=local）
+- auto: 抽出型の要約で本文を表せないページだけを偽のクライアントで要約する（SCRAPER_SUMMARY_ENGINE=auto）
+
+使い方:
+    python bench_summarize.py [--records 40] [--latency 0.5] [--concurrency 8] [--rpm 240] [--rate-limited 0.1]
+"""
+import argparse
+import logging
+import time
+
+import summarizer
+from summarizer import FakeSummaryClient, summarize_records
+
+# 本文の文の材料（ページごとに話題の数を変え、抽出型の要約で表しやすいページと表しにくいページを作る）
+TOPICS = ['政府は新しい経済対策を発表した', '大阪・関西万博の会場で準備が進んでいる', 'スキマバイトの利用者が増えている',
+          '電気とガスの料金が来月から値上げされる', 'プロ野球の開幕戦が各地で行われた', '新しいスマートフォンが発売された',
+          '桜の開花が全国で平年より早まっている', '円相場が一時大きく値下がりした']
+
+def make_records(count):
+    records = []
+    for index in range(count):
+        topics = TOPICS[:1 + index % len(TOPICS)]
+        sentences = [f"{topics[number % len(topics)]}と{number + 1}日に報じられた。" for number in range(30)]
+        records.append({'url': f"https://example.com/news/{index}", 'title': f"ニュース {index}", 'description': '説明',
+                        'content': ''.join(sentences)})
+    return records
+
+def measure(records, latency, concurrency, rpm, rate_limit_rate=0.0, engine='gemini'):
+    client = FakeSummaryClient(latency=latency, rate_limit_rate=rate_limit_rate)
+    start = time.perf_counter()
+    summaries = summarize_records(records, None, concurrency=concurrency, client=client, rpm=rpm, engine=engine)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for summary in summaries if not summary)
+    return elapsed, client.calls, client.rate_limited, failed
+
+def main():
+    parser = argparse.ArgumentParser(description='要約の並行処理のベンチマーク')
+    parser.add_argument('--records', '-n', type=int, default=40, help='要約するレコード数（デフォルト: 40）')
+    parser.add_argument('--latency', type=float, default=0.5, help='偽のクライアントの応答時間（秒、デフォルト: 0.5）')
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='並行数（デフォルト: 8）')
+    parser.add_argument('--rpm', type=float, default=240, help='rpm limitの1分あたりのリクエスト数（デフォルト: 240）')
+    parser.add_argument('--rate-limited', type=float, default=0.1, help='429を返す割合（デフォルト: 0.1）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    # キャッシュから返すと計測にならないため、要約のキャッシュは使わない
+    summarizer.summary_cache = None
+    records = make_records(args.records)
+    print(f"{args.records}レコード、応答時間 {args.latency}秒、並行数 {args.concurrency}")
+    print()
+
+    scenarios = (
+        ('sequential', 1, 0, 0.0, 'gemini'),
+        ('concurrent', args.concurrency, 0, 0.0, 'gemini'),
+        (f"rpm {args.rpm:g}", args.concurrency, args.rpm, 0.0, 'gemini'),
+        (f"429 {args.rate_limited:.0%}", args.concurrency, 0, args.rate_limited, 'gemini'),
+        ('local', 1, 0, 0.0, 'local'),
+        ('auto', args.concurrency, 0, 0.0, 'auto'),
+    )
+    print(f"{'mode':<12} {'seconds':>8} {'records/s':>10} {'calls':>6} {'429':>5} {'failed':>7}")
+    for name, concurrency, rpm, rate_limit_rate, engine in scenarios:
+        elapsed, calls, rate_limited, failed = measure(records, args.latency, concurrency, rpm, rate_limit_rate, engine)
+        print(f"{name:<12} {elapsed:>8.2f} {len(records) / elapsed:>10.1f} {calls:>6} {rate_limited:>5} {failed:>7}")
+
+if __name__ == '__main__':
+    main()
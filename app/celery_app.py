@@ -1,5 +1,7 @@
 from celery import Celery
-from config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, DEFAULT_SCHEDULE
+from celery_serializers import resolve_serializer
+from config import (CELERY_BROKER_URL, CELERY_RESULT_BACKEND, DEFAULT_SCHEDULE, SUMMARY_QUEUE, CELERY_RESULT_SERIALIZER,
+                    CELERY_TASK_SERIALIZER, CELERY_RESULT_EXPIRES, CELERY_PREFETCH_MULTIPLIER, CELERY_ACKS_LATE)
 
 app = Celery('crawler',
              broker=CELERY_BROKER_URL,
@@ -13,5 +15,25 @@ app.conf.beat_schedule = {
 
 app.conf.timezone = 'Asia/Tokyo'
 
+# タスクの結果は小さな要約（tasks.result_envelope）にし、圧縮して一定時間で消す（Redisのメモリを増やし続けない）
+result_serializer = resolve_serializer(CELERY_RESULT_SERIALIZER)
+task_serializer = resolve_serializer(CELERY_TASK_SERIALIZER)
+app.conf.result_serializer = result_serializer
+app.conf.task_serializer = task_serializer
+app.conf.accept_content = sorted({'json', task_serializer})
+app.conf.result_accept_content = sorted({'json', result_serializer})
+app.conf.result_expires = CELERY_RESULT_EXPIRES
+
+# 先に受け取るタスク数と確認応答のタイミング（IO待ちのワーカーの設定はdocker-compose.ymlのcelery_io_workerを参照）
+# 完了後に確認応答する場合は、ワーカーが異常終了したタスクを別のワーカーで再実行する
+app.conf.worker_prefetch_multiplier = CELERY_PREFETCH_MULTIPLIER
+app.conf.task_acks_late = CELERY_ACKS_LATE
+app.conf.task_reject_on_worker_lost = CELERY_ACKS_LATE
+
+# 要約は取得とは別のキューで処理する（要約のAPIの応答を待つ間も取得のワーカーを止めない）
+app.conf.task_routes = {
+    'tasks.summarize_batch': {'queue': SUMMARY_QUEUE},
+}
+
 if __name__ == '__main__':
     app.start()
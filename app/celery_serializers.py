@@ -0,0 +1,39 @@
+"""Celeryのメッセージとタスクの結果のシリアライザ
+
+msgpack-zlib: msgpackでエンコードしてzlibで圧縮する（JSONより小さく、Redisの結果のバックエンドのメモリを節約する）。
+CELERY_RESULT_SERIALIZER / CELERY_TASK_SERIALIZERにmsgpack-zlibを指定すると使われる。
+"""
+import logging
+import zlib
+
+MSGPACK_ZLIB = 'msgpack-zlib'
+MSGPACK_ZLIB_CONTENT_TYPE = 'application/x-msgpack-zlib'
+
+# zlibの圧縮レベル（zlibの標準）
+COMPRESSION_LEVEL = 6
+
+def register_msgpack_zlib():
+    """msgpack-zlibのシリアライザをkombuに登録する（msgpackがなければFalse）"""
+    try:
+        import msgpack
+    except ImportError:
+        logging.warning("msgpackパッケージがインストールされていません。Celeryの結果はJSONでシリアライズします。")
+        return False
+    from kombu.serialization import register
+
+    def dumps(value):
+        return zlib.compress(msgpack.packb(value, use_bin_type=True), COMPRESSION_LEVEL)
+
+    def loads(data):
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        return msgpack.unpackb(zlib.decompress(data), raw=False)
+
+    register(MSGPACK_ZLIB, dumps, loads, content_type=MSGPACK_ZLIB_CONTENT_TYPE, content_encoding='binary')
+    return True
+
+def resolve_serializer(name):
+    """シリアライザの名前を返す（msgpack-zlibが使えなければjson）"""
+    if name == MSGPACK_ZLIB and not register_msgpack_zlib():
+        return 'json'
+    return name
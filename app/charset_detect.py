@@ -0,0 +1,208 @@
+"""取得したページの文字コードの判定とデコード
+
+次の順に文字コードを決め、本文を1度だけデコードする。
+
+1. HTTPヘッダー（Content-Typeのcharset）
+2. BOM（UTF-8 / UTF-16）
+3. 先頭CHARSET_SNIFF_BYTESバイトの<meta charset>・<meta http-equiv="Content-Type">
+4. 先頭CHARSET_DETECT_BYTESバイトがUTF-8として正しければUTF-8
+   （Shift_JISのキャッシュより先に確かめる。UTF-8の日本語はCP932としてもデコードできてしまうことが多い）
+5. 同じホストで前回判定した文字コード（先頭が正しくデコードできる場合だけ使う）
+6. 先頭CHARSET_DETECT_BYTESバイトだけでの判定（cchardet（faust-cchardet）、なければcharset_normalizer / chardet。
+   判定できなければ、EUC-JP・CP932の順に正しくデコードできるものを使う）
+
+Shift_JISはブラウザと同じくCP932（Windows-31J）として、ISO-8859-1・US-ASCIIはWindows-1252としてデコードする
+（機種依存文字やスマートクォートが化けないようにする）。
+"""
+import codecs
+import logging
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from config import CHARSET_SNIFF_BYTES, CHARSET_DETECT_BYTES, CHARSET_HOST_CACHE_SIZE
+
+# 判定の方法（charset_sourceの戻り値）
+SOURCE_HEADER = 'header'
+SOURCE_BOM = 'bom'
+SOURCE_META = 'meta'
+SOURCE_HOST_CACHE = 'host_cache'
+SOURCE_DETECTED = 'detected'
+
+# ブラウザと同じデコードにする文字コードの別名
+CHARSET_ALIASES = {
+    'shift_jis': 'cp932', 'shift-jis': 'cp932', 'sjis': 'cp932', 'x-sjis': 'cp932', 'ms_kanji': 'cp932',
+    'csshiftjis': 'cp932', 'windows-31j': 'cp932', 'x-euc-jp': 'euc_jp',
+    'iso-8859-1': 'cp1252', 'latin1': 'cp1252', 'latin-1': 'cp1252', 'us-ascii': 'cp1252', 'ascii': 'cp1252',
+}
+
+# 判定器が判定できなかった場合に試す文字コード（Shift_JISのバイト列はEUC-JPとしては
+# ほとんどデコードできないが、逆はできてしまうことがあるため、EUC-JPを先に試す）
+FALLBACK_CHARSETS = ('euc_jp', 'cp932')
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# <meta charset="...">と<meta http-equiv="Content-Type" content="text/html; charset=...">の両方に一致する
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([A-Za-z0-9_:.+-]+)', re.IGNORECASE)
+
+def normalize_charset(name):
+    """文字コード名をPythonのコーデック名にする（未知の名前はNone）"""
+    if not name:
+        return None
+    if isinstance(name, bytes):
+        name = name.decode('ascii', errors='ignore')
+    name = name.strip().strip('"\'').lower()
+    name = CHARSET_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def header_charset(content_type):
+    """Content-Typeのcharsetを返す（なければNone。requestsのようにISO-8859-1とはみなさない）"""
+    for parameter in (content_type or '').split(';')[1:]:
+        key, _, value = parameter.partition('=')
+        if key.strip().lower() == 'charset':
+            return normalize_charset(value)
+    return None
+
+def bom_charset(body):
+    """BOMから文字コードを返す（BOMがなければNone）"""
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding
+    return None
+
+def meta_charset(body, sniff_bytes=CHARSET_SNIFF_BYTES):
+    """先頭sniff_bytesバイトの<meta>から文字コードを返す（なければNone）"""
+    match = META_CHARSET_PATTERN.search(body, 0, sniff_bytes)
+    if not match:
+        return None
+    encoding = normalize_charset(match.group(1))
+    # ASCIIと互換のない文字コードは<meta>を読めた時点で誤りなので、UTF-8とみなす（HTMLの仕様と同じ）
+    if encoding and encoding.startswith('utf_16'):
+        return 'utf-8'
+    return encoding
+
+def decodes_as(prefix, encoding):
+    """先頭のバイト列がencodingで正しくデコードできるか（末尾で切れた1文字は許す）"""
+    try:
+        prefix.decode(encoding)
+        return True
+    except UnicodeDecodeError as e:
+        return e.end >= len(prefix) and e.reason in ('unexpected end of data', 'incomplete multibyte sequence')
+    except LookupError:
+        return False
+
+_detector = None
+
+def _get_detector():
+    """文字コードの判定器を返す（cchardetがなければrequestsと同じcharset_normalizer / chardet）"""
+    global _detector
+    if _detector is None:
+        try:
+            import cchardet
+            _detector = cchardet.detect
+        except ImportError:
+            logging.info("cchardetパッケージがインストールされていません。文字コードの判定にはcharset_normalizer / chardetを使用します。")
+            from requests.compat import chardet
+            _detector = chardet.detect
+    return _detector
+
+def detect_charset(body, detect_bytes=CHARSET_DETECT_BYTES):
+    """先頭detect_bytesバイトだけを判定器に渡して文字コードを判定する（判定できなければUTF-8）"""
+    prefix = body[:detect_bytes]
+    if len(body) > detect_bytes:
+        # 途中で切れた1文字で判定器が誤らないよう、最後の「<」の前で切る
+        # （「<」はShift_JIS・EUC-JPの2バイト目には現れない）
+        cut = prefix.rfind(b'<')
+        if cut > 0:
+            prefix = prefix[:cut]
+    encoding = normalize_charset(_get_detector()(prefix).get('encoding'))
+    if encoding:
+        return encoding
+    # 判定器が判定できなかった場合（ASCIIの多いページ）は、日本語の文字コードで正しくデコードできるかを確かめる
+    return next((encoding for encoding in FALLBACK_CHARSETS if decodes_as(prefix, encoding)), 'utf-8')
+
+class HostCharsetCache:
+    """ホストごとに判定した文字コードのLRUキャッシュ
+
+    ヘッダーにも<meta>にも文字コードがないサイトは同じ文字コードのページが続くことが多いため、
+    判定した文字コードを覚えておき、次のページは先頭が正しくデコードできればそれを使う（判定器を呼ばない）。
+    """
+
+    def __init__(self, maxsize=CHARSET_HOST_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # ホスト -> 文字コード
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host, prefix):
+        """ホストの文字コードを返す（キャッシュになければ、またはprefixを正しくデコードできなければNone）"""
+        with self._lock:
+            encoding = self._entries.get(host)
+            if encoding is not None:
+                self._entries.move_to_end(host)
+        if encoding is not None and decodes_as(prefix, encoding):
+            with self._lock:
+                self.hits += 1
+            return encoding
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, host, encoding):
+        with self._lock:
+            self._entries[host] = encoding
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'hosts': len(self._entries)}
+
+# プロセスで共有するキャッシュ（SCRAPER_CHARSET_HOST_CACHE_SIZE=0で無効）
+host_charsets = HostCharsetCache() if CHARSET_HOST_CACHE_SIZE > 0 else None
+
+def charset_source(body, declared=None, url=None):
+    """本文の文字コードと、その判定の方法を(文字コード, 方法)で返す
+
+    declaredはContent-Typeのcharset（header_charsetの戻り値かaiohttpのresponse.charset）。
+    urlを渡すと、判定した文字コードをホストごとにキャッシュする。
+    """
+    encoding = normalize_charset(declared)
+    if encoding:
+        return encoding, SOURCE_HEADER
+    encoding = bom_charset(body)
+    if encoding:
+        return encoding, SOURCE_BOM
+    encoding = meta_charset(body)
+    if encoding:
+        return encoding, SOURCE_META
+
+    # 多くのページはUTF-8なので、判定器の前にUTF-8として正しいかを確かめる（ASCIIだけの場合もUTF-8）
+    prefix = body[:CHARSET_DETECT_BYTES]
+    if decodes_as(prefix, 'utf-8'):
+        return 'utf-8', SOURCE_DETECTED
+
+    host = urlparse(url).netloc.lower() if url and host_charsets else None
+    if host:
+        encoding = host_charsets.get(host, prefix)
+        if encoding:
+            return encoding, SOURCE_HOST_CACHE
+    encoding = detect_charset(prefix)
+    if host:
+        host_charsets.store(host, encoding)
+    return encoding, SOURCE_DETECTED
+
+def decode_html(body, declared=None, url=None):
+    """本文の文字コードを判定し、1度だけデコードした文字列を返す"""
+    encoding, _ = charset_source(body, declared, url)
+    return body.decode(encoding, errors='replace')
@@ -3,6 +3,17 @@ import os
 # Celery設定
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
+# タスクの結果とメッセージのシリアライザ（json / msgpack-zlib: msgpackをzlibで圧縮）
+# msgpack-zlibの結果はcelery_serializersを読み込んだプロセスでしか読めないため、デフォルトはjson
+# （結果を読むすべてのサービス（ワーカー・Web UI）で同じ値にする。docker-compose.ymlを参照）
+CELERY_RESULT_SERIALIZER = os.environ.get('CELERY_RESULT_SERIALIZER', 'json')
+CELERY_TASK_SERIALIZER = os.environ.get('CELERY_TASK_SERIALIZER', 'json')
+# タスクの結果を結果のバックエンドに残す秒数（結果は保存先と結果のストアにもあるため、短くてよい）
+CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', str(60 * 60)))
+# ワーカーが先に受け取っておくタスク数（並行数あたり） / タスクの完了後に確認応答するか
+# IO待ちのワーカー（gevent / eventlet / threadsのプール）では1にして、並行数より多くのタスクを抱え込まないようにする
+CELERY_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', '4'))
+CELERY_ACKS_LATE = os.environ.get('CELERY_ACKS_LATE', 'false').lower() == 'true'
 
 # スクレイピング設定
 DEFAULT_URLS = [
@@ -31,3 +42,152 @@ DEFAULT_SCHEDULE = {
         'summarize': False,
     }
 }
+
+# HTMLパーサーのバックエンド（html.parser / lxml / selectolax）
+PARSER_BACKEND = os.environ.get('SCRAPER_PARSER', 'html.parser')
+
+# 一括取得の方式（celery: URLごとにタスクを作成 / async: 1つのタスクで非同期に並行取得 /
+#                pipeline: asyncの取得と、プロセスのプールでの解析を分けたパイプライン）
+FETCH_ENGINE = os.environ.get('SCRAPER_FETCH_ENGINE', 'celery')
+
+# スケジュール実行で1つのタスク（チャンク）にまとめて取得するURL数（celeryの場合）
+SCRAPE_CHUNK_SIZE = int(os.environ.get('SCRAPER_CHUNK_SIZE', '10'))
+
+# 非同期取得の同時接続数（全体 / ホストごと）
+FETCH_CONCURRENCY = int(os.environ.get('SCRAPER_FETCH_CONCURRENCY', '20'))
+FETCH_PER_HOST = int(os.environ.get('SCRAPER_FETCH_PER_HOST', '2'))
+
+# 取得と解析を分けたパイプライン（解析のプロセス数（0はCPU数） / 取得したページを解析まで待たせるキューの長さ /
+# 保存のスレッド数 / 解析のプロセスの起動方式（spawn / forkserver / fork））
+PIPELINE_PARSE_WORKERS = int(os.environ.get('SCRAPER_PIPELINE_PARSE_WORKERS', '0'))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('SCRAPER_PIPELINE_QUEUE_SIZE', '64'))
+PIPELINE_STORE_WORKERS = int(os.environ.get('SCRAPER_PIPELINE_STORE_WORKERS', '2'))
+PIPELINE_START_METHOD = os.environ.get('SCRAPER_PIPELINE_START_METHOD', 'spawn')
+
+# ページの取得の上限（本文の最大バイト数 / 超えた場合の扱い（truncate: 先頭だけを解析 / skip: 取得をやめる） /
+# 接続と1回の読み込みのタイムアウト（秒） / リクエスト全体の期限（秒））
+FETCH_MAX_BYTES = int(os.environ.get('SCRAPER_FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+FETCH_OVERSIZE = os.environ.get('SCRAPER_FETCH_OVERSIZE', 'truncate')
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('SCRAPER_FETCH_CONNECT_TIMEOUT', '10'))
+FETCH_READ_TIMEOUT = float(os.environ.get('SCRAPER_FETCH_READ_TIMEOUT', '30'))
+FETCH_DEADLINE = float(os.environ.get('SCRAPER_FETCH_DEADLINE', '60'))
+
+# 文字コードの判定（<meta>を探す先頭のバイト数 / 判定器に渡す先頭のバイト数 / 判定した文字コードを覚えるホスト数（0で無効））
+CHARSET_SNIFF_BYTES = int(os.environ.get('SCRAPER_CHARSET_SNIFF_BYTES', '4096'))
+CHARSET_DETECT_BYTES = int(os.environ.get('SCRAPER_CHARSET_DETECT_BYTES', '16384'))
+CHARSET_HOST_CACHE_SIZE = int(os.environ.get('SCRAPER_CHARSET_HOST_CACHE_SIZE', '1024'))
+
+# robots.txtキャッシュ（ホスト数の上限 / 有効期間（秒） / エラー時の有効期間（秒） / 共有用Redis）
+ROBOTS_CACHE_SIZE = int(os.environ.get('SCRAPER_ROBOTS_CACHE_SIZE', '1024'))
+ROBOTS_CACHE_TTL = int(os.environ.get('SCRAPER_ROBOTS_CACHE_TTL', str(60 * 60)))
+ROBOTS_CACHE_NEGATIVE_TTL = int(os.environ.get('SCRAPER_ROBOTS_CACHE_NEGATIVE_TTL', '300'))
+ROBOTS_CACHE_REDIS_URL = os.environ.get('SCRAPER_ROBOTS_CACHE_REDIS_URL')
+
+# HTTPコネクションプール（保持するホスト数 / ホストごとの接続数）
+HTTP_POOL_CONNECTIONS = int(os.environ.get('SCRAPER_HTTP_POOL_CONNECTIONS', '32'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('SCRAPER_HTTP_POOL_MAXSIZE', '4'))
+# 使い終わったSessionをプールに残す数（スレッドやグリーンスレッドの並行数に合わせる）
+HTTP_SESSION_POOL_SIZE = int(os.environ.get('SCRAPER_HTTP_SESSION_POOL_SIZE', '32'))
+
+# 条件付きGET用のHTTPキャッシュ（ETag/Last-Modifiedを保存して、更新のないページの処理を省略する）
+HTTP_CACHE_ENABLED = os.environ.get('SCRAPER_HTTP_CACHE', 'true').lower() == 'true'
+HTTP_CACHE_DIR = os.environ.get('SCRAPER_HTTP_CACHE_DIR', 'cache/http')
+
+# ドメインごとのレート制限（トークンバケットの最大トークン数 / 共有用Redis / タスク内で待機する最大秒数）
+# 待ち時間がRATE_LIMIT_MAX_SLEEPを超える場合、Celeryタスクは待機せずにその時間後に再実行される
+RATE_LIMIT_BURST = int(os.environ.get('SCRAPER_RATE_LIMIT_BURST', '1'))
+RATE_LIMIT_REDIS_URL = os.environ.get('SCRAPER_RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_MAX_SLEEP = float(os.environ.get('SCRAPER_RATE_LIMIT_MAX_SLEEP', '0.5'))
+
+# リンクをたどるクロール（最大の深さ / 取得するページ数の上限 / 1回にまとめて取得するURL数）
+CRAWL_MAX_DEPTH = int(os.environ.get('SCRAPER_CRAWL_MAX_DEPTH', '1'))
+CRAWL_MAX_PAGES = int(os.environ.get('SCRAPER_CRAWL_MAX_PAGES', '100'))
+CRAWL_BATCH_SIZE = int(os.environ.get('SCRAPER_CRAWL_BATCH_SIZE', '100'))
+# 取得済みURLを記録するBloomフィルタ（想定URL数 / 偽陽性率）
+CRAWL_SEEN_CAPACITY = int(os.environ.get('SCRAPER_CRAWL_SEEN_CAPACITY', '1000000'))
+CRAWL_SEEN_ERROR_RATE = float(os.environ.get('SCRAPER_CRAWL_SEEN_ERROR_RATE', '0.001'))
+
+# URLの正規化と重複排除のインデックス（正規化したURL -> 最終取得時刻）
+# 最終取得からURL_INDEX_REFETCH_AFTER秒以内のURLはスケジュール実行・クロールで取得しない
+URL_INDEX_ENABLED = os.environ.get('SCRAPER_URL_INDEX', 'true').lower() == 'true'
+URL_INDEX_PATH = os.environ.get('SCRAPER_URL_INDEX_PATH', 'cache/urls.sqlite3')
+URL_INDEX_REFETCH_AFTER = int(os.environ.get('SCRAPER_URL_INDEX_REFETCH_AFTER', str(30 * 60)))
+# 正規化で取り除くトラッキング用のクエリパラメータ（末尾が*のものは前方一致）
+URL_TRACKING_PARAMS = os.environ.get(
+    'SCRAPER_URL_TRACKING_PARAMS',
+    'utm_*,fbclid,gclid,dclid,msclkid,yclid,mc_cid,mc_eid,igshid,_ga,_gl'
+).split(',')
+
+# ほぼ同じ内容のスナップショットの検出（SimHash、ドメインごとの指紋インデックス）
+# off: 検出しない（デフォルト。従来どおりすべて保存する） / reference: 全体を保存せず、元のファイルへの参照だけを保存する / skip: 保存しない
+NEAR_DUP_MODE = os.environ.get('SCRAPER_NEAR_DUP', 'off').lower()
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get('SCRAPER_NEAR_DUP_MAX_DISTANCE', '6'))  # 同じURLの前回とのハミング距離（64ビット中）
+NEAR_DUP_WINDOW = int(os.environ.get('SCRAPER_NEAR_DUP_WINDOW', '24'))  # URLごとに比較する直近のスナップショット数
+NEAR_DUP_INDEX_PATH = os.environ.get('SCRAPER_NEAR_DUP_INDEX_PATH', 'cache/fingerprints.sqlite3')
+
+# 保存先（files: ページごとのJSON+CSV（従来の形式） / jsonl: 圧縮したJSON Linesのセグメントにまとめて追記 /
+#        parquet: ドメインと日付で分割したParquet）
+STORAGE_SINK = os.environ.get('SCRAPER_SINK', 'files').lower()
+# JSON Linesの書き込み（まとめて書き込む件数 / 書き込みの間隔（秒） / セグメントを切り替えるサイズ（バイト）と経過時間（秒） / 圧縮形式）
+SINK_BATCH_SIZE = int(os.environ.get('SCRAPER_SINK_BATCH_SIZE', '100'))
+SINK_FLUSH_INTERVAL = float(os.environ.get('SCRAPER_SINK_FLUSH_INTERVAL', '1'))
+SINK_SEGMENT_BYTES = int(os.environ.get('SCRAPER_SINK_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+SINK_SEGMENT_SECONDS = int(os.environ.get('SCRAPER_SINK_SEGMENT_SECONDS', str(60 * 60)))
+SINK_COMPRESSION = os.environ.get('SCRAPER_SINK_COMPRESSION', 'zstd').lower()  # zstd / gzip / none
+
+# Parquetの保存先（出力ディレクトリの下のディレクトリ名 / まとめて書き込む件数）
+PARQUET_DIR = os.environ.get('SCRAPER_PARQUET_DIR', 'parquet')
+PARQUET_BATCH_SIZE = int(os.environ.get('SCRAPER_PARQUET_BATCH_SIZE', '1000'))
+
+# 結果のストア（SQLite。Web UIで最近の結果・URLごとの履歴・件数を表示する）
+# 結果はRESULT_STORE_BATCH_SIZE件ごとか、RESULT_STORE_FLUSH_INTERVAL秒ごとにまとめて挿入する
+RESULT_STORE_ENABLED = os.environ.get('SCRAPER_RESULT_STORE', 'true').lower() == 'true'
+RESULT_STORE_PATH = os.environ.get('SCRAPER_RESULT_STORE_PATH', 'data/results.sqlite3')
+RESULT_STORE_BATCH_SIZE = int(os.environ.get('SCRAPER_RESULT_STORE_BATCH_SIZE', '200'))
+RESULT_STORE_FLUSH_INTERVAL = float(os.environ.get('SCRAPER_RESULT_STORE_FLUSH_INTERVAL', '2'))
+# 全文検索インデックス（タイトル・説明・本文の文字bigram。結果のストアと同じデータベースに保存する）
+TEXT_INDEX_ENABLED = os.environ.get('SCRAPER_TEXT_INDEX', 'true').lower() == 'true'
+# 検索語を含む新しいページから関連度で並べる件数の上限（多くのページに含まれる語の検索を速くする）
+TEXT_INDEX_MAX_CANDIDATES = int(os.environ.get('SCRAPER_TEXT_INDEX_MAX_CANDIDATES', '2000'))
+
+# 正規化テキストのキャッシュ（小文字化してnormalize_japanese_textを適用したタイトル・説明・本文を
+# 元のテキストのハッシュをキーにして保存し、再フィルタリングや全文検索インデックスの再構築で使い回す）
+NORMALIZED_CACHE_ENABLED = os.environ.get('SCRAPER_NORMALIZED_CACHE', 'true').lower() == 'true'
+NORMALIZED_CACHE_PATH = os.environ.get('SCRAPER_NORMALIZED_CACHE_PATH', 'cache/normalized.sqlite3')
+NORMALIZED_MEMO_SIZE = int(os.environ.get('SCRAPER_NORMALIZED_MEMO_SIZE', '4096'))  # プロセス内に保持する件数
+NORMALIZED_MIN_PERSIST_LENGTH = int(os.environ.get('SCRAPER_NORMALIZED_MIN_PERSIST_LENGTH', '200'))  # ファイルに保存する最小の文字数
+
+# 要約（Geminiのモデル）
+SUMMARY_MODEL = os.environ.get('SCRAPER_SUMMARY_MODEL', 'models/gemini-1.5-pro')
+# 要約のキャッシュ（内容・言語・スタイル・長さ・モデルが同じ要約を再利用する）
+# SUMMARY_CACHE_REDIS_URLを指定するとRedisで全ワーカーと共有し、指定しなければディスクに保存する
+SUMMARY_CACHE_ENABLED = os.environ.get('SCRAPER_SUMMARY_CACHE', 'true').lower() == 'true'
+SUMMARY_CACHE_DIR = os.environ.get('SCRAPER_SUMMARY_CACHE_DIR', 'cache/summaries')
+SUMMARY_CACHE_TTL = int(os.environ.get('SCRAPER_SUMMARY_CACHE_TTL', str(7 * 24 * 60 * 60)))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get('SCRAPER_SUMMARY_CACHE_MAX_ENTRIES', '10000'))
+SUMMARY_CACHE_REDIS_URL = os.environ.get('SCRAPER_SUMMARY_CACHE_REDIS_URL')
+# 要約の条件（Celeryの要約のタスクで使う。コマンドラインではapp.pyが同じ環境変数を読む）
+SUMMARY_LANGUAGE = os.environ.get('SCRAPER_SUMMARY_LANGUAGE', 'Japanese')
+SUMMARY_STYLE = os.environ.get('SCRAPER_SUMMARY_STYLE', 'bullet')
+SUMMARY_LENGTH = int(os.environ.get('SCRAPER_SUMMARY_LENGTH', '200'))
+# 要約の実行（gemini: Gemini API / fake: APIを呼ばない負荷試験用のクライアント）
+SUMMARY_CLIENT = os.environ.get('SCRAPER_SUMMARY_CLIENT', 'gemini').lower()
+# 要約を並行して行う数 / モデルごとの1分あたりのリクエスト数の上限 / 1つのタスクでまとめて要約する件数
+SUMMARY_CONCURRENCY = int(os.environ.get('SCRAPER_SUMMARY_CONCURRENCY', '4'))
+SUMMARY_RPM = float(os.environ.get('SCRAPER_SUMMARY_RPM', '60'))
+SUMMARY_BATCH_SIZE = int(os.environ.get('SCRAPER_SUMMARY_BATCH_SIZE', '20'))
+# 429（リクエスト過多）の再試行（最大回数 / 最初の待ち時間（秒、再試行のたびに倍にする） / 待ち時間の上限（秒））
+SUMMARY_MAX_RETRIES = int(os.environ.get('SCRAPER_SUMMARY_MAX_RETRIES', '5'))
+SUMMARY_BACKOFF = float(os.environ.get('SCRAPER_SUMMARY_BACKOFF', '2'))
+SUMMARY_BACKOFF_MAX = float(os.environ.get('SCRAPER_SUMMARY_BACKOFF_MAX', '60'))
+# 要約のタスクを送るCeleryのキュー（取得のワーカーとは別のワーカーで処理する）
+SUMMARY_QUEUE = os.environ.get('SCRAPER_SUMMARY_QUEUE', 'summaries')
+# 負荷試験用のクライアントの応答時間（秒）
+SUMMARY_FAKE_LATENCY = float(os.environ.get('SCRAPER_SUMMARY_FAKE_LATENCY', '1'))
+# 要約の方式（gemini: Gemini API / local: APIを使わない抽出型の要約（TextRank） /
+#            auto: 抽出型の要約が本文をcoverage SUMMARY_LOCAL_MIN_COVERAGE以上で表せればそれを使い、足りないページだけGeminiで要約する）
+SUMMARY_ENGINE = os.environ.get('SCRAPER_SUMMARY_ENGINE', 'gemini').lower()
+SUMMARY_LOCAL_MIN_COVERAGE = float(os.environ.get('SCRAPER_SUMMARY_LOCAL_MIN_COVERAGE', '0.8'))
+# 抽出型の要約で文として扱う最小の文字数 / 先頭から重要度を計算する文の数の上限
+SUMMARY_LOCAL_MIN_SENTENCE = int(os.environ.get('SCRAPER_SUMMARY_LOCAL_MIN_SENTENCE', '10'))
+SUMMARY_LOCAL_MAX_SENTENCES = int(os.environ.get('SCRAPER_SUMMARY_LOCAL_MAX_SENTENCES', '300'))
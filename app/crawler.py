@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import math
+import re
+from collections import deque
+from urllib.parse import urldefrag, urlparse
+
+from config import CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, CRAWL_BATCH_SIZE, CRAWL_SEEN_CAPACITY, CRAWL_SEEN_ERROR_RATE
+from http_cache import http_cache, is_not_modified, not_modified_result
+from url_index import url_index, url_key
+
+class BloomFilter:
+    """取得済みURLを記録するBloomフィルタ
+
+    URLそのものは保存せず、ビット配列だけを持つ（100万URL・偽陽性率0.1%で約1.8MB）。
+    偽陽性率の割合で未取得のURLを取得済みと判定することがあるが、
+    取得済みのURLを未取得と判定することはない。
+    """
+
+    def __init__(self, capacity=CRAWL_SEEN_CAPACITY, error_rate=CRAWL_SEEN_ERROR_RATE):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, url):
+        # 1回のハッシュから2つの値を取り出し、k個の位置を作る（ダブルハッシュ法）
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, url):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(url))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, url):
+        """URLを追加する（新しいURLだった場合はTrueを返す）"""
+        added = False
+        for p in self._positions(url):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+class CrawlScope:
+    """クロールでたどるURLの範囲
+
+    same_domainがTrueの場合はシードURLと同じホストのURLだけをたどる。
+    includeを指定した場合はいずれかの正規表現に一致するURLだけ、
+    excludeに一致するURLは除外する。
+    """
+
+    def __init__(self, seeds, same_domain=True, include=None, exclude=None):
+        self.domains = {urlparse(url).netloc.lower() for url in seeds} if same_domain else None
+        self.include = [re.compile(pattern) for pattern in include or []]
+        self.exclude = [re.compile(pattern) for pattern in exclude or []]
+
+    def allows(self, url):
+        parsed_url = urlparse(url)
+        if parsed_url.scheme not in ('http', 'https'):
+            return False
+        if self.domains is not None and parsed_url.netloc.lower() not in self.domains:
+            return False
+        if self.include and not any(pattern.search(url) for pattern in self.include):
+            return False
+        return not any(pattern.search(url) for pattern in self.exclude)
+
+def result_links(url, result):
+    """ページのリンクを返す（更新のなかったページは前回保存したリンクを使う）"""
+    if is_not_modified(result):
+        entry = http_cache.load(url) if http_cache else None
+        return (entry or {}).get('links') or []
+    if not result:
+        return []
+    return result.get('links') or []
+
+def crawl(seeds, fetch, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES, scope=None, seen=None, batch_size=CRAWL_BATCH_SIZE, index=url_index):
+    """シードURLからリンクを幅優先でたどり、(url, depth, result)を順に返す
+
+    fetch(urls)はURLのリストを受け取り、同じ順番で結果のリストを返す関数
+    （scrape_websiteの結果と同じ形式で、失敗したURLはNone）。
+    待機中のURLは幅優先の順にbatch_size件ずつまとめてfetchに渡すため、非同期取得で並行に処理できる。
+    深さmax_depthのページのリンクはたどらず、max_pagesページを取得したら終了する。
+    URLは正規化したキー（url_index.url_key）で重複を判定する。indexを指定した場合は
+    取得できたページをindexに記録し、最近取得したページ（シードを除く）は取得せずに
+    前回保存したリンクだけをたどる（ページ数の上限には数えない）。
+    """
+    scope = scope or CrawlScope(seeds)
+    seen = seen if seen is not None else BloomFilter()
+
+    frontier = deque()
+    for url in seeds:
+        url = urldefrag(url)[0]
+        if seen.add(url_key(url)):
+            frontier.append((url, 0))
+
+    def expand(url, depth, result):
+        if depth >= max_depth:
+            return
+        for link in result_links(url, result):
+            link = urldefrag(link)[0]
+            if scope.allows(link) and seen.add(url_key(link)):
+                frontier.append((link, depth + 1))
+
+    fetched = 0
+    skipped = 0
+    while frontier and fetched < max_pages:
+        batch = []
+        while frontier and len(batch) < min(batch_size, max_pages - fetched):
+            url, depth = frontier.popleft()
+            if depth and index and index.is_fresh(url):
+                # 最近取得したページは取得せず、前回保存したリンクだけをたどる
+                expand(url, depth, not_modified_result(url))
+                skipped += 1
+                continue
+            batch.append((url, depth))
+        if not batch:
+            continue
+
+        logging.info(f"クロール: 深さ{batch[0][1]}の{len(batch)}件を取得します（取得済み {fetched}件 / 待機中 {len(frontier)}件）")
+        results = fetch([url for url, _ in batch])
+        fetched += len(batch)
+
+        for (url, depth), result in zip(batch, results):
+            if index:
+                index.record_result(url, result)
+            yield url, depth, result
+            expand(url, depth, result)
+
+    logging.info(f"クロール完了: {fetched}件を取得しました（最近取得済みで省略 {skipped}件 / 未取得 {len(frontier)}件）")
@@ -0,0 +1,358 @@
+import json
+import logging
+from urllib.parse import urljoin
+
+from parsers import START, END, TEXT, MAIN_TEXT, STRING_CONTAINER_TAGS, iter_events
+from url_index import canonicalize_url
+
+# 本文候補として探す要素のセレクタ（この順番で候補に追加される）
+CONTENT_SELECTORS = ['article', '.article', '#article', '.content', '#content', '.main', '#main', 'main', 'section', '.section', '#section']
+
+# テキストの範囲を記録する必要があるタグ
+RECORDED_TAGS = frozenset(['title', 'p', 'div', 'a', 'script'])
+
+def get_absolute_url(base_url, relative_url):
+    """相対URLを絶対URLに変換する"""
+    if not relative_url:
+        return None
+    if relative_url.startswith(('http://', 'https://')):
+        return relative_url
+    return urljoin(base_url, relative_url)
+
+def _rel_values(attrs):
+    """rel属性を小文字のリストとして取得する"""
+    rel = attrs.get('rel')
+    if not rel:
+        return ()
+    if isinstance(rel, str):
+        rel = rel.split()
+    return [value.lower() for value in rel]
+
+def _classes(attrs):
+    """class属性をリストとして取得する"""
+    classes = attrs.get('class')
+    if not classes:
+        return ()
+    if isinstance(classes, str):
+        return classes.split()
+    return classes
+
+class _Node:
+    """走査中に記録する要素（テキストは範囲だけを持ち、必要になるまで連結しない）"""
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children', 'only_string')
+
+    def __init__(self, name, attrs, start):
+        self.name = name
+        self.attrs = attrs
+        self.start = start
+        self.end = start
+        self.children = 0
+        self.only_string = None
+
+class PageScan:
+    """1回の走査で集めたページの情報
+
+    各テキスト片の長さの累積和を持つため、入れ子になったdivでも
+    テキスト長は要素ごとにO(1)で求められ、文字列の連結は必要な要素だけで行う。
+    """
+
+    def __init__(self, events):
+        self.pieces = []          # 全テキスト片（文書順）
+        self.kinds = []           # テキスト片の種類
+        self.stripped = []        # MAIN_TEXTのstrip済みテキスト（それ以外は空文字）
+        self.stripped_cum = [0]   # strippedの長さの累積和
+        self.title = None
+        self.meta = {}            # (属性名, 値) -> 最初に見つかったmeta要素の属性
+        self.selected = {selector: [] for selector in CONTENT_SELECTORS}
+        self.paragraphs = []
+        self.divs = []
+        self.images = []
+        self.links = []
+        self.canonical = None     # 最初のrel=canonicalのhref
+        self.schema_scripts = []
+        self._scan(events)
+
+    def _scan(self, events):
+        pieces = self.pieces
+        kinds = self.kinds
+        stripped = self.stripped
+        stripped_cum = self.stripped_cum
+        meta = self.meta
+        selected = self.selected
+        stack = []
+        total = 0
+
+        for event, value, extra in events:
+            if event is TEXT:
+                if stack:
+                    parent = stack[-1]
+                    if parent is not None:
+                        parent.children += 1
+                        parent.only_string = value
+                if extra is None:
+                    continue
+                pieces.append(value)
+                kinds.append(extra)
+                if extra == MAIN_TEXT:
+                    text = value.strip()
+                    stripped.append(text)
+                    total += len(text)
+                else:
+                    stripped.append('')
+                stripped_cum.append(total)
+                continue
+
+            if event is END:
+                node = stack.pop()
+                if node is not None:
+                    node.end = len(pieces)
+                continue
+
+            # 開始タグ
+            name = value
+            attrs = extra
+            if stack:
+                parent = stack[-1]
+                if parent is not None:
+                    parent.children += 1
+                    parent.only_string = None
+
+            matched = []
+            if name in selected:
+                matched.append(name)
+            element_id = attrs.get('id')
+            if element_id is not None and '#' + element_id in selected:
+                matched.append('#' + element_id)
+            for cls in _classes(attrs):
+                key = '.' + cls
+                if key in selected and key not in matched:
+                    matched.append(key)
+
+            node = None
+            if matched or name in RECORDED_TAGS:
+                node = _Node(name, attrs, len(pieces))
+                for key in matched:
+                    selected[key].append(node)
+
+            if name == 'title':
+                if self.title is None:
+                    self.title = node
+            elif name == 'p':
+                self.paragraphs.append(node)
+            elif name == 'div':
+                self.divs.append(node)
+            elif name == 'a':
+                if 'href' in attrs:
+                    self.links.append(node)
+            elif name == 'img':
+                self.images.append(attrs)
+            elif name == 'link':
+                if self.canonical is None and 'canonical' in _rel_values(attrs):
+                    self.canonical = attrs.get('href')
+            elif name == 'meta':
+                for attr_name in ('name', 'property'):
+                    attr_value = attrs.get(attr_name)
+                    if attr_value is not None:
+                        meta.setdefault((attr_name, attr_value), attrs)
+            elif name == 'script':
+                if attrs.get('type') == 'application/ld+json':
+                    self.schema_scripts.append(node)
+
+            stack.append(node)
+
+    def text(self, node):
+        """get_text(strip=True)と同じテキストを返す"""
+        if node.name in STRING_CONTAINER_TAGS:
+            return ''.join(self.pieces[i].strip() for i in range(node.start, node.end) if self.kinds[i] == node.name)
+        return ''.join(self.stripped[node.start:node.end])
+
+    def text_length(self, node):
+        """get_text(strip=True)の長さを連結せずに返す"""
+        if node.name in STRING_CONTAINER_TAGS:
+            return len(self.text(node))
+        return self.stripped_cum[node.end] - self.stripped_cum[node.start]
+
+    def raw_text(self, node):
+        """get_text()と同じ（stripしない）テキストを返す"""
+        return ''.join(self.pieces[i] for i in range(node.start, node.end) if self.kinds[i] == MAIN_TEXT)
+
+    def string(self, node):
+        """Tag.stringと同様に、子が文字列1つだけの場合にその文字列を返す"""
+        if node.children == 1:
+            return node.only_string
+        return None
+
+    def find_meta(self, attr_name, attr_value):
+        """指定された属性値を持つ最初のmeta要素の属性を返す"""
+        return self.meta.get((attr_name, attr_value))
+
+def scan_document(document):
+    """解析済みドキュメントを1回だけ走査してPageScanを作成する"""
+    return PageScan(iter_events(document))
+
+def extract_content(soup, url, min_text_length=50):
+    """Webページからコンテンツを抽出する汎用関数
+
+    タイトル、メタデータ、段落、コンテナ要素のテキスト長、画像、リンクを
+    1回のツリー走査で集め、結果は従来の複数回走査と同じになる。
+    soupにはparse_html()が返すどのバックエンドのドキュメントも渡せる。
+    """
+    scan = scan_document(soup)
+    data = {}
+    
+    # URLを追加
+    data['url'] = url
+    
+    # タイトルの取得
+    data['title'] = scan.raw_text(scan.title).strip() if scan.title else "No Title"
+    logging.info(f"ページのタイトル: {data['title']}")
+    
+    # Open Graph タグからのタイトル取得（代替手段）
+    if data['title'] == "No Title":
+        og_title = scan.find_meta('property', 'og:title')
+        if og_title:
+            data['title'] = og_title.get('content', 'No Title')
+            logging.info(f"Open Graph タイトル: {data['title']}")
+    
+    # メタデータの取得
+    # 通常のメタ説明
+    meta_description = scan.find_meta('name', 'description')
+    if meta_description:
+        data['description'] = meta_description.get('content', '')
+        logging.info(f"ページの説明: {data['description'][:100]}...")
+    else:
+        # Open Graph 説明
+        og_description = scan.find_meta('property', 'og:description')
+        if og_description:
+            data['description'] = og_description.get('content', '')
+            logging.info(f"Open Graph 説明: {data['description'][:100]}...")
+        else:
+            data['description'] = ""
+    
+    # 本文の取得
+    logging.info("ページ本文を抽出中...")
+    
+    # 様々なコンテンツ抽出方法を試す
+    # 候補は（長さ, テキストを作る関数）として持ち、選ばれた候補だけ文字列を連結する
+    content_candidates = []
+    
+    # 方法1: 記事/コンテンツらしき要素を探す
+    for selector in CONTENT_SELECTORS:
+        for element in scan.selected[selector]:
+            content_candidates.append((scan.text_length(element), lambda element=element: scan.text(element)))
+    
+    # 方法2: 段落を取得
+    paragraphs = []
+    for p in scan.paragraphs:
+        text = scan.raw_text(p).strip()
+        if len(text) > min_text_length:
+            paragraphs.append(text)
+    
+    if paragraphs:
+        joined = "\n\n".join(paragraphs)
+        content_candidates.append((len(joined), lambda: joined))
+    
+    # 方法3: divで囲まれた大きなテキストブロックを探す
+    for div in scan.divs:
+        length = scan.text_length(div)
+        if length > min_text_length * 5:  # より大きなテキストブロック
+            content_candidates.append((length, lambda div=div: scan.text(div)))
+    
+    # 方法4: schema.org構造化データを探す
+    for element in scan.schema_scripts:
+        try:
+            schema_data = json.loads(scan.string(element))
+            if isinstance(schema_data, dict):
+                # 記事コンテンツを探す
+                article_body = schema_data.get('articleBody')
+                if article_body:
+                    content_candidates.append((len(article_body), lambda article_body=article_body: article_body))
+        except Exception as e:
+            logging.warning(f"schema.orgデータの解析中にエラーが発生しました: {e}")
+    
+    # 最も長いコンテンツ候補を選択
+    if content_candidates:
+        data['content'] = max(content_candidates, key=lambda candidate: candidate[0])[1]()
+        logging.info(f"本文を抽出しました（{len(data['content'])}文字）")
+        logging.info(f"プレビュー: {data['content'][:150]}...")
+    else:
+        data['content'] = ""
+        logging.warning("本文が見つかりませんでした")
+    
+    # 画像URLの取得
+    logging.info("画像を抽出中...")
+    
+    images = []
+    
+    # Open Graph 画像を探す
+    og_image = scan.find_meta('property', 'og:image')
+    if og_image:
+        img_url = og_image.get('content', '')
+        if img_url:
+            images.append({
+                'url': img_url,
+                'alt': 'Open Graph Image'
+            })
+    
+    # 通常の画像を探す
+    for img in scan.images:
+        src = img.get('src', '')
+        if src:
+            # 相対URLを絶対URLに変換
+            abs_src = get_absolute_url(url, src)
+            if abs_src:
+                # 画像の代替テキストを取得
+                alt = img.get('alt', '')
+                
+                images.append({
+                    'url': abs_src,
+                    'alt': alt
+                })
+    
+    # 画像URLのリストを作成
+    data['images'] = [img['url'] for img in images]
+    
+    if images:
+        logging.info(f"画像を{len(images)}枚見つけました")
+        for i, img in enumerate(images[:5]):  # 最初の5枚だけ表示
+            logging.info(f"画像 {i+1}: {img['url']}")
+        if len(images) > 5:
+            logging.info(f"...他 {len(images) - 5} 枚")
+    else:
+        logging.warning("画像が見つかりませんでした")
+    
+    # リンクの取得
+    logging.info("リンクを抽出中...")
+    
+    links = []
+    for a in scan.links:
+        href = a.attrs.get('href', '')
+        if href and not href.startswith(('#', 'javascript:', 'mailto:')):
+            # 相対URLを絶対URLに変換
+            abs_href = get_absolute_url(url, href)
+            if abs_href:
+                links.append({
+                    'url': abs_href,
+                    'node': a
+                })
+    
+    # リンクURLのリストを作成
+    data['links'] = [link['url'] for link in links]
+    
+    if links:
+        logging.info(f"リンクを{len(links)}個見つけました")
+        for i, link in enumerate(links[:5]):  # 最初の5個だけ表示（リンクテキストは表示する分だけ作る）
+            logging.info(f"リンク {i+1}: {scan.text(link['node'])} - {link['url']}")
+        if len(links) > 5:
+            logging.info(f"...他 {len(links) - 5} 個")
+    else:
+        logging.warning("リンクが見つかりませんでした")
+    
+    # 正規URL（rel=canonical、なければog:url）。重複排除のインデックスで使う
+    canonical = scan.canonical
+    if not canonical:
+        og_url = scan.find_meta('property', 'og:url')
+        canonical = og_url.get('content') if og_url else None
+    data['canonical_url'] = canonicalize_url(get_absolute_url(url, canonical) or url)
+    
+    return data
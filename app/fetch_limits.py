@@ -0,0 +1,156 @@
+"""ページの取得の上限（本文のバイト数と、接続・読み込み・全体の期限）
+
+本文は一度に読み込まず、CHUNK_SIZEずつ読む。読んだ量がmax_bytesを超えたら、
+oversizeがtruncateなら先頭max_bytesバイトだけを解析し（結果に'truncated': Trueを付ける）、
+skipなら取得をやめて{'url': url, 'status': 'oversized'}を結果にする
+（Content-Lengthがmax_bytesを超える場合は、本文を読まずにやめる）。
+
+接続と1回の読み込みのタイムアウトとは別に、リクエスト全体の期限（deadline秒）を設ける。
+少しずつ送り続けるサーバーでも期限を過ぎたら読むのをやめ、{'url': url, 'status': 'deadline_exceeded'}を結果にする。
+requestsの本文は、届いた分だけを返すread1で読み、読むたびにソケットのタイムアウトを期限までの残り時間に縮めるため、
+1バイトずつ送るサーバーでも期限で止まる（iter_contentはCHUNK_SIZEバイトがそろうまで戻らず、期限を確認できない）。
+aiohttpではClientTimeoutのtotalを期限にする。
+ヘッダーを受け取るまでは、接続と1回の読み込みのタイムアウト（読み込みは期限より長くしない）だけで待つ。
+"""
+import socket
+import time
+
+import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from config import FETCH_MAX_BYTES, FETCH_OVERSIZE, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, FETCH_DEADLINE
+
+# 取得をやめた結果のステータスと、本文を切り詰めて保存したページのステータス
+OVERSIZED = 'oversized'
+DEADLINE_EXCEEDED = 'deadline_exceeded'
+TRUNCATED = 'truncated'
+
+# 1回に読むバイト数
+CHUNK_SIZE = 64 * 1024
+
+class FetchLimitExceeded(Exception):
+    """本文のサイズか全体の期限の上限を超えた（statusはOVERSIZED / DEADLINE_EXCEEDED、receivedは読んだバイト数）"""
+
+    def __init__(self, status, message, received=0):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+def limited_result(url, error):
+    """上限を超えて取得をやめたページの結果（タスクの結果としてそのまま返せる）"""
+    return {'url': url, 'status': error.status, 'received_bytes': error.received}
+
+def is_fetch_limited(result):
+    """結果が上限を超えて取得をやめたもの（サイズ超過・期限切れ）かどうかを返す"""
+    return isinstance(result, dict) and result.get('status') in (OVERSIZED, DEADLINE_EXCEEDED)
+
+def is_truncated(result):
+    """結果が本文を切り詰めて保存したページかどうかを返す"""
+    return isinstance(result, dict) and bool(result.get('truncated'))
+
+def request_timeout(connect=FETCH_CONNECT_TIMEOUT, read=FETCH_READ_TIMEOUT, deadline=FETCH_DEADLINE):
+    """requestsのtimeout（接続, 1回の読み込み）を返す（1回の読み込みは全体の期限より長くしない）"""
+    return (connect, min(read, deadline))
+
+def start_deadline(deadline=FETCH_DEADLINE):
+    """リクエスト全体の期限の時刻（time.monotonic()の値）を返す"""
+    return time.monotonic() + deadline
+
+def deadline_passed(deadline):
+    """期限を過ぎたかどうかを返す（deadlineがNoneなら期限なし）"""
+    return deadline is not None and time.monotonic() > deadline
+
+def check_deadline(deadline, received=0):
+    """期限を過ぎていればFetchLimitExceededを送出する"""
+    if deadline_passed(deadline):
+        raise FetchLimitExceeded(DEADLINE_EXCEEDED, '取得の期限を過ぎました', received)
+
+def check_content_length(headers, max_bytes=FETCH_MAX_BYTES, oversize=FETCH_OVERSIZE):
+    """Content-Lengthがmax_bytesを超え、oversizeがskipならFetchLimitExceededを送出する"""
+    length = headers.get('Content-Length')
+    if oversize == 'skip' and length and length.isdigit() and int(length) > max_bytes:
+        raise FetchLimitExceeded(OVERSIZED, f"本文が上限（{max_bytes}バイト）を超えています（{length}バイト）")
+
+def _append(chunks, chunk, received, max_bytes, oversize):
+    """チャンクを加え、(読んだバイト数, 上限に達したか)を返す"""
+    if received + len(chunk) <= max_bytes:
+        chunks.append(chunk)
+        return received + len(chunk), False
+    if oversize == 'skip':
+        raise FetchLimitExceeded(OVERSIZED, f"本文が上限（{max_bytes}バイト）を超えました", received + len(chunk))
+    chunks.append(chunk[:max_bytes - received])
+    return max_bytes, True
+
+def read_body(response, max_bytes=FETCH_MAX_BYTES, deadline=None, oversize=FETCH_OVERSIZE):
+    """requestsのレスポンス（stream=True）の本文を少しずつ読み、(本文, 切り詰めたか)を返す
+
+    上限はデコード（gzip・brotli）後のバイト数で数える。
+    """
+    chunks = []
+    received = 0
+    truncated = False
+    try:
+        check_content_length(response.headers, max_bytes, oversize)
+        for chunk in _iter_body(response, deadline):
+            check_deadline(deadline, received)
+            received, truncated = _append(chunks, chunk, received, max_bytes, oversize)
+            if truncated:
+                break
+    except FetchLimitExceeded as e:
+        e.received = max(e.received, received)
+        raise
+    finally:
+        response.close()
+    return b''.join(chunks), truncated
+
+def _response_socket(raw):
+    """urllib3のレスポンスのソケットを返す（取得できなければNone）"""
+    connection = getattr(raw, 'connection', None) or getattr(raw, '_connection', None)
+    return getattr(connection, 'sock', None)
+
+def _iter_body(response, deadline):
+    """requestsのレスポンスの本文を、届いた分ずつ（最大CHUNK_SIZEバイト、デコード後）返す
+
+    読むたびにソケットのタイムアウトを期限までの残り時間以下にし、期限を過ぎたらFetchLimitExceededを送出する。
+    read1のないurllib3（1.x）では、iter_contentで読む（期限はチャンクの間でだけ確認する）。
+    """
+    raw = response.raw
+    if deadline is None or not hasattr(raw, 'read1'):
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+    sock = _response_socket(raw)
+    read_timeout = sock.gettimeout() if sock is not None else None
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise FetchLimitExceeded(DEADLINE_EXCEEDED, '取得の期限を過ぎました')
+            if sock is not None:
+                sock.settimeout(min(read_timeout, remaining) if read_timeout else remaining)
+            try:
+                chunk = raw.read1(CHUNK_SIZE, decode_content=True)
+            except (ReadTimeoutError, socket.timeout) as e:
+                if deadline_passed(deadline):
+                    raise FetchLimitExceeded(DEADLINE_EXCEEDED, '取得の期限を過ぎました')
+                raise requests.exceptions.ConnectionError(e)
+            except ProtocolError as e:
+                raise requests.exceptions.ChunkedEncodingError(e)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if sock is not None and sock.fileno() != -1:
+            sock.settimeout(read_timeout)
+
+async def read_body_async(response, max_bytes=FETCH_MAX_BYTES, deadline=None, oversize=FETCH_OVERSIZE):
+    """aiohttpのレスポンスの本文を少しずつ読み、(本文, 切り詰めたか)を返す"""
+    check_content_length(response.headers, max_bytes, oversize)
+    chunks = []
+    received = 0
+    truncated = False
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        check_deadline(deadline, received)
+        received, truncated = _append(chunks, chunk, received, max_bytes, oversize)
+        if truncated:
+            break
+    return b''.join(chunks), truncated
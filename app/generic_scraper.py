@@ -1,6 +1,5 @@
 import sys
 import requests
-from bs4 import BeautifulSoup
 import json
 import csv
 import os
@@ -8,8 +7,24 @@ import argparse
 import time
 import logging
 from datetime import datetime
-from urllib.parse import urlparse, urljoin
-from urllib.robotparser import RobotFileParser
+from functools import partial
+from urllib.parse import urlparse
+from extractor import extract_content, get_absolute_url
+from config import (PARSER_BACKEND, FETCH_CONCURRENCY, FETCH_PER_HOST, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, NEAR_DUP_MODE, STORAGE_SINK,
+                    PIPELINE_PARSE_WORKERS)
+from async_fetcher import fetch_urls
+from crawler import CrawlScope, crawl
+from robots_cache import robots_cache
+from rate_limiter import rate_limiter, crawl_interval
+from http_client import borrow_session
+from http_cache import http_cache, not_modified_result, is_not_modified
+from charset_detect import header_charset, decode_html
+from fetch_limits import (FetchLimitExceeded, DEADLINE_EXCEEDED, limited_result, request_timeout, start_deadline, deadline_passed,
+                          read_body, is_fetch_limited, is_truncated)
+from sinks import SINK_TYPES, get_sink, save_to_json, save_to_csv, get_output_basename
+from parsers import PARSER_BACKENDS, parse_html
+from normalizer import store_normalized_fields
+from near_dup import fingerprint_index, simhash, near_duplicate_result, is_near_duplicate
 
 # 互換性のために以下を使用
 import os
@@ -33,16 +48,12 @@ HEADERS = {
 REQUEST_DELAY = 1
 
 def check_robots_txt(url):
-    """robots.txtをチェックして、URLへのアクセスが許可されているかを確認する"""
+    """robots.txtをチェックして、URLへのアクセスが許可されているかを確認する
+
+    robots.txtはホストごとにキャッシュされ、有効期間内は再取得しない。
+    """
     try:
-        parsed_url = urlparse(url)
-        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-        
-        rp = RobotFileParser()
-        rp.set_url(robots_url)
-        rp.read()
-        
-        can_fetch = rp.can_fetch(HEADERS['User-Agent'], url)
+        can_fetch = robots_cache.can_fetch(url, HEADERS['User-Agent'], headers=HEADERS)
         if not can_fetch:
             logging.warning(f"robots.txtによりアクセスが制限されています: {url}")
         return can_fetch
@@ -51,198 +62,72 @@ def check_robots_txt(url):
         # エラーが発生した場合はアクセスを許可する（寛容なアプローチ）
         return True
 
-def get_absolute_url(base_url, relative_url):
-    """相対URLを絶対URLに変換する"""
-    if not relative_url:
-        return None
-    if relative_url.startswith(('http://', 'https://')):
-        return relative_url
-    return urljoin(base_url, relative_url)
+def extract_page(url, html, min_text_length=50, parser=None, truncated=False):
+    """取得したHTMLからデータを抽出し、(データ, 本文のSimHash)を返す
 
-def save_to_json(data, filename):
-    """データをJSON形式で保存する"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-    print(f"✅ JSONファイルを保存しました: {filename}")
-
-def save_to_csv(data, filename):
-    """データをCSV形式で保存する"""
-    # CSVのヘッダー
-    fieldnames = list(data.keys())
+    解析と抽出のCPUの処理だけを行い、保存はしない（パイプラインでは別のプロセスで実行する）。
+    ほぼ同じ内容の検出が無効な場合、SimHashはNone。
+    truncatedがTrue（本文を上限のバイト数で切り詰めた）の場合は、データに'truncated': Trueを加える。
+    """
+    soup = parse_html(html, parser)
     
-    with open(filename, 'w', encoding='utf-8', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        # リスト型のデータをカンマ区切りの文字列に変換
-        csv_data = {}
-        for key, value in data.items():
-            if isinstance(value, list):
-                csv_data[key] = ','.join(value)
-            else:
-                csv_data[key] = value
-        
-        writer.writerow(csv_data)
-    print(f"✅ CSVファイルを保存しました: {filename}")
+    # データを抽出
+    data = extract_content(soup, url, min_text_length)
+    if truncated:
+        data['truncated'] = True
+    fingerprint = simhash(data.get('content')) if fingerprint_index else None
+    return data, fingerprint
 
-def extract_content(soup, url, min_text_length=50):
-    """Webページからコンテンツを抽出する汎用関数"""
-    data = {}
-    
-    # URLを追加
-    data['url'] = url
-    
-    # タイトルの取得
-    data['title'] = soup.title.text.strip() if soup.title else "No Title"
-    logging.info(f"ページのタイトル: {data['title']}")
-    
-    # Open Graph タグからのタイトル取得（代替手段）
-    if data['title'] == "No Title":
-        og_title = soup.find('meta', property='og:title')
-        if og_title:
-            data['title'] = og_title.get('content', 'No Title')
-            logging.info(f"Open Graph タイトル: {data['title']}")
-    
-    # メタデータの取得
-    # 通常のメタ説明
-    meta_description = soup.find('meta', attrs={'name': 'description'})
-    if meta_description:
-        data['description'] = meta_description.get('content', '')
-        logging.info(f"ページの説明: {data['description'][:100]}...")
-    else:
-        # Open Graph 説明
-        og_description = soup.find('meta', property='og:description')
-        if og_description:
-            data['description'] = og_description.get('content', '')
-            logging.info(f"Open Graph 説明: {data['description'][:100]}...")
-        else:
-            data['description'] = ""
-    
-    # 本文の取得
-    logging.info("ページ本文を抽出中...")
-    
-    # 様々なコンテンツ抽出方法を試す
-    content_candidates = []
-    
-    # 方法1: 記事/コンテンツらしき要素を探す
-    for selector in ['article', '.article', '#article', '.content', '#content', '.main', '#main', 'main', 'section', '.section', '#section']:
-        elements = soup.select(selector)
-        if elements:
-            for element in elements:
-                content_candidates.append(element.get_text(strip=True))
-    
-    # 方法2: 段落を取得
-    paragraphs = []
-    for p in soup.find_all('p'):
-        text = p.text.strip()
-        if len(text) > min_text_length:
-            paragraphs.append(text)
-    
-    if paragraphs:
-        content_candidates.append("\n\n".join(paragraphs))
-    
-    # 方法3: divで囲まれた大きなテキストブロックを探す
-    for div in soup.find_all('div'):
-        text = div.get_text(strip=True)
-        if len(text) > min_text_length * 5:  # より大きなテキストブロック
-            content_candidates.append(text)
-    
-    # 方法4: schema.org構造化データを探す
-    schema_elements = soup.find_all('script', type='application/ld+json')
-    for element in schema_elements:
-        try:
-            schema_data = json.loads(element.string)
-            if isinstance(schema_data, dict):
-                # 記事コンテンツを探す
-                article_body = schema_data.get('articleBody')
-                if article_body:
-                    content_candidates.append(article_body)
-        except Exception as e:
-            logging.warning(f"schema.orgデータの解析中にエラーが発生しました: {e}")
-    
-    # 最も長いコンテンツ候補を選択
-    if content_candidates:
-        data['content'] = max(content_candidates, key=len)
-        logging.info(f"本文を抽出しました（{len(data['content'])}文字）")
-        logging.info(f"プレビュー: {data['content'][:150]}...")
-    else:
-        data['content'] = ""
-        logging.warning("本文が見つかりませんでした")
-    
-    # 画像URLの取得
-    logging.info("画像を抽出中...")
-    
-    images = []
-    
-    # Open Graph 画像を探す
-    og_image = soup.find('meta', property='og:image')
-    if og_image:
-        img_url = og_image.get('content', '')
-        if img_url:
-            images.append({
-                'url': img_url,
-                'alt': 'Open Graph Image'
-            })
-    
-    # 通常の画像を探す
-    for img in soup.find_all('img'):
-        src = img.get('src', '')
-        if src:
-            # 相対URLを絶対URLに変換
-            abs_src = get_absolute_url(url, src)
-            if abs_src:
-                # 画像の代替テキストを取得
-                alt = img.get('alt', '')
-                
-                images.append({
-                    'url': abs_src,
-                    'alt': alt
-                })
-    
-    # 画像URLのリストを作成
-    data['images'] = [img['url'] for img in images]
-    
-    if images:
-        logging.info(f"画像を{len(images)}枚見つけました")
-        for i, img in enumerate(images[:5]):  # 最初の5枚だけ表示
-            logging.info(f"画像 {i+1}: {img['url']}")
-        if len(images) > 5:
-            logging.info(f"...他 {len(images) - 5} 枚")
-    else:
-        logging.warning("画像が見つかりませんでした")
-    
-    # リンクの取得
-    logging.info("リンクを抽出中...")
-    
-    links = []
-    for a in soup.find_all('a', href=True):
-        href = a.get('href', '')
-        if href and not href.startswith(('#', 'javascript:', 'mailto:')):
-            # 相対URLを絶対URLに変換
-            abs_href = get_absolute_url(url, href)
-            if abs_href:
-                link_text = a.get_text(strip=True)
-                links.append({
-                    'url': abs_href,
-                    'text': link_text
-                })
+def store_page(url, data, fingerprint=None, output_dir='data', sink=None, normalized=None):
+    """抽出したデータを保存先に保存する
+
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    normalizedには正規化済みのタイトル・説明・本文を渡せる（省略時はここで正規化する）。
+    戻り値は抽出したデータに保存先（location）を加えたもの。
+    """
+    # 保存済みのスナップショットとほぼ同じ内容なら、全体は保存しない（参照だけを保存するかスキップする）
+    match = fingerprint_index.find(url, fingerprint) if fingerprint is not None and fingerprint_index else None
+    if match:
+        logging.info(f"ほぼ同じ内容のスナップショットがあります（距離: {match['distance']}）: {match['basename']}")
+        result = near_duplicate_result(data, match)
+        if NEAR_DUP_MODE == 'reference':
+            reference = {key: value for key, value in result.items() if key != 'links'}
+            get_sink(output_dir, sink).write(reference)
+        return result
     
-    # リンクURLのリストを作成
-    data['links'] = [link['url'] for link in links]
+    # 保存先に保存（filesはJSONとCSV、jsonlはセグメントに追記）
+    location = get_sink(output_dir, sink).write(data)
+    if fingerprint is not None and fingerprint_index:
+        fingerprint_index.add(url, fingerprint, location)
     
-    if links:
-        logging.info(f"リンクを{len(links)}個見つけました")
-        for i, link in enumerate(links[:5]):  # 最初の5個だけ表示
-            logging.info(f"リンク {i+1}: {link['text']} - {link['url']}")
-        if len(links) > 5:
-            logging.info(f"...他 {len(links) - 5} 個")
-    else:
-        logging.warning("リンクが見つかりませんでした")
+    # キーワードの再フィルタリングや全文検索のために、正規化したテキストを保存しておく
+    store_normalized_fields(data, normalized)
     
-    return data
+    # 保存先（filesはファイルパス、jsonl / parquetはレコードID）を加えて返す（タスクの結果はこれで保存したページを参照する）
+    return {**data, 'location': location}
+
+def process_page(url, html, output_dir='data', min_text_length=50, parser=None, sink=None, truncated=False):
+    """取得したHTMLからデータを抽出し、保存先に保存する（extract_pageとstore_pageを続けて行う）
 
-def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DELAY, user_agent=None):
-    """指定されたURLのWebサイトをスクレイピングする"""
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    戻り値は抽出したデータに保存先（location）を加えたもの。
+    """
+    data, fingerprint = extract_page(url, html, min_text_length, parser, truncated)
+    return store_page(url, data, fingerprint, output_dir, sink)
+
+def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DELAY, user_agent=None, parser=None, use_cache=True, rate_limit=True,
+                   sink=None):
+    """指定されたURLのWebサイトをスクレイピングする
+
+    parserでHTMLパーサーのバックエンドを指定できる（省略時は環境変数SCRAPER_PARSER）。
+    use_cacheがTrueの場合は条件付きGETを行い、前回から更新されていないページは
+    解析も保存もせずにnot_modified_result()を返す。
+    rate_limitがFalseの場合は、呼び出し側でレート制限の予約を済ませているものとして待機しない。
+    sinkは保存先の種類（files / jsonl、省略時は環境変数SCRAPER_SINK）。
+    本文は少しずつ読み、上限（SCRAPER_FETCH_MAX_BYTES）を超えた分は切り詰めるか（'truncated': True）、
+    取得をやめて{'status': 'oversized'}を返す。リクエスト全体の期限（SCRAPER_FETCH_DEADLINE）を過ぎた場合は
+    {'status': 'deadline_exceeded'}を返す（fetch_limits.py）。
+    """
     logging.info(f"{url} のスクレイピングを開始しました！")
     
     # ユーザーエージェントの設定
@@ -250,6 +135,7 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
     if user_agent:
         headers['User-Agent'] = user_agent
     
+    deadline = None
     try:
         # robots.txtをチェック
         if not check_robots_txt(url):
@@ -258,34 +144,44 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
         
         logging.info("Webページを取得中...")
         
-        # リクエスト前に待機（レート制限）
-        if delay > 0:
-            logging.info(f"{delay}秒間待機中...")
-            time.sleep(delay)
+        # ドメインごとのレート制限（delayとrobots.txtのCrawl-delayの大きい方の間隔を空ける）
+        if rate_limit:
+            interval = crawl_interval(delay, robots_cache.lookup(url), headers['User-Agent'])
+            rate_limiter.wait(url, interval)
         
-        response = requests.get(url, headers=headers, timeout=30)
+        # 前回の取得結果があれば条件付きGETにする
+        cache = http_cache if use_cache else None
+        if cache:
+            headers.update(cache.conditional_headers(url))
+        
+        # プロセスで共有するSessionのプールから借りて、同じホストへの接続を再利用する
+        # （本文はstream=Trueで少しずつ読み、読み終えてから接続をプールに返す）
+        deadline = start_deadline()
+        with borrow_session() as session:
+            response = session.get(url, headers=headers, timeout=request_timeout(), stream=True)
+            if response.status_code != 200:
+                response.close()
+                content = b''
+            else:
+                content, truncated = read_body(response, deadline=deadline)
+        
+        if response.status_code == 304:
+            logging.info(f"ページは前回の取得から更新されていません: {url}")
+            return not_modified_result(url)
         
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            # データを抽出
-            data = extract_content(soup, url, min_text_length)
-            
-            # 保存用のディレクトリを作成
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # ドメイン名を取得してファイル名に使用
-            domain = urlparse(url).netloc.replace('.', '_')
-            
-            # タイムスタンプを含むファイル名を生成
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            json_filename = f"{output_dir}/{domain}_{timestamp}.json"
-            csv_filename = f"{output_dir}/{domain}_{timestamp}.csv"
-            
-            # JSONとCSVに保存
-            save_to_json(data, json_filename)
-            save_to_csv(data, csv_filename)
+            if truncated:
+                logging.warning(f"本文が上限を超えたため、先頭{len(content)}バイトだけを解析します: {url}")
+            if cache and cache.is_unchanged(url, content):
+                logging.info(f"ページの内容は前回の取得から変わっていません: {url}")
+                cache.store(url, response.headers, content)
+                return not_modified_result(url)
             
+            # 文字コードはヘッダー・BOM・<meta>・ホストごとのキャッシュ・先頭だけの判定の順に決める（charset_detect.py）
+            html = decode_html(content, header_charset(response.headers.get('Content-Type')), url)
+            data = process_page(url, html, output_dir, min_text_length, parser, sink, truncated)
+            if cache and data:
+                cache.store(url, response.headers, content, data.get('links'))
             return data
             
         else:
@@ -300,11 +196,18 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
                 logging.error("サーバーエラーが発生しました。後でもう一度試してください。")
             return None
 
-    except requests.exceptions.Timeout:
-        logging.error(f"タイムアウトエラー: {url}")
-        return None
-    except requests.exceptions.ConnectionError:
-        logging.error(f"接続エラー: {url}")
+    except FetchLimitExceeded as e:
+        logging.warning(f"{e}: {url}")
+        return limited_result(url, e)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        # 読み込みのタイムアウトが期限の後に起きた場合は、期限切れとして扱う
+        if deadline_passed(deadline):
+            logging.warning(f"取得の期限を過ぎました: {url}")
+            return limited_result(url, FetchLimitExceeded(DEADLINE_EXCEEDED, str(e)))
+        if isinstance(e, requests.exceptions.Timeout):
+            logging.error(f"タイムアウトエラー: {url}")
+        else:
+            logging.error(f"接続エラー: {url}")
         return None
     except requests.exceptions.RequestException as e:
         logging.error(f"リクエストエラー: {e}")
@@ -317,11 +220,24 @@ def scrape_website(url, output_dir='data', min_text_length=50, delay=REQUEST_DEL
 
 def main():
     parser = argparse.ArgumentParser(description='汎用Webスクレイパー')
-    parser.add_argument('url', help='スクレイピングするWebサイトのURL')
+    parser.add_argument('urls', nargs='+', metavar='url', help='スクレイピングするWebサイトのURL（複数指定すると非同期で並行取得）')
     parser.add_argument('--output-dir', '-o', default='data', help='出力ディレクトリ（デフォルト: data）')
     parser.add_argument('--min-text-length', '-m', type=int, default=50, help='本文として扱う最小テキスト長（デフォルト: 50）')
     parser.add_argument('--delay', '-d', type=float, default=REQUEST_DELAY, help=f'リクエスト間の待機時間（秒）（デフォルト: {REQUEST_DELAY}）')
     parser.add_argument('--user-agent', '-u', help='カスタムユーザーエージェント')
+    parser.add_argument('--parser', '-p', choices=PARSER_BACKENDS, default=PARSER_BACKEND, help=f'HTMLパーサーのバックエンド（デフォルト: {PARSER_BACKEND}）')
+    parser.add_argument('--sink', '-s', choices=SINK_TYPES, default=STORAGE_SINK, help=f'保存先（files: ページごとのJSON+CSV / jsonl: 圧縮したJSON Linesのセグメント / parquet: 分割したParquet）（デフォルト: {STORAGE_SINK}）')
+    parser.add_argument('--concurrency', '-c', type=int, default=FETCH_CONCURRENCY, help=f'複数URL取得時の同時接続数（デフォルト: {FETCH_CONCURRENCY}）')
+    parser.add_argument('--per-host', type=int, default=FETCH_PER_HOST, help=f'複数URL取得時のホストごとの同時接続数（デフォルト: {FETCH_PER_HOST}）')
+    parser.add_argument('--pipeline', action='store_true', help='複数URL取得時に、解析をプロセスのプールで行うパイプラインを使う（全コアで解析する）')
+    parser.add_argument('--parse-workers', type=int, default=PIPELINE_PARSE_WORKERS, help=f'パイプラインの解析のプロセス数（0はCPU数、デフォルト: {PIPELINE_PARSE_WORKERS}）')
+    parser.add_argument('--crawl', action='store_true', help='ページのリンクを幅優先でたどってクロールする（指定したURLがシードになる）')
+    parser.add_argument('--max-depth', type=int, default=CRAWL_MAX_DEPTH, help=f'クロールでリンクをたどる最大の深さ（デフォルト: {CRAWL_MAX_DEPTH}）')
+    parser.add_argument('--max-pages', type=int, default=CRAWL_MAX_PAGES, help=f'クロールで取得するページ数の上限（デフォルト: {CRAWL_MAX_PAGES}）')
+    parser.add_argument('--any-domain', action='store_true', help='クロールでシードURL以外のドメインへのリンクもたどる')
+    parser.add_argument('--include', action='append', metavar='PATTERN', help='クロールでこの正規表現に一致するURLだけをたどる（複数指定可）')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN', help='クロールでこの正規表現に一致するURLをたどらない（複数指定可）')
+    parser.add_argument('--no-cache', action='store_true', help='条件付きGETのキャッシュを使わず、常にページを取得して保存する')
     parser.add_argument('--no-robots', action='store_true', help='robots.txtチェックを無効にする（非推奨）')
     parser.add_argument('--verbose', '-v', action='store_true', help='詳細なログ出力を有効にする')
     
@@ -335,16 +251,62 @@ def main():
     if args.no_robots:
         logging.warning("robots.txtチェックが無効になっています。Webサイトの利用規約に違反する可能性があります。")
     
+    # クロールまたは複数URLの場合は非同期で並行取得する
+    if args.crawl or len(args.urls) > 1:
+        headers = HEADERS.copy()
+        if args.user_agent:
+            headers['User-Agent'] = args.user_agent
+        if args.pipeline:
+            from pipeline import fetch_urls_pipeline
+            fetch_pages = partial(fetch_urls_pipeline, output_dir=args.output_dir, min_text_length=args.min_text_length, parser=args.parser,
+                                  sink=args.sink, workers=args.parse_workers)
+        else:
+            handler = partial(process_page, output_dir=args.output_dir, min_text_length=args.min_text_length, parser=args.parser, sink=args.sink)
+            fetch_pages = partial(fetch_urls, handler=handler)
+        fetch = partial(
+            fetch_pages,
+            headers=headers,
+            concurrency=args.concurrency,
+            per_host=args.per_host,
+            delay=args.delay,
+            check_robots=not args.no_robots,
+            use_cache=not args.no_cache
+        )
+        if args.crawl:
+            scope = CrawlScope(args.urls, same_domain=not args.any_domain, include=args.include, exclude=args.exclude)
+            results = [result for _, _, result in crawl(args.urls, fetch, max_depth=args.max_depth, max_pages=args.max_pages, scope=scope)]
+        else:
+            results = fetch(args.urls)
+        not_modified = sum(1 for result in results if is_not_modified(result))
+        near_duplicate = sum(1 for result in results if is_near_duplicate(result))
+        limited = sum(1 for result in results if is_fetch_limited(result))
+        truncated = sum(1 for result in results if is_truncated(result) and not is_near_duplicate(result))
+        succeeded = sum(1 for result in results if result) - not_modified - near_duplicate - limited
+        logging.info(f"スクレイピングが完了しました（成功: {succeeded}件（うち切り詰め: {truncated}件） / 更新なし: {not_modified}件 / "
+                     f"ほぼ同じ内容: {near_duplicate}件 / 上限超過: {limited}件 / 全{len(results)}件）")
+        return
+    
     # スクレイピングの実行
     result = scrape_website(
-        url=args.url,
+        url=args.urls[0],
         output_dir=args.output_dir,
         min_text_length=args.min_text_length,
         delay=args.delay,
-        user_agent=args.user_agent
+        user_agent=args.user_agent,
+        parser=args.parser,
+        use_cache=not args.no_cache,
+        sink=args.sink
     )
     
-    if result:
+    if is_not_modified(result):
+        logging.info("ページは前回の取得から更新されていないため、保存をスキップしました。")
+    elif is_near_duplicate(result):
+        logging.info("ページは保存済みのスナップショットとほぼ同じ内容のため、全体の保存をスキップしました。")
+    elif is_fetch_limited(result):
+        logging.error(f"ページが取得の上限を超えたため、取得をやめました（{result['status']}）。")
+    elif is_truncated(result):
+        logging.warning("本文が上限を超えたため、先頭だけを解析して保存しました。")
+    elif result:
         logging.info("スクレイピングが正常に完了しました。")
     else:
         logging.error("スクレイピングに失敗しました。")
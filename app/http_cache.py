@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from config import HTTP_CACHE_DIR, HTTP_CACHE_ENABLED
+
+# 前回から更新されていないページの結果ステータス
+NOT_MODIFIED = 'not_modified'
+
+def not_modified_result(url):
+    """更新されていないページの結果（タスクの結果としてそのまま返せる）"""
+    return {'url': url, 'status': NOT_MODIFIED}
+
+def is_not_modified(result):
+    """結果が「更新なし」かどうかを返す"""
+    return isinstance(result, dict) and result.get('status') == NOT_MODIFIED
+
+def body_hash(body):
+    """レスポンス本文のハッシュを返す"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+class HttpCache:
+    """URLごとのETag/Last-Modifiedと本文のハッシュを保存する条件付きGET用のキャッシュ
+
+    次回の取得時にIf-None-Match/If-Modified-Sinceを送り、304が返れば
+    解析・抽出・保存をすべて省略できる。検証用ヘッダーを返さないサーバーでも、
+    本文のハッシュが前回と同じなら更新なしとして扱う。
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def load(self, url):
+        """保存済みのエントリを返す（なければNone）"""
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"HTTPキャッシュの読み込みに失敗しました: {e}")
+            return None
+
+    def conditional_headers(self, url):
+        """条件付きGETのリクエストヘッダーを返す"""
+        entry = self.load(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_unchanged(self, url, body):
+        """本文が前回保存したときと同じかどうかを返す"""
+        entry = self.load(url)
+        return bool(entry) and entry.get('body_hash') == body_hash(body)
+
+    def store(self, url, response_headers, body, links=None):
+        """ページを処理できたときに検証用ヘッダーと本文のハッシュを保存する
+
+        linksにはページのリンクを保存し、更新のなかったページからもクロールを続けられるようにする
+        （省略した場合は前回保存したリンクを引き継ぐ）。
+        """
+        if links is None:
+            links = (self.load(url) or {}).get('links')
+        entry = {
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'body_hash': body_hash(body),
+            'fetched_at': time.time(),
+            'links': links,
+        }
+        path = self._path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルを読まないよう、一時ファイル（プロセスとスレッドごと）に書いてから置き換える
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"HTTPキャッシュの書き込みに失敗しました: {e}")
+
+# プロセスで共有するキャッシュ（無効の場合はNone）
+http_cache = HttpCache() if HTTP_CACHE_ENABLED else None
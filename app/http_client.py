@@ -0,0 +1,87 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_SESSION_POOL_SIZE
+
+def _accept_encoding():
+    """デコードできる圧縮形式のAccept-Encodingを返す（brotliはパッケージがある場合のみ）"""
+    try:
+        import brotli  # noqa: F401
+        return 'br, gzip'
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+            return 'br, gzip'
+        except ImportError:
+            return 'gzip'
+
+ACCEPT_ENCODING = _accept_encoding()
+
+def create_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+    """コネクションプールを持つSessionを作成する
+
+    pool_connectionsは保持するホスト（プール）の数、pool_maxsizeはホストごとに
+    再利用する接続の数。同じホストへの2回目以降のリクエストはTCP/TLSの
+    ハンドシェイクを省略してkeep-aliveの接続を使う。
+    requests（urllib3）はHTTP/1.1だけを使う（HTTP/2を使わない理由はREADMEのHTTP Connectionsを参照）。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return session
+
+class SessionPool:
+    """スレッドやグリーンスレッド（gevent / eventlet）の間で使い回すSessionのプール
+
+    requests.SessionはCookieや接続の状態を持ち、同時に複数のリクエストで使うことは保証されていないため、
+    リクエストの間だけ1つのSessionを借りて、終わったら返す（borrow）。返したSessionは
+    最後に使ったものから貸し出すため、keep-aliveの接続はタスクやスレッドをまたいで再利用される。
+    返されたときにmax_idle個を超えているSessionは閉じる。
+    fork後の子プロセスでは親の接続を共有しないように作り直す。
+    """
+
+    def __init__(self, max_idle=HTTP_SESSION_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        return create_session()
+
+    def _release(self, session):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(session)
+                return
+        session.close()
+
+    @contextmanager
+    def borrow(self):
+        """Sessionを1つ借りる（withを抜けるとプールに返す）"""
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+# プロセスで共有するSessionのプール（Celeryのワーカープロセス内ではタスクをまたいで使われる）
+session_pool = SessionPool()
+
+def borrow_session():
+    """プロセスで共有するプールからSessionを借りる（with borrow_session() as session: ...）"""
+    return session_pool.borrow()
@@ -0,0 +1,267 @@
+"""複数キーワードのフィルタ（Aho-Corasick）
+
+キーワードの式は、キーワードをAND・OR・NOTと括弧で組み合わせて書く:
+    タイミー OR メルカリ
+    (タイミー OR メルカリ) AND NOT 求人
+    "スキマ バイト", タイミー
+
+カンマと|はORと同じ。演算子を挟まずに並べた語は空白を含めて1つのキーワードになる
+（従来の1キーワードの指定と同じ）。引用符で囲むと演算子と同じ語もキーワードにできる。
+式は1回だけコンパイルし、正規化したすべてのキーワードを1つのオートマトンにまとめるため、
+本文・タイトル・説明はキーワードの数によらずそれぞれ1回だけ走査する。
+"""
+import logging
+import re
+from collections import deque
+from functools import lru_cache
+
+from normalizer import normalize_japanese_text, normalize_for_match  # noqa: F401
+
+# 走査するフィールドと、ログに表示する名前
+FIELDS = ('content', 'title', 'description')
+FIELD_NAMES = {'content': '本文', 'title': 'タイトル', 'description': '説明'}
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+_TOKEN = re.compile(r'\s*(?:"([^"]*)"|([(),|])|([^\s(),|"]+))')
+
+class AhoCorasick:
+    """複数のパターンを1回の走査で探すオートマトン"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto = [{}]
+        output = [()]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append(())
+                state = next_state
+            output[state] += (index,)
+
+        # 失敗遷移を幅優先で求め、失敗先の出力を合わせておく
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                target = fail[state]
+                while target and char not in goto[target]:
+                    target = fail[target]
+                fail[next_state] = goto[target].get(char, 0)
+                output[next_state] += output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self._alphabet = frozenset(char for pattern in self.patterns for char in pattern)
+
+    def counts(self, text):
+        """パターンの番号ごとの出現回数を返す（出現しないパターンは含まない）"""
+        goto, fail, output, alphabet = self._goto, self._fail, self._output, self._alphabet
+        counts = {}
+        state = 0
+        for char in text:
+            # パターンに含まれない文字では必ず初期状態に戻る
+            if char not in alphabet:
+                state = 0
+                continue
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                counts[index] = counts.get(index, 0) + 1
+        return counts
+
+class _PyAhoCorasick:
+    """pyahocorasick（C拡張）のオートマトン（AhoCorasickと同じインターフェース）"""
+
+    def __init__(self, patterns, ahocorasick):
+        self.patterns = list(patterns)
+        self._automaton = ahocorasick.Automaton()
+        for index, pattern in enumerate(self.patterns):
+            self._automaton.add_word(pattern, index)
+        self._automaton.make_automaton()
+
+    def counts(self, text):
+        counts = {}
+        for _, index in self._automaton.iter(text):
+            counts[index] = counts.get(index, 0) + 1
+        return counts
+
+def build_automaton(patterns):
+    """パターンのオートマトンを作る（pyahocorasickがあれば使い、なければ純Pythonで作る）"""
+    try:
+        import ahocorasick
+    except ImportError:
+        return AhoCorasick(patterns)
+    if not patterns:
+        return AhoCorasick(patterns)
+    return _PyAhoCorasick(patterns, ahocorasick)
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    while True:
+        match = _TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        quoted, symbol, word = match.groups()
+        if quoted is not None:
+            tokens.append(('term', quoted))
+        elif symbol is not None:
+            tokens.append(('OR', symbol) if symbol in ',|' else (symbol, symbol))
+        elif word in OPERATORS:
+            tokens.append((word, word))
+        elif tokens and tokens[-1][0] == 'word':
+            # 演算子を挟まない語は空白を含めて1つのキーワードにする
+            tokens[-1] = ('word', f"{tokens[-1][1]} {word}")
+        else:
+            tokens.append(('word', word))
+    if expression[position:].strip():
+        raise ValueError(f"キーワードの式を解釈できません: {expression}")
+    return [('term', value) if kind == 'word' else (kind, value) for kind, value in tokens]
+
+def parse_expression(expression):
+    """キーワードの式を構文木にする
+
+    構文木は('term', キーワード)、('not', 木)、('and', [木, ...])、('or', [木, ...])のタプル。
+    式が正しくない場合はValueErrorを送出する。
+    """
+    tokens = _tokenize(expression)
+    position = 0
+
+    def peek():
+        return tokens[position][0] if position < len(tokens) else None
+
+    def parse_or():
+        nonlocal position
+        nodes = [parse_and()]
+        while peek() == 'OR':
+            position += 1
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and():
+        nonlocal position
+        nodes = [parse_unary()]
+        while peek() in ('AND', 'NOT', '(', 'term'):
+            # ANDは省略できる（「"A" "B"」「A NOT B」など）
+            if peek() == 'AND':
+                position += 1
+            nodes.append(parse_unary())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_unary():
+        nonlocal position
+        kind = peek()
+        if kind == 'NOT':
+            position += 1
+            return ('not', parse_unary())
+        if kind == '(':
+            position += 1
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError(f"キーワードの式の括弧が閉じていません: {expression}")
+            position += 1
+            return node
+        if kind == 'term':
+            position += 1
+            return ('term', tokens[position - 1][1])
+        raise ValueError(f"キーワードの式が正しくありません: {expression}")
+
+    if not tokens:
+        raise ValueError("キーワードが指定されていません")
+    tree = parse_or()
+    if position < len(tokens):
+        raise ValueError(f"キーワードの式が正しくありません: {expression}")
+    return tree
+
+class KeywordFilter:
+    """キーワードの式をコンパイルしたフィルタ
+
+    expressionは式の文字列か、キーワードのリスト（いずれかを含めば一致）。
+    式として解釈できない文字列は、全体を1つのキーワードとして扱う。
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        if isinstance(expression, str):
+            try:
+                self._tree = parse_expression(expression)
+            except ValueError as e:
+                logging.warning(f"{e}（全体を1つのキーワードとして扱います）")
+                self._tree = ('term', expression.strip())
+        else:
+            self._tree = ('or', [('term', keyword) for keyword in expression])
+
+        # 正規化すると同じになるキーワードは1つのパターンにまとめる
+        self.keywords = []
+        self._keyword_patterns = {}
+        patterns = {}
+        self._collect(self._tree, patterns)
+        self._pattern_keywords = [[] for _ in patterns]
+        for keyword, pattern_index in self._keyword_patterns.items():
+            if pattern_index is not None:
+                self._pattern_keywords[pattern_index].append(keyword)
+        self._automaton = build_automaton(list(patterns))
+
+    def _collect(self, node, patterns):
+        kind, value = node
+        if kind == 'term':
+            if value not in self._keyword_patterns:
+                self.keywords.append(value)
+                pattern = normalize_for_match(value)
+                # 正規化すると空になるキーワードはどのページにも一致しない
+                self._keyword_patterns[value] = patterns.setdefault(pattern, len(patterns)) if pattern else None
+        elif kind == 'not':
+            self._collect(value, patterns)
+        else:
+            for child in value:
+                self._collect(child, patterns)
+
+    def scan(self, data):
+        """各フィールドを1回ずつ走査し、{キーワード: {フィールド: 出現回数}}を返す"""
+        hits = {}
+        for field in FIELDS:
+            text = data.get(field)
+            if not text:
+                continue
+            for pattern_index, count in self._automaton.counts(normalize_for_match(text)).items():
+                for keyword in self._pattern_keywords[pattern_index]:
+                    hits.setdefault(keyword, {})[field] = count
+        return hits
+
+    def evaluate(self, hits, node=None):
+        """scan()の結果が式を満たすかどうかを返す"""
+        kind, value = node or self._tree
+        if kind == 'term':
+            return value in hits
+        if kind == 'not':
+            return not self.evaluate(hits, value)
+        if kind == 'and':
+            return all(self.evaluate(hits, child) for child in value)
+        return any(self.evaluate(hits, child) for child in value)
+
+    def match(self, data):
+        """データが式を満たすかどうかと、scan()の結果を返す"""
+        hits = self.scan(data)
+        return self.evaluate(hits), hits
+
+@lru_cache(maxsize=64)
+def _compile(expression):
+    return KeywordFilter(expression)
+
+def compile_keyword_filter(expression):
+    """キーワードの式をコンパイルする（同じ式はプロセスで1回だけコンパイルする）"""
+    if not isinstance(expression, str):
+        expression = tuple(expression)
+    return _compile(expression)
@@ -0,0 +1,143 @@
+"""APIを使わない抽出型の要約（TextRank）
+
+本文を文（。！？と改行で区切る。半角の!?は後ろが空白の場合だけ）に分け、文字bigramのTF-IDFのベクトルの類似度で文のグラフを作り、
+TextRankで重要な文を選んで箇条書き・段落・見出しにする。類似度はNumPyの行列積でまとめて計算するため、
+1ページ数ミリ秒で要約できる。
+
+選んだ文が本文全体の内容をどれだけ表しているか（coverage、本文と要約のベクトルのコサイン類似度）も返す。
+SCRAPER_SUMMARY_ENGINE=autoでは、coverageの低いページだけをGeminiで要約する。
+"""
+import re
+
+import numpy as np
+
+from normalizer import normalize_japanese_text
+from text_index import bigram_tokens
+from config import SUMMARY_LOCAL_MIN_SENTENCE, SUMMARY_LOCAL_MAX_SENTENCES
+
+# 文の区切り（句点・感嘆符・疑問符の後と改行。半角の!?は「Yahoo!ニュース」のような語の中では区切らない）
+_SENTENCE_END = re.compile(r'(?<=[。！？])|(?<=[!?])(?=\s)|\n+')
+
+# TextRankの減衰率と反復
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+
+# 箇条書きにする文の数（本文の文が少ない場合はそれより少なくなる）
+BULLET_MIN = 3
+BULLET_MAX = 5
+HEADLINE_LENGTH = 30
+
+def split_sentences(text, min_length=SUMMARY_LOCAL_MIN_SENTENCE, max_sentences=SUMMARY_LOCAL_MAX_SENTENCES):
+    """本文を文のリストにする（min_length文字未満の文は除き、先頭からmax_sentences文まで）"""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text or ''):
+        sentence = sentence.strip()
+        if len(sentence) >= min_length:
+            sentences.append(sentence)
+            if len(sentences) >= max_sentences:
+                break
+    return sentences
+
+def tfidf_matrix(texts):
+    """テキストごとの文字bigramのTF-IDFのベクトル（行を長さ1に正規化した行列）を返す"""
+    vocabulary = {}
+    rows, columns, values = [], [], []
+    for row, text in enumerate(texts):
+        counts = {}
+        for token in bigram_tokens(normalize_japanese_text(text.lower())):
+            column = vocabulary.setdefault(token, len(vocabulary))
+            counts[column] = counts.get(column, 0) + 1
+        rows.extend([row] * len(counts))
+        columns.extend(counts)
+        values.extend(counts.values())
+
+    matrix = np.zeros((len(texts), max(1, len(vocabulary))))
+    matrix[rows, columns] = np.log1p(values)
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    matrix *= np.log((1 + len(texts)) / (1 + document_frequency)) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def textrank(similarity, personalization=None):
+    """類似度の行列から、文ごとのTextRankのスコアを返す（personalizationは飛び先の重み）"""
+    count = similarity.shape[0]
+    similarity = similarity.copy()
+    np.fill_diagonal(similarity, 0)
+    weights = similarity.sum(axis=1, keepdims=True)
+    # 他の文と似ていない文からは、すべての文に等しく移る
+    transition = np.where(weights > 0, similarity / np.where(weights == 0, 1, weights), 1.0 / count)
+    teleport = np.full(count, 1.0 / count) if personalization is None else personalization / personalization.sum()
+
+    scores = np.full(count, 1.0 / count)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) * teleport + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            return updated
+        scores = updated
+    return scores
+
+def rank_sentences(sentences, title=None):
+    """文の重要度（TextRank）と、文のTF-IDFの行列を返す
+
+    タイトルがあれば、タイトルに似た文に飛びやすくする（タイトルの話題を中心に選ぶ）。
+    """
+    matrix = tfidf_matrix(sentences + [title] if title else sentences)
+    if title:
+        matrix, title_vector = matrix[:-1], matrix[-1]
+        personalization = 1 + matrix @ title_vector
+    else:
+        personalization = None
+    return textrank(matrix @ matrix.T, personalization), matrix
+
+def _select(sentences, scores, budget, minimum, maximum):
+    """重要な順にbudget文字以内でminimum〜maximum文を選び、本文の順番の位置のリストを返す"""
+    selected = []
+    length = 0
+    for index in np.argsort(-scores, kind='stable'):
+        if len(selected) >= maximum:
+            break
+        if len(selected) >= minimum and length + len(sentences[index]) > budget:
+            break
+        selected.append(int(index))
+        length += len(sentences[index])
+    return sorted(selected)
+
+def _truncate(text, length):
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+def extractive_summary(data, style='bullet', max_length=200):
+    """ページのタイトルと本文から重要な文を選んで要約し、(要約, coverage)を返す（文がなければ(None, 0.0)）
+
+    styleはbullet（3〜5文の箇条書き）/ paragraph / headline（30文字以内）。
+    max_lengthは要約の文字数の目安（Geminiのmax_output_tokensに合わせる）。
+    coverageは本文全体と選んだ文のTF-IDFのベクトルのコサイン類似度（0〜1）。
+    """
+    sentences = split_sentences(data.get('content'))
+    if not sentences and data.get('description'):
+        sentences = split_sentences(data['description'])
+    if not sentences:
+        return None, 0.0
+
+    scores, matrix = rank_sentences(sentences, data.get('title'))
+    if style == 'headline':
+        selected = [int(np.argmax(scores))]
+    elif style == 'bullet':
+        selected = _select(sentences, scores, max_length, min(BULLET_MIN, len(sentences)), BULLET_MAX)
+    else:
+        selected = _select(sentences, scores, max_length, 1, len(sentences))
+
+    document = matrix.sum(axis=0)
+    summary_vector = matrix[selected].sum(axis=0)
+    denominator = np.linalg.norm(document) * np.linalg.norm(summary_vector)
+    coverage = float(document @ summary_vector / denominator) if denominator else 0.0
+
+    if style == 'headline':
+        summary = _truncate(sentences[selected[0]], HEADLINE_LENGTH)
+    elif style == 'bullet':
+        # 長い文は切り詰めて、箇条書き全体をおおよそmax_length文字に収める
+        summary = '\n'.join(f"* {_truncate(sentences[index], max(HEADLINE_LENGTH, max_length // len(selected)))}"
+                             for index in selected)
+    else:
+        summary = _truncate(''.join(sentences[index] for index in selected), max_length)
+    return summary, round(coverage, 4)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from config import NEAR_DUP_MODE, NEAR_DUP_MAX_DISTANCE, NEAR_DUP_WINDOW, NEAR_DUP_INDEX_PATH
+
+# ほぼ同じ内容のため全体を保存しなかったページの結果ステータス
+NEAR_DUPLICATE = 'near_duplicate'
+
+# SimHashの特徴量にする文字n-gramの長さ（日本語は単語に区切れないため文字単位にする）
+SHINGLE_SIZE = 4
+
+# これより短い本文は指紋が不安定なため比較しない
+MIN_FINGERPRINT_LENGTH = 100
+
+_WHITESPACE = re.compile(r'\s+')
+
+def simhash(text, shingle_size=SHINGLE_SIZE):
+    """本文の64ビットSimHashを返す（短すぎる場合はNone）
+
+    空白をつぶした文字n-gramの集合を特徴量にする。サイドバーの一部が
+    入れ替わった程度の違いなら、ハミング距離は数ビットに収まる。
+    """
+    text = _WHITESPACE.sub(' ', text or '').strip()
+    if len(text) < MIN_FINGERPRINT_LENGTH:
+        return None
+    shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+
+    # ビットごとに1の数を数える（バイト位置ごとに値を集計してから展開すると速い）
+    bit_counts = [0] * 64
+    for position in range(8):
+        for value, count in Counter(digests[position::8]).items():
+            for bit in range(8):
+                if value >> bit & 1:
+                    bit_counts[position * 8 + bit] += count
+
+    half = len(shingles) / 2
+    fingerprint = 0
+    for bit, count in enumerate(bit_counts):
+        if count > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def hamming_distance(a, b):
+    """2つの指紋の異なるビット数を返す"""
+    return bin(a ^ b).count('1')
+
+def near_duplicate_result(data, match):
+    """ほぼ同じ内容のスナップショットの結果（全体の代わりに保存する参照）
+
+    linksはクロールを続けるために結果に含めるが、参照のファイルには保存しない。
+    """
+    return {
+        'url': data['url'],
+        'title': data.get('title'),
+        'status': NEAR_DUPLICATE,
+        'duplicate_of': match['basename'],
+        'duplicate_url': match['url'],
+        'distance': match['distance'],
+        'canonical_url': data.get('canonical_url'),
+        'links': data.get('links', []),
+    }
+
+def is_near_duplicate(result):
+    """結果が「ほぼ同じ内容」かどうかを返す"""
+    return isinstance(result, dict) and result.get('status') == NEAR_DUPLICATE
+
+def _to_signed(fingerprint):
+    # SQLiteのINTEGERは符号付き64ビットのため変換して保存する
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+class FingerprintIndex:
+    """ドメインごとに保存したスナップショットの指紋を記録するインデックス（SQLite）
+
+    新しいページの指紋を、同じURLで直近にwindow件保存したスナップショットと比較し、
+    ハミング距離がmax_distance以下のものがあればそのスナップショットを返す。
+    同じドメインの別のURL（同じ記事の別の表記など）は、指紋が一致する場合だけ重複とみなす。
+    参照先は常に全体を保存したスナップショットになる（参照の参照は作らない）。
+    """
+
+    def __init__(self, path=NEAR_DUP_INDEX_PATH, max_distance=NEAR_DUP_MAX_DISTANCE, window=NEAR_DUP_WINDOW):
+        self.path = path
+        self.max_distance = max_distance
+        self.window = window
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # fork後の子プロセスでは親の接続を使わずに開き直す
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints ('
+                'domain TEXT NOT NULL, url TEXT NOT NULL, fingerprint INTEGER NOT NULL, basename TEXT NOT NULL, saved_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS fingerprints_url ON fingerprints (domain, url, saved_at)')
+            connection.execute('CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints (domain, fingerprint)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def find(self, url, fingerprint):
+        """ほぼ同じ内容の保存済みスナップショットを返す（なければNone）
+
+        同じURLのスナップショットを優先し、次に距離の近いものを選ぶ。
+        """
+        domain = urlparse(url).netloc.lower()
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT url, fingerprint, basename FROM fingerprints WHERE domain = ? AND url = ? ORDER BY saved_at DESC LIMIT ?',
+                (domain, url, self.window)
+            ).fetchall()
+            # 同じテンプレートの別ページは距離が近くなりやすいため、別のURLは指紋が一致する場合だけ重複とみなす
+            rows += connection.execute(
+                'SELECT url, fingerprint, basename FROM fingerprints WHERE domain = ? AND fingerprint = ? AND url != ? LIMIT 1',
+                (domain, _to_signed(fingerprint), url)
+            ).fetchall()
+
+        best = None
+        for row_url, row_fingerprint, basename in rows:
+            distance = hamming_distance(fingerprint, row_fingerprint % (1 << 64))
+            if distance > self.max_distance:
+                continue
+            rank = (row_url != url, distance)
+            if best is None or rank < best[0]:
+                best = (rank, {'url': row_url, 'basename': basename, 'distance': distance})
+        return best[1] if best else None
+
+    def add(self, url, fingerprint, basename):
+        """全体を保存したスナップショットの指紋を記録する"""
+        domain = urlparse(url).netloc.lower()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?)',
+                    (domain, url, _to_signed(fingerprint), basename, time.time())
+                )
+
+# プロセスで共有するインデックス（無効の場合はNone）
+fingerprint_index = FingerprintIndex() if NEAR_DUP_MODE in ('reference', 'skip') else None
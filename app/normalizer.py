@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import jaconv
+
+from config import NORMALIZED_CACHE_ENABLED, NORMALIZED_CACHE_PATH, NORMALIZED_MEMO_SIZE, NORMALIZED_MIN_PERSIST_LENGTH
+
+# 正規化の処理を変えたら上げる（保存済みの正規化テキストを使わないようにする）
+NORMALIZE_VERSION = 2
+
+# 正規化したテキストを保存するフィールド
+TEXT_FIELDS = ('title', 'description', 'content')
+
+def normalize_japanese_text(text):
+    """日本語テキストを正規化する
+
+    ひらがな、カタカナ、漢字などの異なる文字種を統一的に扱うための正規化を行います。
+    現在の実装では、半角カタカナを全角にしてから、すべてのカタカナをひらがなに変換します。
+    """
+    if not text:
+        return text
+
+    # カタカナをひらがなに変換
+    normalized_text = jaconv.h2z(text, kana=True, digit=False, ascii=False)  # 半角カタカナを全角に変換
+    normalized_text = jaconv.z2h(normalized_text, kana=False, digit=True, ascii=True)  # 全角英数字を半角に変換
+    normalized_text = jaconv.kata2hira(normalized_text)  # カタカナをひらがなに変換
+
+    return normalized_text
+
+def text_hash(text):
+    """テキストのハッシュ（正規化したテキストのキー）を返す"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16, person=b'normalize-v%d' % NORMALIZE_VERSION).digest()
+
+class NormalizedTextCache:
+    """小文字にして正規化したテキストのキャッシュ
+
+    元のテキストのハッシュをキーにして、プロセス内のLRU（memo_size件）と
+    SQLiteのファイル（保存したレコードの正規化テキスト）の2段で保持する。
+    キーワードの再フィルタリングや全文検索インデックスの再構築では、
+    保存済みのレコードを正規化し直さずにここから取り出す。
+    min_length文字より短いテキストは正規化の方が速いため、ファイルには保存しない。
+    """
+
+    def __init__(self, path=NORMALIZED_CACHE_PATH, memo_size=NORMALIZED_MEMO_SIZE, min_length=NORMALIZED_MIN_PERSIST_LENGTH):
+        self.path = path
+        self.memo_size = memo_size
+        self.min_length = min_length
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._stats = {'memo_hits': 0, 'stored_hits': 0, 'misses': 0}
+
+    def _connect(self):
+        # fork後の子プロセスでは親の接続を使わずに開き直す
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS normalized_text (hash BLOB PRIMARY KEY, text TEXT NOT NULL)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key, normalized):
+        self._memo[key] = normalized
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def normalize(self, text):
+        """テキストを小文字にして正規化する（キャッシュにあればそれを返す）"""
+        if not text:
+            return ''
+        key = text_hash(text)
+        with self._lock:
+            normalized = self._memo.get(key)
+            if normalized is not None:
+                self._memo.move_to_end(key)
+                self._stats['memo_hits'] += 1
+                return normalized
+
+            persist = len(text) >= self.min_length
+            if persist:
+                try:
+                    row = self._connect().execute('SELECT text FROM normalized_text WHERE hash = ?', (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logging.warning(f"正規化テキストのキャッシュを読み込めませんでした: {e}")
+                    row = None
+                    persist = False
+                if row:
+                    self._stats['stored_hits'] += 1
+                    self._remember(key, row[0])
+                    return row[0]
+
+        normalized = normalize_japanese_text(text.lower())
+        with self._lock:
+            self._stats['misses'] += 1
+            self._store(key, normalized, persist)
+        return normalized
+
+    def store(self, text, normalized):
+        """別のプロセス（パイプラインの解析のワーカー）で正規化したテキストを保存する"""
+        if not text:
+            return
+        with self._lock:
+            self._store(text_hash(text), normalized, len(text) >= self.min_length)
+
+    def _store(self, key, normalized, persist):
+        self._remember(key, normalized)
+        if persist:
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.execute('INSERT OR IGNORE INTO normalized_text VALUES (?, ?)', (key, normalized))
+            except sqlite3.Error as e:
+                logging.warning(f"正規化テキストのキャッシュに保存できませんでした: {e}")
+
+    def normalize_record(self, record):
+        """レコードのタイトル・説明・本文を正規化し、{フィールド: 正規化テキスト}を返す"""
+        return {field: self.normalize(record.get(field)) for field in TEXT_FIELDS}
+
+    def stats(self):
+        """キャッシュのヒット数（プロセス内 / ファイル）と正規化した回数を返す"""
+        with self._lock:
+            return dict(self._stats)
+
+# プロセスで共有するキャッシュ（無効の場合はNone）
+normalized_text_cache = NormalizedTextCache() if NORMALIZED_CACHE_ENABLED else None
+
+def normalize_for_match(text):
+    """キーワード・フィルタ・全文検索に共通の正規化（小文字化してnormalize_japanese_text）を行う"""
+    if not text:
+        return ''
+    if normalized_text_cache:
+        return normalized_text_cache.normalize(text)
+    return normalize_japanese_text(text.lower())
+
+def normalize_fields(record):
+    """レコードのタイトル・説明・本文を正規化する（キャッシュを使わない。パイプラインの解析のワーカーで使う）"""
+    return {field: normalize_japanese_text((record.get(field) or '').lower()) for field in TEXT_FIELDS}
+
+def store_normalized_fields(record, normalized=None):
+    """保存したレコードの正規化テキストをキャッシュに保存しておく（キャッシュが無効なら何もしない）
+
+    normalizedには正規化済みのフィールド（normalize_fieldsの戻り値）を渡せる。
+    """
+    if not normalized_text_cache:
+        return
+    if normalized is None:
+        normalized_text_cache.normalize_record(record)
+        return
+    for field in TEXT_FIELDS:
+        normalized_text_cache.store(record.get(field), normalized[field])
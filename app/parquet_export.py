@@ -0,0 +1,256 @@
+"""クロール結果をドメインと日付で分割したParquetに書き出す
+
+保存先（SCRAPER_SINK=parquet）として使うほか、保存済みのJSON（ページごとのファイル）と
+JSON Linesのセグメントを変換・統合するコマンドとしても使える。
+
+    data/parquet/domain=news.yahoo.co.jp/date=2025-03-28/part-....parquet
+
+分析では必要な列だけを読み込める:
+    pyarrow.parquet.read_table('data/parquet', columns=['title', 'content_length'],
+                               filters=[('date', '>=', '2025-03-01')])
+
+使い方:
+    python parquet_export.py [--input data] [--output data/parquet] [--compact | --compact-only]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+from urllib.parse import urlparse
+
+from config import PARQUET_DIR, PARQUET_BATCH_SIZE
+from sinks import read_records
+
+# ページごとのJSONファイル名に含まれる保存時刻
+_FILENAME_TIMESTAMP = re.compile(r'_(\d{8}_\d{6})(?:_\d+)?(?:_filtered|_summary)?\.json$')
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet  # noqa: F401
+        return pyarrow
+    except ImportError:
+        raise ImportError("Parquetの書き出しにはpyarrowパッケージが必要です。pip install pyarrowでインストールしてください。")
+
+def record_schema(pa):
+    """Parquetの列の型（domainとdateはディレクトリの分割に使う）"""
+    return pa.schema([
+        ('record_id', pa.string()),
+        ('kind', pa.dictionary(pa.int8(), pa.string())),
+        ('status', pa.dictionary(pa.int8(), pa.string())),
+        ('url', pa.string()),
+        ('canonical_url', pa.string()),
+        ('domain', pa.dictionary(pa.int32(), pa.string())),
+        ('date', pa.string()),
+        ('saved_at', pa.timestamp('s')),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('content', pa.string()),
+        ('content_length', pa.int32()),
+        ('images', pa.list_(pa.string())),
+        ('image_count', pa.int32()),
+        ('links', pa.list_(pa.string())),
+        ('link_count', pa.int32()),
+        ('summary', pa.string()),
+        ('duplicate_of', pa.string()),
+    ])
+
+def _saved_at(record):
+    value = record.get('saved_at')
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.now()
+
+def _string_list(values):
+    if not values:
+        return []
+    if isinstance(values, str):
+        return [value for value in values.split(',') if value]
+    return [str(value) for value in values]
+
+def records_to_table(records):
+    """レコード（extract_contentの結果など）のリストをArrowのテーブルにする"""
+    pa = _pyarrow()
+    schema = record_schema(pa)
+    columns = {field.name: [] for field in schema}
+    for record in records:
+        saved_at = _saved_at(record)
+        images = _string_list(record.get('images'))
+        links = _string_list(record.get('links'))
+        content = record.get('content')
+        columns['record_id'].append(record.get('record_id') or uuid.uuid4().hex)
+        columns['kind'].append(record.get('kind') or 'page')
+        columns['status'].append(record.get('status') or 'saved')
+        columns['url'].append(record.get('url'))
+        columns['canonical_url'].append(record.get('canonical_url'))
+        columns['domain'].append(urlparse(record.get('url') or '').netloc.lower())
+        columns['date'].append(saved_at.strftime('%Y-%m-%d'))
+        columns['saved_at'].append(saved_at.replace(tzinfo=None, microsecond=0))
+        columns['title'].append(record.get('title'))
+        columns['description'].append(record.get('description'))
+        columns['content'].append(content)
+        columns['content_length'].append(len(content) if content else 0)
+        columns['images'].append(images)
+        columns['image_count'].append(len(images))
+        columns['links'].append(links)
+        columns['link_count'].append(len(links))
+        columns['summary'].append(record.get('summary'))
+        columns['duplicate_of'].append(record.get('duplicate_of'))
+    return pa.table([pa.array(columns[field.name], type=field.type) for field in schema], schema=schema)
+
+def write_partitioned(records, root):
+    """レコードをdomain・dateで分割したParquetファイルとして追加する（書き込んだ件数を返す）"""
+    if not records:
+        return 0
+    pa = _pyarrow()
+    table = records_to_table(records)
+    partitioning = pa.dataset.partitioning(pa.schema([('domain', pa.string()), ('date', pa.string())]), flavor='hive')
+    pa.dataset.write_dataset(
+        table,
+        root,
+        format='parquet',
+        partitioning=partitioning,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=pa.dataset.ParquetFileFormat().make_write_options(compression='zstd'),
+    )
+    return table.num_rows
+
+class ParquetSink:
+    """レコードをbatch_size件ずつまとめてParquetに書き出す保存先
+
+    書き込みのたびに分割ごとのファイルが増えるため、batch_sizeは大きめにし、
+    小さなファイルはcompact()でまとめる。
+    """
+
+    def __init__(self, output_dir, batch_size=PARQUET_BATCH_SIZE):
+        _pyarrow()
+        self.root = os.path.join(output_dir, PARQUET_DIR)
+        self.batch_size = batch_size
+        self._buffer = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, record, kind='page'):
+        """レコードをバッファに入れ、レコードIDを返す"""
+        record_id = uuid.uuid4().hex
+        entry = {'record_id': record_id, 'kind': kind, 'saved_at': datetime.now().isoformat(timespec='seconds')}
+        entry.update(record)
+        with self._lock:
+            # fork後の子プロセスでは親のバッファを引き継がない
+            if self._pid != os.getpid():
+                self._buffer = []
+                self._pid = os.getpid()
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+        return record_id
+
+    def flush(self):
+        """バッファのレコードをParquetに書き込む"""
+        with self._lock:
+            if self._pid != os.getpid() or not self._buffer:
+                return
+            records, self._buffer = self._buffer, []
+        count = write_partitioned(records, self.root)
+        logging.info(f"✅ {count}件のレコードをParquetに保存しました: {self.root}")
+
+    def close(self):
+        self.flush()
+
+def load_json_records(input_dir):
+    """ページごとに保存したJSONファイルをレコードとして読み込む（保存時刻はファイル名から復元する）"""
+    for path in sorted(glob.glob(os.path.join(input_dir, '*.json'))):
+        try:
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"JSONファイルを読み込めませんでした: {path} ({e})")
+            continue
+        if not isinstance(record, dict) or 'url' not in record:
+            continue
+        match = _FILENAME_TIMESTAMP.search(os.path.basename(path))
+        if match:
+            saved_at = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S')
+        else:
+            saved_at = datetime.fromtimestamp(os.path.getmtime(path))
+        record.setdefault('saved_at', saved_at.isoformat())
+        suffix = os.path.splitext(path)[0].rsplit('_', 1)[-1]
+        record.setdefault('kind', suffix if suffix in ('filtered', 'summary') else 'page')
+        # ファイル名をIDにして、何度変換しても統合時に重複を取り除けるようにする
+        record.setdefault('record_id', os.path.splitext(os.path.basename(path))[0])
+        yield record
+
+def export(input_dir, root, batch_size=PARQUET_BATCH_SIZE):
+    """保存済みのJSONファイルとJSON Linesのセグメントを変換する（変換した件数を返す）"""
+    total = 0
+    batch = []
+    for source in (load_json_records(input_dir), read_records(input_dir, kind=None)):
+        for record in source:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                total += write_partitioned(batch, root)
+                batch = []
+    total += write_partitioned(batch, root)
+    return total
+
+def compact(root):
+    """分割ごとのParquetファイルを1つにまとめ、record_idの重複を取り除く（まとめた分割の数を返す）"""
+    pa = _pyarrow()
+    compacted = 0
+    for directory in sorted(glob.glob(os.path.join(root, 'domain=*', 'date=*'))):
+        paths = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+        if len(paths) < 2:
+            continue
+        # 分割の列（domain・date）はディレクトリ名にあるため、ファイルには含めない
+        table = pa.parquet.read_table(paths, partitioning=None)
+        # 同じrecord_idは最初の1件だけを残す
+        seen = set()
+        keep = []
+        for index, record_id in enumerate(table.column('record_id').to_pylist()):
+            if record_id not in seen:
+                seen.add(record_id)
+                keep.append(index)
+        if len(keep) < table.num_rows:
+            table = table.take(pa.array(keep))
+        table = table.sort_by('saved_at')
+        temp_path = os.path.join(directory, f"compacted-{uuid.uuid4().hex}.parquet.tmp")
+        pa.parquet.write_table(table, temp_path, compression='zstd')
+        os.replace(temp_path, os.path.join(directory, os.path.basename(temp_path)[:-len('.tmp')]))
+        for path in paths:
+            os.remove(path)
+        compacted += 1
+        logging.info(f"{len(paths)}ファイル（{table.num_rows}件）を1ファイルにまとめました: {directory}")
+    return compacted
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='クロール結果をドメインと日付で分割したParquetに書き出す')
+    parser.add_argument('--input', '-i', default='data', help='JSONファイルとJSON Linesのセグメントがあるディレクトリ（デフォルト: data）')
+    parser.add_argument('--output', '-o', help=f'Parquetの出力先（デフォルト: <input>/{PARQUET_DIR}）')
+    parser.add_argument('--compact', action='store_true', help='書き出した後、Parquetファイルを分割ごとに1つにまとめる')
+    parser.add_argument('--compact-only', action='store_true', help='書き出しを行わず、既存のParquetファイルをまとめるだけにする')
+    args = parser.parse_args()
+
+    root = args.output or os.path.join(args.input, PARQUET_DIR)
+    if not args.compact_only:
+        count = export(args.input, root)
+        logging.info(f"{count}件のレコードをParquetに書き出しました: {root}")
+    if args.compact or args.compact_only:
+        count = compact(root)
+        logging.info(f"{count}個の分割をまとめました: {root}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import logging
+
+from bs4 import BeautifulSoup, NavigableString, CData, Tag
+
+from config import PARSER_BACKEND
+
+# 走査イベントの種類
+START, END, TEXT = range(3)
+
+# 本文テキストとして扱う文字列の種類
+MAIN_TEXT = 'main'
+
+# 独自の文字列コンテナとして扱われるタグ（BeautifulSoupのHTMLTreeBuilderと同じ）
+STRING_CONTAINER_TAGS = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+
+# 利用できるパーサーバックエンド
+PARSER_BACKENDS = ('html.parser', 'lxml', 'selectolax')
+
+def parse_html(html, backend=None):
+    """HTMLを指定されたバックエンドで解析する
+
+    html.parserとlxmlはBeautifulSoupオブジェクトを、selectolaxはLexborHTMLParserを返す。
+    バックエンドのパッケージがインストールされていない場合はhtml.parserで解析する。
+    """
+    backend = backend or PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        logging.warning(f"未知のパーサーバックエンドです: {backend}（html.parserを使用します）")
+        backend = 'html.parser'
+
+    if backend == 'selectolax':
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+            return LexborHTMLParser(html)
+        except ImportError:
+            logging.warning("selectolaxパッケージがインストールされていません。html.parserを使用します。")
+            backend = 'html.parser'
+
+    if backend == 'lxml':
+        try:
+            return BeautifulSoup(html, 'lxml')
+        except Exception as e:
+            # bs4.FeatureNotFound（lxml未インストール）
+            logging.warning(f"lxmlパーサーを使用できません: {e}（html.parserを使用します）")
+            backend = 'html.parser'
+
+    return BeautifulSoup(html, 'html.parser')
+
+def iter_events(document):
+    """解析済みドキュメントを文書順に1回だけ走査し、開始・終了・テキストのイベントを生成する
+
+    テキストイベントには文字列の種類を付ける。get_text()が拾う通常の文字列はMAIN_TEXT、
+    script/styleなどのコンテナ内の文字列はそのタグ名、コメント等はNoneになる。
+    """
+    if isinstance(document, Tag):
+        return iter_soup_events(document)
+    return iter_lexbor_events(document)
+
+def iter_soup_events(soup):
+    """BeautifulSoupのツリーのイベントを生成する"""
+    container_kinds = {cls: name for name, cls in soup.builder.string_containers.items()}
+    stack = [soup]
+    for element in soup.descendants:
+        parent = element.parent
+        while stack[-1] is not parent:
+            yield END, stack.pop().name, None
+        if isinstance(element, Tag):
+            yield START, element.name, element.attrs
+            stack.append(element)
+        else:
+            string_type = type(element)
+            if string_type is NavigableString or string_type is CData:
+                kind = MAIN_TEXT
+            else:
+                kind = container_kinds.get(string_type)
+            yield TEXT, element, kind
+    while len(stack) > 1:
+        yield END, stack.pop().name, None
+
+def iter_lexbor_events(tree):
+    """selectolax（lexbor）のツリーのイベントを生成する
+
+    文字列の種類はBeautifulSoupと同じく、最も内側の文字列コンテナのタグで決める。
+    値のない属性はBeautifulSoupに合わせて空文字にする。
+    """
+    node = tree.root
+    containers = []
+    while node is not None:
+        tag = node.tag
+        if tag == '-text':
+            yield TEXT, node.text_content, containers[-1] if containers else MAIN_TEXT
+        elif tag[0] in '-_#':
+            # コメント、doctypeなど
+            yield TEXT, '', None
+        else:
+            attrs = {name: value if value is not None else '' for name, value in node.attributes.items()}
+            yield START, tag, attrs
+            if tag in STRING_CONTAINER_TAGS:
+                containers.append(tag)
+            child = node.child
+            if child is not None:
+                node = child
+                continue
+            yield END, tag, None
+            if tag in STRING_CONTAINER_TAGS:
+                containers.pop()
+
+        # 次の兄弟へ。兄弟がなければ親を閉じながら上に戻る
+        while node is not None:
+            sibling = node.next
+            if sibling is not None:
+                node = sibling
+                break
+            node = node.parent
+            if node is None or node.tag[0] in '-_#':
+                node = None
+                break
+            yield END, node.tag, None
+            if node.tag in STRING_CONTAINER_TAGS:
+                containers.pop()
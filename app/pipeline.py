@@ -0,0 +1,155 @@
+"""取得と解析を分けたパイプライン
+
+1. 取得: AsyncFetcherと同じく非同期に並行して取得し（robots.txt・レート制限・条件付きGETも同じ）、
+   本文のバイト列をキューに入れる。解析と保存が終わっていないページはPIPELINE_QUEUE_SIZE件までで、
+   それを超える間は取得の枠（concurrency）を持ったまま待つため、次の取得も止まる（背圧）。
+   解析が追いつかないときでも、メモリにある本文はqueue_size + concurrency件を超えない。
+2. 解析: ProcessPoolExecutorの解析のワーカー（PIPELINE_PARSE_WORKERS、0はCPU数）で、
+   デコード・HTMLの解析・抽出・SimHash・正規化を行う。GILに縛られないため、1つのプロセスで全コアを使える。
+3. 保存: このプロセスの保存のスレッド（PIPELINE_STORE_WORKERS）で、ほぼ同じ内容の判定と保存先への書き込みを行う。
+   保存先とSQLiteへの書き込みは解析のワーカーでは行わない。
+
+結果はfetch_urlsにprocess_pageを渡した場合と同じ（URLと同じ順番のリスト）。
+
+デーモンのプロセス（Celeryのprefork（デフォルト）のワーカーの子プロセス）は子プロセスを作れないため、
+解析のワーカーのプールを作れない。Celeryでパイプラインを使う場合は、スレッドかsoloのワーカー
+（docker-compose.ymlのcelery_pipeline_worker）で実行する（tasks.page_fetcherはデーモンのプロセスでは
+警告を出してAsyncFetcherで取得する）。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import extract_page, store_page
+from async_fetcher import AsyncFetcher
+from charset_detect import decode_html
+from normalizer import normalize_fields
+from config import (NORMALIZED_CACHE_ENABLED, PIPELINE_PARSE_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_STORE_WORKERS,
+                    PIPELINE_START_METHOD)
+
+# プロセスで共有する解析のワーカーのプール（起動に時間がかかるため、取得のたびに作り直さない）
+_parse_executor = None
+_parse_executor_pid = None
+_parse_executor_lock = threading.Lock()
+
+def parse_workers(workers=PIPELINE_PARSE_WORKERS):
+    """解析のワーカーの数を返す（0以下はCPU数）"""
+    return workers if workers > 0 else os.cpu_count() or 1
+
+def can_start_parse_workers():
+    """このプロセスで解析のワーカーのプールを作れるか（デーモンのプロセスは子プロセスを作れない）"""
+    return not multiprocessing.current_process().daemon
+
+def get_parse_executor(workers=PIPELINE_PARSE_WORKERS, start_method=PIPELINE_START_METHOD):
+    """解析のワーカーのプールを返す（fork後の子プロセスでは作り直す）"""
+    global _parse_executor, _parse_executor_pid
+    with _parse_executor_lock:
+        if _parse_executor is None or _parse_executor_pid != os.getpid():
+            _parse_executor = ProcessPoolExecutor(max_workers=parse_workers(workers),
+                                                  mp_context=multiprocessing.get_context(start_method))
+            _parse_executor_pid = os.getpid()
+        return _parse_executor
+
+def shutdown_parse_executor():
+    """解析のワーカーのプールを終了する（次に使うときに作り直す）"""
+    global _parse_executor
+    with _parse_executor_lock:
+        executor, _parse_executor = _parse_executor, None
+        if executor is not None and _parse_executor_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def parse_page(url, body, encoding, min_text_length=50, parser=None, truncated=False):
+    """解析のワーカーで本文をデコードしてデータを抽出し、(データ, SimHash, 正規化したフィールド)を返す"""
+    html = decode_html(body, encoding, url)
+    data, fingerprint = extract_page(url, html, min_text_length, parser, truncated)
+    normalized = normalize_fields(data) if NORMALIZED_CACHE_ENABLED else None
+    return data, fingerprint, normalized
+
+class PipelineFetcher(AsyncFetcher):
+    """取得したページを解析のワーカーのプールに渡して保存するAsyncFetcher
+
+    解析のワーカーに同時に渡すページは、ワーカー数の2倍まで（解析と保存を重ねて、ワーカーを空けない。queue_sizeより多くはしない）。
+    statsには、キューの最大の長さ・キューが一杯で取得が待った回数・解析と保存にかかった秒数（合計）が入る。
+    """
+
+    def __init__(self, output_dir='data', min_text_length=50, parser=None, sink=None, workers=PIPELINE_PARSE_WORKERS,
+                 queue_size=PIPELINE_QUEUE_SIZE, store_workers=PIPELINE_STORE_WORKERS, **kwargs):
+        super().__init__(None, **kwargs)
+        self.output_dir = output_dir
+        self.min_text_length = min_text_length
+        self.parser = parser
+        self.sink = sink
+        self.workers = parse_workers(workers)
+        self.queue_size = queue_size
+        self.store_workers = store_workers
+        self.stats = {'pages': 0, 'queue_max': 0, 'backpressure': 0, 'parse_seconds': 0.0, 'store_seconds': 0.0}
+
+    async def fetch_all(self, urls):
+        self._queue = asyncio.Queue()
+        # 解析と保存が終わっていないページの枠（キューにあるページと解析・保存中のページ）
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._executor = get_parse_executor(self.workers)
+        self._store_executor = ThreadPoolExecutor(max_workers=self.store_workers, thread_name_prefix='pipeline-store')
+        parsers = [asyncio.ensure_future(self._parse_loop()) for _ in range(self.workers * 2)]
+        try:
+            return await super().fetch_all(urls)
+        finally:
+            for task in parsers:
+                task.cancel()
+            await asyncio.gather(*parsers, return_exceptions=True)
+            self._store_executor.shutdown(wait=True)
+            stats = {name: round(value, 3) if isinstance(value, float) else value for name, value in self.stats.items()}
+            logging.info(f"パイプライン: {stats}")
+
+    async def _hand_off(self, url, body, encoding, truncated=False):
+        """枠が空くまで待ってから本文をキューに入れ、結果のfutureを返す（待つ間は取得の枠を持ったまま）"""
+        if self._slots.locked():
+            self.stats['backpressure'] += 1
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((url, body, encoding, truncated, future))
+        self.stats['queue_max'] = max(self.stats['queue_max'], self._queue.qsize())
+        return future
+
+    async def _parse_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            url, body, encoding, truncated, future = await self._queue.get()
+            try:
+                started = time.perf_counter()
+                data, fingerprint, normalized = await loop.run_in_executor(
+                    self._executor, parse_page, url, body, encoding, self.min_text_length, self.parser, truncated
+                )
+                parsed = time.perf_counter()
+                result = await loop.run_in_executor(
+                    self._store_executor, store_page, url, data, fingerprint, self.output_dir, self.sink, normalized
+                )
+                self.stats['pages'] += 1
+                self.stats['parse_seconds'] += parsed - started
+                self.stats['store_seconds'] += time.perf_counter() - parsed
+                if not future.done():
+                    future.set_result(result)
+            except BrokenProcessPool as e:
+                # 解析のワーカーが異常終了した場合は、次の取得でプールを作り直す
+                shutdown_parse_executor()
+                if not future.done():
+                    future.set_exception(e)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._slots.release()
+                self._queue.task_done()
+
+def fetch_urls_pipeline(urls, output_dir='data', min_text_length=50, parser=None, sink=None, **kwargs):
+    """同期コード（Celeryタスクやコマンドライン）からパイプラインで取得して保存する
+
+    kwargsはAsyncFetcherの引数（headers・concurrency・per_host・delay・check_robots・use_cache）と、
+    workers・queue_size・store_workers。
+    """
+    return asyncio.run(PipelineFetcher(output_dir, min_text_length, parser, sink, **kwargs).fetch_all(urls))
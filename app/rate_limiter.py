@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from config import RATE_LIMIT_BURST, RATE_LIMIT_REDIS_URL
+
+# Redisに保存するときのキーの接頭辞
+REDIS_KEY_PREFIX = 'ratelimit:'
+
+# トークンバケットから1トークンを予約し、待ち時間（秒）を返すLuaスクリプト
+# トークンは負の値まで予約でき、その分だけ後の時刻に割り当てられる（予約した順に間隔を空けて実行される）
+RESERVE_SCRIPT = """
+local bucket = KEYS[1]
+local metrics = KEYS[2]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', bucket, 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate) - 1
+redis.call('HSET', bucket, 'tokens', tokens, 'updated', now)
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+redis.call('EXPIRE', bucket, math.ceil(capacity / rate + wait) + 60)
+redis.call('HINCRBY', metrics, 'requests', 1)
+redis.call('HINCRBYFLOAT', metrics, 'wait_total', wait)
+local max_wait = tonumber(redis.call('HGET', metrics, 'wait_max')) or 0
+if wait > max_wait then
+    redis.call('HSET', metrics, 'wait_max', wait)
+end
+return tostring(wait)
+"""
+
+def domain_key(url):
+    """レート制限のキー（ドメイン）を返す"""
+    return urlparse(url).netloc.lower()
+
+class RateLimiter:
+    """ドメインごとのトークンバケットによるリクエスト間隔の制御
+
+    interval秒に1トークンが補充され、最大burst個まで貯まる。reserve()はトークンを
+    予約して「あと何秒待てば実行してよいか」を返すだけで、自分では待機しない。
+    呼び出し側はその時間だけ待つか（コマンドライン・非同期取得）、タスクを
+    その時間後に再実行する（Celery）ため、待ち時間の間も他のドメインの処理を進められる。
+    Redisを設定すると、すべてのワーカーが同じバケットを共有する。
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, redis_url=RATE_LIMIT_REDIS_URL):
+        self.burst = burst
+        self.redis_url = redis_url
+        self._redis = None
+        self._script = None
+        self._buckets = {}   # ドメイン -> (トークン数, 更新時刻)
+        self._metrics = {}   # ドメイン -> {'requests', 'wait_total', 'wait_max'}
+        self._lock = threading.Lock()
+
+    def _get_script(self):
+        if self._script is None and self.redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(self.redis_url)
+                self._script = self._redis.register_script(RESERVE_SCRIPT)
+            except ImportError:
+                logging.warning("redisパッケージがインストールされていません。レート制限はプロセス内でのみ行います。")
+                self.redis_url = None
+        return self._script
+
+    def reserve(self, url, interval):
+        """URLのドメインのトークンを1つ予約し、実行までの待ち時間（秒）を返す"""
+        return self.reserve_key(domain_key(url), interval)
+
+    def reserve_key(self, domain, interval):
+        """キー（ドメインなど）のトークンを1つ予約し、実行までの待ち時間（秒）を返す"""
+        if interval <= 0:
+            return 0.0
+        rate = 1.0 / interval
+
+        script = self._get_script()
+        if script is not None:
+            try:
+                keys = [f"{REDIS_KEY_PREFIX}{domain}", f"{REDIS_KEY_PREFIX}metrics:{domain}"]
+                return float(script(keys=keys, args=[rate, self.burst]))
+            except Exception as e:
+                logging.warning(f"レート制限（Redis）の予約に失敗しました。プロセス内で制御します: {e}")
+
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(domain, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * rate) - 1
+            self._buckets[domain] = (tokens, now)
+            wait = -tokens / rate if tokens < 0 else 0.0
+            metrics = self._metrics.setdefault(domain, {'requests': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+            metrics['requests'] += 1
+            metrics['wait_total'] += wait
+            metrics['wait_max'] = max(metrics['wait_max'], wait)
+        return wait
+
+    def wait(self, url, interval):
+        """トークンを予約し、実行できる時刻まで待機する（待った秒数を返す）"""
+        return self.wait_key(domain_key(url), interval)
+
+    def wait_key(self, domain, interval):
+        """キー（ドメインなど）のトークンを予約し、実行できる時刻まで待機する（待った秒数を返す）"""
+        wait = self.reserve_key(domain, interval)
+        if wait > 0:
+            logging.info(f"{wait:.2f}秒間待機中...")
+            time.sleep(wait)
+        return wait
+
+    def metrics(self):
+        """ドメインごとのリクエスト数と待ち時間（合計・平均・最大）を返す"""
+        if self._get_script() is not None:
+            result = {}
+            try:
+                for key in self._redis.scan_iter(f"{REDIS_KEY_PREFIX}metrics:*"):
+                    values = self._redis.hgetall(key)
+                    domain = key.decode('utf-8')[len(f"{REDIS_KEY_PREFIX}metrics:"):]
+                    result[domain] = {
+                        'requests': int(values.get(b'requests', 0)),
+                        'wait_total': float(values.get(b'wait_total', 0)),
+                        'wait_max': float(values.get(b'wait_max', 0)),
+                    }
+            except Exception as e:
+                logging.warning(f"レート制限の統計（Redis）の取得に失敗しました: {e}")
+        else:
+            with self._lock:
+                result = {domain: dict(values) for domain, values in self._metrics.items()}
+        for values in result.values():
+            values['wait_avg'] = values['wait_total'] / values['requests'] if values['requests'] else 0.0
+        return result
+
+def crawl_interval(delay, rules, user_agent):
+    """リクエスト間隔を返す（指定されたdelayとrobots.txtのCrawl-delayの大きい方）
+
+    rulesはrobots_cacheから取得したRobotFileParser（なければNone）。
+    """
+    crawl_delay = rules.crawl_delay(user_agent) if rules is not None else None
+    if crawl_delay:
+        return max(delay, float(crawl_delay))
+    return delay
+
+# プロセスで共有するレート制限
+rate_limiter = RateLimiter()
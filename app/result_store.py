@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import text_index
+from config import RESULT_STORE_ENABLED, RESULT_STORE_PATH, RESULT_STORE_BATCH_SIZE, RESULT_STORE_FLUSH_INTERVAL, TEXT_INDEX_ENABLED
+from http_cache import is_not_modified
+from fetch_limits import OVERSIZED, DEADLINE_EXCEEDED, TRUNCATED, is_fetch_limited, is_truncated
+from near_dup import is_near_duplicate
+from url_index import canonicalize_url
+
+# 取得結果のステータス
+SAVED = 'saved'
+NOT_MODIFIED = 'not_modified'
+NEAR_DUPLICATE = 'near_duplicate'
+FAILED = 'failed'
+
+# 取得ごとのステータス（TRUNCATEDは本文を上限のバイト数で切り詰めて保存したページ、
+# OVERSIZED・DEADLINE_EXCEEDEDは上限を超えて取得をやめたページ）
+STATUSES = (SAVED, TRUNCATED, NOT_MODIFIED, NEAR_DUPLICATE, OVERSIZED, DEADLINE_EXCEEDED, FAILED)
+# ページの内容を保存したステータス
+STORED_STATUSES = (SAVED, TRUNCATED)
+
+SCHEMA = (
+    # 正規URLごとのページ
+    'CREATE TABLE IF NOT EXISTS pages ('
+    'id INTEGER PRIMARY KEY, canonical_url TEXT NOT NULL UNIQUE, domain TEXT NOT NULL, title TEXT, '
+    'first_fetched REAL NOT NULL, last_fetched REAL NOT NULL)',
+    # 取得ごとの結果（urlは正規化した取得時のURL）
+    'CREATE TABLE IF NOT EXISTS fetches ('
+    'id INTEGER PRIMARY KEY, page_id INTEGER NOT NULL REFERENCES pages (id), url TEXT NOT NULL, domain TEXT NOT NULL, '
+    'status TEXT NOT NULL, fetched_at REAL NOT NULL, title TEXT, description TEXT, content_length INTEGER, '
+    'image_count INTEGER, link_count INTEGER, duplicate_of TEXT)',
+    'CREATE TABLE IF NOT EXISTS images (fetch_id INTEGER NOT NULL REFERENCES fetches (id), url TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS links (fetch_id INTEGER NOT NULL REFERENCES fetches (id), url TEXT NOT NULL)',
+    # 取得結果の要約（要約は別のタスクで後から行うため、取得のURLと時刻で対応付ける）
+    'CREATE TABLE IF NOT EXISTS summaries ('
+    'url TEXT NOT NULL, fetched_at REAL NOT NULL, summary TEXT NOT NULL, model TEXT, summarized_at REAL NOT NULL, '
+    'PRIMARY KEY (url, fetched_at))',
+    # スケジュール実行ごとの集計（statsは件数・バイト数・所要時間などのJSON）
+    'CREATE TABLE IF NOT EXISTS runs ('
+    'id TEXT PRIMARY KEY, status TEXT NOT NULL, started_at REAL NOT NULL, finished_at REAL, url_count INTEGER NOT NULL, stats TEXT)',
+    # 件数の集計（行数が増えてもCOUNT(*)で全件を数えずに済むよう、挿入と同時に更新する）
+    'CREATE TABLE IF NOT EXISTS counts (domain TEXT NOT NULL, name TEXT NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (domain, name))',
+    'CREATE INDEX IF NOT EXISTS pages_domain ON pages (domain, last_fetched)',
+    'CREATE INDEX IF NOT EXISTS fetches_page ON fetches (page_id, fetched_at)',
+    'CREATE INDEX IF NOT EXISTS fetches_url ON fetches (url, fetched_at)',
+    'CREATE INDEX IF NOT EXISTS fetches_domain ON fetches (domain, fetched_at)',
+    'CREATE INDEX IF NOT EXISTS fetches_fetched_at ON fetches (fetched_at)',
+    'CREATE INDEX IF NOT EXISTS images_fetch ON images (fetch_id)',
+    'CREATE INDEX IF NOT EXISTS links_fetch ON links (fetch_id)',
+    'CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at)',
+)
+
+FETCH_COLUMNS = ('id', 'url', 'canonical_url', 'domain', 'status', 'fetched_at', 'title', 'description',
+                 'content_length', 'image_count', 'link_count', 'duplicate_of')
+RUN_COLUMNS = ('id', 'status', 'started_at', 'finished_at', 'url_count', 'stats')
+
+# 実行のステータス
+RUN_RUNNING = 'running'
+RUN_FINISHED = 'finished'
+
+_SELECT_FETCHES = (
+    'SELECT fetches.id, fetches.url, pages.canonical_url, fetches.domain, fetches.status, fetches.fetched_at, '
+    'fetches.title, fetches.description, fetches.content_length, fetches.image_count, fetches.link_count, fetches.duplicate_of '
+    'FROM fetches JOIN pages ON pages.id = fetches.page_id'
+)
+
+def result_status(result):
+    """スクレイピングの結果のステータスを返す"""
+    if not result:
+        return FAILED
+    if is_not_modified(result):
+        return NOT_MODIFIED
+    if is_fetch_limited(result):
+        return result['status']
+    if is_near_duplicate(result):
+        return NEAR_DUPLICATE
+    if is_truncated(result):
+        return TRUNCATED
+    return SAVED
+
+def _row_to_dict(row):
+    return dict(zip(FETCH_COLUMNS, row))
+
+def _run_to_dict(row):
+    run = dict(zip(RUN_COLUMNS, row))
+    run['stats'] = json.loads(run['stats']) if run['stats'] else None
+    return run
+
+class ResultStore:
+    """スクレイピングの結果を保存し、Web UIから検索できるようにするストア（SQLite）
+
+    record()は結果をメモリ上のバッファに入れるだけで、batch_size件たまるか
+    flush_interval秒ごとにバックグラウンドのスレッドが1つのトランザクションでまとめて挿入する。
+    ページは正規URL（rel=canonicalなど）ごとに1行で、取得のたびにfetchesに1行を追加する。
+    text_searchがTrueの場合は、保存したページを同じトランザクションで全文検索インデックス（text_index）にも登録する。
+    """
+
+    def __init__(self, path=RESULT_STORE_PATH, batch_size=RESULT_STORE_BATCH_SIZE, flush_interval=RESULT_STORE_FLUSH_INTERVAL,
+                 text_search=TEXT_INDEX_ENABLED):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.text_search = text_search
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._thread = None
+        self._thread_pid = None
+
+    def _connect(self):
+        # fork後の子プロセスでは親の接続を使わずに開き直す
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+                if self.text_search:
+                    self.text_search = text_index.create_index(connection)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _start(self):
+        # fork後の子プロセスでは親のバッファを引き継がずにスレッドを起動し直す
+        if self._thread_pid != os.getpid():
+            self._buffer = []
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='result-store', daemon=True)
+            self._thread.start()
+
+    def record(self, url, result, fetched_at=None):
+        """スクレイピングの結果をバッファに入れる（失敗した場合はresultがNone）"""
+        entry = (url, result, fetched_at or time.time())
+        with self._condition:
+            self._start()
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._buffer) >= self.batch_size, timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"結果の保存に失敗しました: {e}")
+
+    def flush(self):
+        """バッファの結果をまとめて挿入する"""
+        with self._condition:
+            if self._thread_pid != os.getpid():
+                return
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                counts = {}
+                for url, result, fetched_at in entries:
+                    domain, status, new_page = self._insert(connection, url, result, fetched_at)
+                    counts[(domain, status)] = counts.get((domain, status), 0) + 1
+                    if new_page:
+                        counts[(domain, 'pages')] = counts.get((domain, 'pages'), 0) + 1
+                connection.executemany(
+                    'INSERT INTO counts VALUES (?, ?, ?) ON CONFLICT (domain, name) DO UPDATE SET value = value + excluded.value',
+                    [(domain, status, count) for (domain, status), count in counts.items()]
+                )
+        logging.debug(f"{len(entries)}件の結果を保存しました: {self.path}")
+
+    def _page_id(self, connection, url, canonical_url, domain, title, fetched_at):
+        """ページのIDと、新しく追加したページかどうかを返す"""
+        if canonical_url is None:
+            # 更新のなかった結果などは正規URLがないため、同じURLの前回の取得と同じページにする
+            row = connection.execute('SELECT page_id FROM fetches WHERE url = ? ORDER BY fetched_at DESC LIMIT 1', (url,)).fetchone()
+            if row:
+                connection.execute('UPDATE pages SET last_fetched = MAX(last_fetched, ?) WHERE id = ?', (fetched_at, row[0]))
+                return row[0], False
+            canonical_url = url
+        row = connection.execute('SELECT id FROM pages WHERE canonical_url = ?', (canonical_url,)).fetchone()
+        if row:
+            connection.execute(
+                'UPDATE pages SET title = COALESCE(?, title), last_fetched = MAX(last_fetched, ?) WHERE id = ?',
+                (title, fetched_at, row[0])
+            )
+            return row[0], False
+        cursor = connection.execute(
+            'INSERT INTO pages (canonical_url, domain, title, first_fetched, last_fetched) VALUES (?, ?, ?, ?, ?)',
+            (canonical_url, domain, title, fetched_at, fetched_at)
+        )
+        return cursor.lastrowid, True
+
+    def _insert(self, connection, url, result, fetched_at):
+        url = canonicalize_url(url)
+        domain = urlparse(url).netloc
+        status = result_status(result)
+        result = result or {}
+        canonical_url = result.get('canonical_url') if status in STORED_STATUSES + (NEAR_DUPLICATE,) else None
+        page_id, new_page = self._page_id(connection, url, canonical_url, domain, result.get('title'), fetched_at)
+
+        images = (result.get('images') or []) if status in STORED_STATUSES else []
+        links = (result.get('links') or []) if status in STORED_STATUSES else []
+        content = result.get('content') if status in STORED_STATUSES else None
+        cursor = connection.execute(
+            'INSERT INTO fetches (page_id, url, domain, status, fetched_at, title, description, content_length, '
+            'image_count, link_count, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (page_id, url, domain, status, fetched_at, result.get('title'), result.get('description'),
+             len(content) if content is not None else None, len(images), len(links), result.get('duplicate_of'))
+        )
+        fetch_id = cursor.lastrowid
+        if images:
+            connection.executemany('INSERT INTO images VALUES (?, ?)', [(fetch_id, image) for image in images])
+        if links:
+            connection.executemany('INSERT INTO links VALUES (?, ?)', [(fetch_id, link) for link in links])
+        if status in STORED_STATUSES and self.text_search:
+            text_index.add(connection, fetch_id, result)
+        return domain, status, new_page
+
+    def recent(self, limit=50, domain=None, before=None):
+        """新しい順に取得結果を返す（beforeより前の時刻のもの。ページ送りに使う）"""
+        conditions = []
+        params = []
+        if domain:
+            conditions.append('fetches.domain = ?')
+            params.append(domain.lower())
+        if before:
+            conditions.append('fetches.fetched_at < ?')
+            params.append(before)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._connect().execute(
+                f"{_SELECT_FETCHES}{where} ORDER BY fetches.fetched_at DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def history(self, url, limit=50):
+        """URL（またはそのURLを正規URLとするページ）の取得履歴を新しい順に返す"""
+        url = canonicalize_url(url)
+        with self._lock:
+            connection = self._connect()
+            page = connection.execute('SELECT id FROM pages WHERE canonical_url = ?', (url,)).fetchone()
+            if page is None:
+                page = connection.execute('SELECT page_id FROM fetches WHERE url = ? ORDER BY fetched_at DESC LIMIT 1', (url,)).fetchone()
+            if page is None:
+                return []
+            rows = connection.execute(
+                f"{_SELECT_FETCHES} WHERE fetches.page_id = ? ORDER BY fetches.fetched_at DESC LIMIT ?", (page[0], limit)
+            ).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def fetch_detail(self, fetch_id):
+        """取得結果を画像とリンクのURLを含めて返す（なければNone）"""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(f"{_SELECT_FETCHES} WHERE fetches.id = ?", (fetch_id,)).fetchone()
+            if row is None:
+                return None
+            detail = _row_to_dict(row)
+            detail['images'] = [url for url, in connection.execute('SELECT url FROM images WHERE fetch_id = ?', (fetch_id,))]
+            detail['links'] = [url for url, in connection.execute('SELECT url FROM links WHERE fetch_id = ?', (fetch_id,))]
+            summary = connection.execute(
+                'SELECT summary FROM summaries WHERE url = ? AND fetched_at = ?', (detail['url'], detail['fetched_at'])
+            ).fetchone()
+            detail['summary'] = summary[0] if summary else None
+        return detail
+
+    def record_summary(self, url, fetched_at, summary, model=None):
+        """取得結果（record()に渡したURLと取得時刻）の要約を保存する"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)',
+                    (canonicalize_url(url), fetched_at, summary, model, time.time())
+                )
+
+    def start_run(self, run_id, url_count, started_at=None):
+        """スケジュール実行の開始を記録する"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO runs (id, status, started_at, url_count) VALUES (?, ?, ?, ?)',
+                    (run_id, RUN_RUNNING, started_at or time.time(), url_count)
+                )
+
+    def finish_run(self, run_id, stats, finished_at=None):
+        """スケジュール実行の終了と集計を記録する"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'UPDATE runs SET status = ?, finished_at = ?, stats = ? WHERE id = ?',
+                    (RUN_FINISHED, finished_at or time.time(), json.dumps(stats, ensure_ascii=False), run_id)
+                )
+
+    def runs(self, limit=20):
+        """スケジュール実行を新しい順に返す"""
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {', '.join(RUN_COLUMNS)} FROM runs ORDER BY started_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [_run_to_dict(row) for row in rows]
+
+    def run(self, run_id):
+        """スケジュール実行の集計を返す（なければNone）"""
+        with self._lock:
+            row = self._connect().execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return _run_to_dict(row) if row else None
+
+    def counts(self, domain=None):
+        """ステータスごとの取得件数とページ数を返す（domainを省略すると全ドメインの合計）"""
+        with self._lock:
+            connection = self._connect()
+            if domain:
+                rows = connection.execute('SELECT name, value FROM counts WHERE domain = ?', (domain.lower(),)).fetchall()
+            else:
+                rows = connection.execute('SELECT name, SUM(value) FROM counts GROUP BY name').fetchall()
+        counts = {status: 0 for status in STATUSES}
+        counts.update(dict(rows))
+        counts['fetches'] = sum(counts[status] for status in STATUSES)
+        counts.setdefault('pages', 0)
+        return counts
+
+    def domains(self, limit=100):
+        """取得件数の多い順にドメインと件数を返す"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT domain, SUM(value) AS total FROM counts WHERE name != 'pages' GROUP BY domain ORDER BY total DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [{'domain': domain, 'fetches': total} for domain, total in rows]
+
+    def search(self, query, limit=20, offset=0, domain=None):
+        """保存したページを全文検索し、関連度の高い順に返す（text_index.searchを参照）"""
+        with self._lock:
+            connection = self._connect()
+            if not self.text_search:
+                return []
+            return text_index.search(connection, query, limit=limit, offset=offset, domain=domain)
+
+    def close(self):
+        """バッファの結果を書き込む"""
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"結果の保存に失敗しました: {e}")
+
+# プロセスで共有するストア（無効の場合はNone）
+result_store = ResultStore() if RESULT_STORE_ENABLED else None
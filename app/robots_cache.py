@@ -0,0 +1,194 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from config import ROBOTS_CACHE_SIZE, ROBOTS_CACHE_TTL, ROBOTS_CACHE_NEGATIVE_TTL, ROBOTS_CACHE_REDIS_URL
+from http_client import borrow_session
+
+# robots.txt取得のタイムアウト（秒）
+ROBOTS_TIMEOUT = 10
+
+# Redisに保存するときのキーの接頭辞
+REDIS_KEY_PREFIX = 'robots:'
+
+# 同じホストのrobots.txtを同時に取得しないためのロックの数（ホストのハッシュで振り分ける）
+FETCH_LOCK_STRIPES = 64
+
+def robots_key(url):
+    """キャッシュのキー（スキーム+ホスト）を返す"""
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+def build_rules(status, body):
+    """robots.txtの取得結果からRobotFileParserを作成する
+
+    statusがNoneの場合は取得エラーを表す。
+    - 200: 内容を解析する
+    - 401/403: すべて禁止
+    - その他の4xx（404など）: すべて許可
+    - 5xx: すべて禁止（urllib.robotparserと同じ扱い）
+    - 取得エラー: すべて許可（寛容なアプローチ）
+    """
+    rp = RobotFileParser()
+    if status == 200:
+        rp.parse((body or '').splitlines())
+    elif status in (401, 403):
+        rp.disallow_all = True
+    elif status is not None and 400 <= status < 500:
+        rp.allow_all = True
+    elif status is not None and status >= 500:
+        rp.disallow_all = True
+    else:
+        rp.allow_all = True
+    return rp
+
+class RobotsCache:
+    """ホストごとのrobots.txtキャッシュ
+
+    プロセス内のLRUキャッシュと、任意でRedis上の共有キャッシュの2段構成。
+    Redisには取得結果（ステータスと本文）を保存し、各ワーカーはそれを解析して使う。
+    正常に取得できたもの（200・4xx）はttl秒、サーバーエラーや取得エラーは
+    negative_ttl秒だけキャッシュし、障害中のホストに毎回問い合わせないようにする。
+    スレッドやグリーンスレッドで同じホストのrobots.txtが同時に必要になった場合は、
+    1つだけが取得し、残りはその結果を使う。
+    """
+
+    def __init__(self, maxsize=ROBOTS_CACHE_SIZE, ttl=ROBOTS_CACHE_TTL, negative_ttl=ROBOTS_CACHE_NEGATIVE_TTL, redis_url=ROBOTS_CACHE_REDIS_URL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.redis_url = redis_url
+        self._redis = None
+        self._entries = OrderedDict()  # キー -> (有効期限, RobotFileParser)
+        self._lock = threading.Lock()
+        self._fetch_locks = [threading.Lock() for _ in range(FETCH_LOCK_STRIPES)]
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(self.redis_url)
+            except ImportError:
+                logging.warning("redisパッケージがインストールされていません。robots.txtはプロセス内でのみキャッシュします。")
+                self.redis_url = None
+        return self._redis
+
+    def _entry_ttl(self, status):
+        if status is None or status >= 500:
+            return self.negative_ttl
+        return self.ttl
+
+    def lookup(self, url):
+        """キャッシュ済みのルールを返す（なければNone）"""
+        key = robots_key(url)
+        now = time.time()
+        rules = self._memory_get(key, now)
+        if rules is not None:
+            return rules
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                cached = client.get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                logging.warning(f"robots.txtキャッシュ（Redis）の読み込みに失敗しました: {e}")
+                cached = None
+            if cached:
+                record = json.loads(cached)
+                expires = record['fetched_at'] + self._entry_ttl(record['status'])
+                if expires > now:
+                    rules = build_rules(record['status'], record['body'])
+                    self._put(key, expires, rules)
+                    with self._lock:
+                        self.redis_hits += 1
+                    return rules
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _memory_get(self, key, now, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[1]
+        return None
+
+    def store(self, url, status, body=None):
+        """robots.txtの取得結果をキャッシュに保存し、ルールを返す"""
+        key = robots_key(url)
+        now = time.time()
+        ttl = self._entry_ttl(status)
+        rules = build_rules(status, body)
+        self._put(key, now + ttl, rules)
+
+        client = self._get_redis()
+        if client is not None:
+            record = {'status': status, 'body': body, 'fetched_at': now}
+            try:
+                client.set(REDIS_KEY_PREFIX + key, json.dumps(record, ensure_ascii=False), ex=max(1, int(ttl)))
+            except Exception as e:
+                logging.warning(f"robots.txtキャッシュ（Redis）の書き込みに失敗しました: {e}")
+        return rules
+
+    def _put(self, key, expires, rules):
+        with self._lock:
+            self._entries[key] = (expires, rules)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def fetch(self, url, headers=None):
+        """robots.txtをダウンロードしてキャッシュに保存する"""
+        robots_url = f"{robots_key(url)}/robots.txt"
+        try:
+            with borrow_session() as session:
+                response = session.get(robots_url, headers=headers, timeout=ROBOTS_TIMEOUT)
+            body = response.text if response.status_code == 200 else None
+            return self.store(url, response.status_code, body)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"robots.txtの確認中にエラーが発生しました: {e}")
+            return self.store(url, None)
+
+    def get_rules(self, url, headers=None):
+        """キャッシュを使ってURLのホストのルールを返す"""
+        rules = self.lookup(url)
+        if rules is None:
+            key = robots_key(url)
+            with self._fetch_locks[hash(key) % FETCH_LOCK_STRIPES]:
+                # 待っている間に他のスレッドが取得していれば、それを使う
+                rules = self._memory_get(key, time.time(), count=False)
+                if rules is None:
+                    rules = self.fetch(url, headers)
+        return rules
+
+    def can_fetch(self, url, user_agent, headers=None):
+        """URLへのアクセスがrobots.txtで許可されているかを返す"""
+        return self.get_rules(url, headers).can_fetch(user_agent, url)
+
+    def stats(self):
+        """キャッシュのヒット数・ミス数を返す"""
+        with self._lock:
+            total = self.hits + self.redis_hits + self.misses
+            return {
+                'hits': self.hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.redis_hits) / total if total else 0.0,
+                'size': len(self._entries),
+            }
+
+# プロセス内で共有するキャッシュ（Celeryの同じワーカープロセスのタスク間で共有される）
+robots_cache = RobotsCache()
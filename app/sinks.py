@@ -0,0 +1,299 @@
+import atexit
+import csv
+import glob
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlparse
+
+from config import (STORAGE_SINK, SINK_BATCH_SIZE, SINK_FLUSH_INTERVAL, SINK_SEGMENT_BYTES,
+                    SINK_SEGMENT_SECONDS, SINK_COMPRESSION)
+
+SINK_TYPES = ('files', 'jsonl', 'parquet')
+
+def save_to_json(data, filename):
+    """データをJSON形式で保存する"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    logging.info(f"✅ JSONファイルを保存しました: {filename}")
+
+def save_to_csv(data, filename):
+    """データをCSV形式で保存する"""
+    # CSVのヘッダー
+    fieldnames = list(data.keys())
+
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+
+        # リスト型のデータをカンマ区切りの文字列に、辞書型のデータ（matched_keywordsなど）をJSONの文字列に変換
+        csv_data = {}
+        for key, value in data.items():
+            if isinstance(value, list):
+                csv_data[key] = ','.join(value)
+            elif isinstance(value, dict):
+                csv_data[key] = json.dumps(value, ensure_ascii=False)
+            else:
+                csv_data[key] = value
+
+        writer.writerow(csv_data)
+    logging.info(f"✅ CSVファイルを保存しました: {filename}")
+
+def get_output_basename(output_dir, url, suffix=''):
+    """保存ファイルのパス（拡張子なし）を生成する
+
+    同じ秒に同じドメインのページを保存しても上書きしないよう、既にファイルがあれば連番を付ける。
+    """
+    # 保存用のディレクトリを作成
+    os.makedirs(output_dir, exist_ok=True)
+
+    # ドメイン名を取得してファイル名に使用
+    domain = urlparse(url).netloc.replace('.', '_')
+
+    # タイムスタンプを含むファイル名を生成
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    basename = f"{output_dir}/{domain}_{timestamp}"
+    candidate = f"{basename}{suffix}"
+    number = 1
+    while True:
+        try:
+            # JSONファイルを先に作成してファイル名を確保する（並行して保存する場合に備える）
+            os.close(os.open(f"{candidate}.json", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return candidate
+        except FileExistsError:
+            candidate = f"{basename}_{number}{suffix}"
+            number += 1
+
+class FileSink:
+    """ページごとにJSONとCSVのファイルを保存する従来の保存先"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def write(self, record, kind='page'):
+        """レコードを保存し、保存先（拡張子なしのファイルパス）を返す
+
+        kindが'page'以外の場合はファイル名の末尾に付ける（例: _filtered）。
+        """
+        suffix = '' if kind == 'page' else f"_{kind}"
+        basename = get_output_basename(self.output_dir, record['url'], suffix)
+        save_to_json(record, f"{basename}.json")
+        save_to_csv(record, f"{basename}.csv")
+        return basename
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def _compressor(compression):
+    """セグメントの圧縮形式を決める（zstandardがなければgzipにする）"""
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+            return 'zstd'
+        except ImportError:
+            logging.warning("zstandardパッケージがインストールされていません。セグメントはgzipで圧縮します。")
+            return 'gzip'
+    if compression in ('gzip', 'none'):
+        return compression
+    logging.warning(f"不明な圧縮形式です: {compression}。gzipを使用します。")
+    return 'gzip'
+
+def compress_segment(path, compression):
+    """書き終えたセグメントを圧縮し、圧縮後のパスを返す"""
+    if compression == 'none':
+        return path
+    if compression == 'zstd':
+        import zstandard
+        compressed_path = f"{path}.zst"
+        with open(path, 'rb') as source, open(f"{compressed_path}.tmp", 'wb') as target:
+            zstandard.ZstdCompressor(level=3).copy_stream(source, target)
+    else:
+        compressed_path = f"{path}.gz"
+        with open(path, 'rb') as source, gzip.open(f"{compressed_path}.tmp", 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target)
+    os.replace(f"{compressed_path}.tmp", compressed_path)
+    os.remove(path)
+    return compressed_path
+
+class JsonlSink:
+    """レコードをJSON Linesのセグメントにまとめて追記する保存先
+
+    write()はレコードをメモリ上のバッファに入れるだけで、バックグラウンドのスレッドが
+    batch_size件たまるか、flush_interval秒ごとにまとめて書き込む。
+    セグメントはsegment_bytesバイトかsegment_seconds秒で切り替え、書き終えたものを圧縮する
+    （書き込み中のセグメントは.jsonl、書き終えたものは.jsonl.zstか.jsonl.gz）。
+    セグメントのファイル名にはプロセスIDを含めるため、複数のワーカーが同じディレクトリに書き込める。
+    """
+
+    def __init__(self, output_dir, batch_size=SINK_BATCH_SIZE, flush_interval=SINK_FLUSH_INTERVAL,
+                 segment_bytes=SINK_SEGMENT_BYTES, segment_seconds=SINK_SEGMENT_SECONDS, compression=SINK_COMPRESSION):
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.compression = _compressor(compression)
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._file = None
+        self._segment_path = None
+        self._segment_started = None
+        self._sequence = 0
+        self._thread = None
+        self._pid = None
+        self._closing = False
+
+    def _start(self):
+        # fork後の子プロセスでは親のバッファとファイルを引き継がずにスレッドを起動し直す
+        if self._pid != os.getpid():
+            self._buffer = []
+            self._file = None
+            self._segment_path = None
+            self._closing = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='jsonl-sink', daemon=True)
+            self._thread.start()
+
+    def write(self, record, kind='page'):
+        """レコードをバッファに入れ、レコードIDを返す"""
+        record_id = uuid.uuid4().hex
+        entry = {'record_id': record_id, 'kind': kind, 'saved_at': datetime.now().isoformat(timespec='seconds')}
+        entry.update(record)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._condition:
+            self._start()
+            self._buffer.append(line)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+        return record_id
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closing or len(self._buffer) >= self.batch_size, timeout=self.flush_interval)
+                closing = self._closing
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"JSON Linesの書き込みに失敗しました: {e}")
+            if closing:
+                return
+
+    def flush(self):
+        """バッファのレコードをセグメントに書き込む"""
+        with self._condition:
+            lines, self._buffer = self._buffer, []
+        with self._io_lock:
+            if lines:
+                if self._file is None:
+                    self._open_segment()
+                self._file.write(''.join(lines))
+                self._file.flush()
+                logging.debug(f"{len(lines)}件のレコードを書き込みました: {self._segment_path}")
+            if self._file is not None and (
+                self._file.tell() >= self.segment_bytes or time.time() - self._segment_started >= self.segment_seconds
+            ):
+                self._close_segment()
+
+    def _open_segment(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._sequence += 1
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._segment_path = os.path.join(self.output_dir, f"pages_{timestamp}_{os.getpid()}_{self._sequence}.jsonl")
+        self._file = open(self._segment_path, 'a', encoding='utf-8')
+        self._segment_started = time.time()
+
+    def _close_segment(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        path = compress_segment(self._segment_path, self.compression)
+        logging.info(f"✅ セグメントを保存しました: {path}")
+
+    def close(self):
+        """残りのレコードを書き込み、書き込み中のセグメントを閉じて圧縮する"""
+        if self._pid != os.getpid():
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._close_segment()
+        self._pid = None
+
+def open_segment(path):
+    """セグメントをテキストとして開く（圧縮形式は拡張子で判断する）"""
+    if path.endswith('.zst'):
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True), encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+def read_records(output_dir, kind='page'):
+    """保存先のディレクトリのJSON Linesのレコードを順に返す（kindがNoneならすべて）"""
+    paths = sorted(glob.glob(os.path.join(output_dir, 'pages_*.jsonl*')))
+    for path in paths:
+        if path.endswith('.tmp'):
+            continue
+        with open_segment(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if kind is None or record.get('kind') == kind:
+                    yield record
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+def get_sink(output_dir='data', sink_type=None):
+    """保存先を返す（出力ディレクトリと種類ごとにプロセスで共有する）"""
+    sink_type = sink_type or STORAGE_SINK
+    if sink_type not in SINK_TYPES:
+        logging.warning(f"不明な保存先です: {sink_type}。filesを使用します。")
+        sink_type = 'files'
+    key = (sink_type, output_dir)
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            if sink_type == 'parquet':
+                try:
+                    from parquet_export import ParquetSink
+                    sink = ParquetSink(output_dir)
+                except ImportError as e:
+                    logging.warning(f"{e} JSON Linesで保存します。")
+                    sink = JsonlSink(output_dir)
+            elif sink_type == 'jsonl':
+                sink = JsonlSink(output_dir)
+            else:
+                sink = FileSink(output_dir)
+            _sinks[key] = sink
+    return sink
+
+def close_sinks():
+    """すべての保存先のバッファを書き込んで閉じる"""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as e:
+            logging.error(f"保存先を閉じる際にエラーが発生しました: {e}")
+
+atexit.register(close_sinks)
@@ -0,0 +1,245 @@
+"""コンテンツの要約（Gemini API）
+
+要約はまとめて並行に行う（summarize_records）。APIの呼び出しはモデルごとに1分あたり
+SUMMARY_RPM回までに制限し（rate_limiterのトークンバケット。Redisを設定すると全ワーカーで共有）、
+429（リクエスト過多）が返った場合は指数的に間隔を空けて再試行する。
+同じ内容の要約はAPIを呼ばずに要約のキャッシュ（summary_cache）から返す。
+
+Celeryでは要約を取得のタスクから切り離し、別のキュー（SUMMARY_QUEUE）のタスク
+（tasks.summarize_batch）でまとめて行うため、取得の速さはAPIの応答時間に左右されない。
+APIを呼ばずに負荷試験をするときは、SCRAPER_SUMMARY_CLIENT=fakeでFakeSummaryClientを使う。
+
+SCRAPER_SUMMARY_ENGINE=localでは、APIを使わずに抽出型の要約（local_summarizer）を返す。
+autoでは抽出型の要約を先に作り、本文を十分に表せないページだけをGeminiで要約する（prefilter_summary）。
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from rate_limiter import rate_limiter
+from summary_cache import summary_cache, summary_key
+from config import (SUMMARY_MODEL, SUMMARY_CLIENT, SUMMARY_CONCURRENCY, SUMMARY_RPM, SUMMARY_MAX_RETRIES,
+                    SUMMARY_BACKOFF, SUMMARY_BACKOFF_MAX, SUMMARY_FAKE_LATENCY, SUMMARY_ENGINE, SUMMARY_LOCAL_MIN_COVERAGE)
+
+# 抽出型の要約を保存するときのモデル名
+LOCAL_MODEL = 'local-textrank'
+
+class RateLimitedError(Exception):
+    """APIが429（リクエスト過多）を返した（retry_afterは指定された待ち時間（秒）。なければNone）"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# プロセスで再利用するGeminiのモデル（(APIキー, モデル名) -> GenerativeModel）
+_summary_models = {}
+_summary_models_lock = threading.Lock()
+
+def get_summary_model(api_key, model_name=SUMMARY_MODEL):
+    """Geminiのモデルを返す（APIキーとモデル名ごとにプロセスで1回だけ作成する）"""
+    import google.generativeai as genai
+
+    key = (api_key, model_name)
+    with _summary_models_lock:
+        model = _summary_models.get(key)
+        if model is None:
+            # APIキーの設定（異なるキーのモデルを作るときだけ設定し直す）
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(model_name)
+            _summary_models[key] = model
+        return model
+
+def _is_rate_limited(error):
+    """例外が429（google.api_coreのResourceExhausted / TooManyRequests）かどうか"""
+    return getattr(error, 'code', None) == 429 or type(error).__name__ in ('ResourceExhausted', 'TooManyRequests')
+
+class GeminiClient:
+    """Gemini APIで要約を生成するクライアント"""
+
+    def __init__(self, api_key, model_name=SUMMARY_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+
+    def generate(self, prompt, max_length):
+        """プロンプトから要約を生成する（429の場合はRateLimitedErrorを送出する）"""
+        model = get_summary_model(self.api_key, self.model_name)
+
+        # 生成パラメータの設定
+        generation_config = {
+            'temperature': 0.2,  # 決定的な出力のために低い温度
+            'max_output_tokens': max_length,  # 出力の長さ制限
+            'top_p': 0.95,  # 核サンプリング
+        }
+
+        try:
+            response = model.generate_content(prompt, generation_config=generation_config)
+        except Exception as e:
+            if _is_rate_limited(e):
+                raise RateLimitedError(str(e)) from e
+            raise
+        return response.text
+
+class FakeSummaryClient:
+    """APIを呼ばずに要約を返すクライアント（負荷試験用。モデル名はfake）
+
+    latency秒待ってから、プロンプトのハッシュを含む決まった要約を返す。
+    rate_limit_rateの割合の呼び出しでRateLimitedErrorを送出し、429の再試行を試せる。
+    """
+
+    model_name = 'fake'
+
+    def __init__(self, latency=SUMMARY_FAKE_LATENCY, rate_limit_rate=0.0):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, max_length):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if random.random() < self.rate_limit_rate:
+                self.rate_limited += 1
+                raise RateLimitedError('429 Too Many Requests (fake)')
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        return f"- 要約 {digest}"[:max_length]
+
+def get_summary_client(api_key, model_name=SUMMARY_MODEL, client=SUMMARY_CLIENT):
+    """要約のクライアントを返す（clientはgemini / fake）"""
+    if client == 'fake':
+        return FakeSummaryClient()
+    return GeminiClient(api_key, model_name)
+
+def build_summary_prompt(data, language='Japanese', style='bullet'):
+    """要約するコンテンツと、それを要約するプロンプトを返す"""
+    # 要約するコンテンツの準備
+    content_to_summarize = f"Title: {data.get('title', '')}\n"
+    if data.get('description'):
+        content_to_summarize += f"Description: {data.get('description')}\n"
+    if data.get('content'):
+        content_to_summarize += f"Content: {data.get('content')}\n"
+
+    # 要約スタイルに基づいてプロンプトを作成
+    if style == 'bullet':
+        prompt = f"Summarize this text in {language} in 3-5 bullet points: \"{content_to_summarize}\""
+    elif style == 'paragraph':
+        prompt = f"Summarize this text in {language} in a short paragraph: \"{content_to_summarize}\""
+    elif style == 'headline':
+        prompt = f"Summarize this text in {language} in a single headline (30 characters or less): \"{content_to_summarize}\""
+    else:
+        prompt = f"Summarize this text in {language}: \"{content_to_summarize}\""
+    return content_to_summarize, prompt
+
+def local_summary(data, style='bullet', max_length=200):
+    """抽出型の要約と、それが本文を表している度合い（coverage）を返す（numpyがなければ(None, 0.0)）"""
+    try:
+        from local_summarizer import extractive_summary
+    except ImportError:
+        logging.warning("numpyパッケージがインストールされていないため、抽出型の要約は使えません。pip install numpyでインストールしてください。")
+        return None, 0.0
+    return extractive_summary(data, style, max_length)
+
+def prefilter_summary(data, style='bullet', max_length=200, engine=SUMMARY_ENGINE, min_coverage=SUMMARY_LOCAL_MIN_COVERAGE):
+    """抽出型の要約で済むかどうかを判定し、(抽出型の要約, Geminiで要約するか)を返す
+
+    engineがlocalなら抽出型の要約を必ず使い（作れなければ要約なし）、autoならcoverageが
+    min_coverage以上のときだけ使う。geminiなら抽出型の要約は作らない。
+    """
+    if engine not in ('local', 'auto'):
+        return None, True
+    summary, coverage = local_summary(data, style, max_length)
+    if engine == 'local':
+        return summary, False
+    if summary and coverage >= min_coverage:
+        return summary, False
+    logging.debug(f"抽出型の要約では本文を十分に表せないため（coverage {coverage:.2f}）、Geminiで要約します: {data.get('url')}")
+    return None, True
+
+def backoff_delay(attempt, retry_after=None, base=SUMMARY_BACKOFF, limit=SUMMARY_BACKOFF_MAX):
+    """attempt回目（0から）の再試行までの待ち時間（指数的に延ばし、同時に再試行しないよう揺らぎを加える）"""
+    delay = min(limit, base * (2 ** attempt))
+    delay = random.uniform(delay / 2, delay)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+def generate_summary(client, prompt, max_length, rpm=SUMMARY_RPM, max_retries=SUMMARY_MAX_RETRIES):
+    """レート制限を守ってプロンプトから要約を生成する（429は最大max_retries回再試行する）"""
+    interval = 60.0 / rpm if rpm > 0 else 0
+    attempt = 0
+    while True:
+        # モデルごとのトークンバケット（ドメインのレート制限と同じ仕組み）
+        rate_limiter.wait_key(f"summary:{client.model_name}", interval)
+        try:
+            return client.generate(prompt, max_length)
+        except RateLimitedError as e:
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, e.retry_after)
+            attempt += 1
+            logging.warning(f"要約のAPIがリクエスト過多を返しました。{delay:.1f}秒後に再試行します（{attempt}/{max_retries}）。")
+            time.sleep(delay)
+
+def summarize_content(data, api_key, language='Japanese', max_length=200, style='bullet', model_name=SUMMARY_MODEL, use_cache=True,
+                      client=None, rpm=SUMMARY_RPM, engine=SUMMARY_ENGINE):
+    """Gemini APIを使用してコンテンツを要約する（失敗した場合はNone）
+
+    同じ内容を同じ条件（言語・スタイル・長さ・モデル）で要約済みの場合は、
+    APIを呼ばずに要約のキャッシュ（summary_cache）から返す。
+    clientを省略するとSCRAPER_SUMMARY_CLIENTのクライアント（通常はGemini）を使う。
+    APIの呼び出しはモデルごとに1分あたりrpm回までに制限する。
+    engineがlocal / autoの場合は抽出型の要約を先に作る（prefilter_summaryを参照。抽出型の要約は本文の言語のまま）。
+    """
+    summary, needs_llm = prefilter_summary(data, style, max_length, engine)
+    if not needs_llm:
+        return summary
+
+    content_to_summarize, prompt = build_summary_prompt(data, language, style)
+    client = client or get_summary_client(api_key, model_name)
+
+    cache = summary_cache if use_cache else None
+    if cache:
+        # 偽のクライアントの要約を本物と取り違えないよう、キーにはクライアントのモデル名を使う
+        key = summary_key(content_to_summarize, language, style, max_length, client.model_name)
+        summary = cache.get(key)
+        if summary is not None:
+            logging.info("要約のキャッシュを使用しました。")
+            return summary
+
+    try:
+        summary = generate_summary(client, prompt, max_length, rpm=rpm)
+
+        if cache and summary:
+            cache.set(key, summary, client.model_name)
+
+        # 要約を返す
+        return summary
+
+    except ImportError:
+        logging.error("google-generativeaiパッケージがインストールされていません。pip install google-generativeaiでインストールしてください。")
+        return None
+    except RateLimitedError as e:
+        logging.error(f"要約のAPIのリクエスト過多が続いたため、要約をあきらめました: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"要約中にエラーが発生しました: {e}")
+        return None
+
+def summarize_records(records, api_key, language='Japanese', max_length=200, style='bullet', model_name=SUMMARY_MODEL,
+                      concurrency=SUMMARY_CONCURRENCY, client=None, rpm=SUMMARY_RPM, engine=SUMMARY_ENGINE):
+    """複数のレコードをconcurrency件ずつ並行に要約し、レコードと同じ順番の要約のリストを返す（失敗したものはNone）
+
+    APIの呼び出しはモデルごとのレート制限（1分あたりrpm回）に従うため、並行数を増やしても制限を超えない。
+    """
+    if not records:
+        return []
+    client = client or get_summary_client(api_key, model_name)
+    summarize = partial(summarize_content, api_key=api_key, language=language, max_length=max_length, style=style,
+                        model_name=model_name, client=client, rpm=rpm, engine=engine)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(records))), thread_name_prefix='summarizer') as executor:
+        return list(executor.map(summarize, records))
@@ -0,0 +1,222 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from config import (SUMMARY_CACHE_ENABLED, SUMMARY_CACHE_DIR, SUMMARY_CACHE_TTL, SUMMARY_CACHE_MAX_ENTRIES,
+                    SUMMARY_CACHE_REDIS_URL)
+
+# Redisに保存するときのキーの接頭辞（要約 / 最終利用時刻のソート済みセット / ヒット数の集計）
+REDIS_KEY_PREFIX = 'summary:'
+REDIS_LRU_KEY = 'summary-lru'
+REDIS_STATS_KEY = 'summary-stats'
+
+def summary_key(content, language, style, max_length, model):
+    """要約のキャッシュのキー（要約する内容と要約の条件のハッシュ）を返す"""
+    payload = json.dumps([content, language, style, max_length, model], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SummaryCache:
+    """要約のキャッシュ（ディスクまたはRedis）
+
+    同じ内容を同じ条件（言語・スタイル・長さ・モデル）で要約した結果を、ttl秒の間再利用する。
+    ディスクではdirectoryの下にキーごとのJSONファイルを置き、max_entries件を超えたら
+    最終利用時刻（ファイルの更新時刻）の古いものから削除する。
+    redis_urlを指定した場合はRedisに保存し、全ワーカーで共有する（件数の上限も全体で数える）。
+    """
+
+    def __init__(self, directory=SUMMARY_CACHE_DIR, ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+                 redis_url=SUMMARY_CACHE_REDIS_URL):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_url = redis_url
+        self._redis = None
+        self._lock = threading.Lock()
+        self._entry_count = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(self.redis_url)
+            except ImportError:
+                logging.warning("redisパッケージがインストールされていません。要約はディスクにキャッシュします。")
+                self.redis_url = None
+        return self._redis
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.hincrby(REDIS_STATS_KEY, 'hits' if hit else 'misses', 1)
+            except Exception as e:
+                logging.debug(f"要約キャッシュ（Redis）の集計に失敗しました: {e}")
+
+    def get(self, key):
+        """キャッシュ済みの要約を返す（なければNone）"""
+        client = self._get_redis()
+        if client is not None:
+            summary = self._redis_get(client, key)
+        else:
+            summary = self._disk_get(key)
+        self._count(summary is not None)
+        return summary
+
+    def _redis_get(self, client, key):
+        try:
+            cached = client.get(REDIS_KEY_PREFIX + key)
+            if cached is None:
+                return None
+            client.zadd(REDIS_LRU_KEY, {key: time.time()})
+            return json.loads(cached)['summary']
+        except Exception as e:
+            logging.warning(f"要約キャッシュ（Redis）の読み込みに失敗しました: {e}")
+            return None
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"要約キャッシュの読み込みに失敗しました: {e}")
+            return None
+        if entry['created_at'] + self.ttl <= time.time():
+            self._remove(path)
+            with self._lock:
+                if self._entry_count:
+                    self._entry_count -= 1
+            return None
+        # 最終利用時刻を更新して、よく使われる要約を削除の対象から外す
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['summary']
+
+    def set(self, key, summary, model=None):
+        """要約を保存する"""
+        entry = {'summary': summary, 'model': model, 'created_at': time.time()}
+        client = self._get_redis()
+        if client is not None:
+            self._redis_set(client, key, entry)
+        else:
+            self._disk_set(key, entry)
+        with self._lock:
+            self.stores += 1
+
+    def _redis_set(self, client, key, entry):
+        try:
+            pipeline = client.pipeline()
+            pipeline.set(REDIS_KEY_PREFIX + key, json.dumps(entry, ensure_ascii=False), ex=max(1, int(self.ttl)))
+            pipeline.zadd(REDIS_LRU_KEY, {key: entry['created_at']})
+            # 期限切れで消えた要約のキーを取り除く
+            pipeline.zremrangebyscore(REDIS_LRU_KEY, '-inf', entry['created_at'] - self.ttl)
+            pipeline.zcard(REDIS_LRU_KEY)
+            count = pipeline.execute()[-1]
+            if count > self.max_entries:
+                evicted = [member.decode() for member, _ in client.zpopmin(REDIS_LRU_KEY, count - self.max_entries)]
+                if evicted:
+                    client.delete(*[REDIS_KEY_PREFIX + member for member in evicted])
+                    with self._lock:
+                        self.evictions += len(evicted)
+        except Exception as e:
+            logging.warning(f"要約キャッシュ（Redis）の書き込みに失敗しました: {e}")
+
+    def _disk_set(self, key, entry):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            existed = os.path.exists(path)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"要約キャッシュの書き込みに失敗しました: {e}")
+            return
+        with self._lock:
+            if self._entry_count is None:
+                self._entry_count = len(self._disk_paths())
+            elif not existed:
+                self._entry_count += 1
+            # 上限を1割超えたらまとめて削除する（書き込みのたびにディレクトリを走査しない）
+            if self._entry_count <= self.max_entries * 1.1:
+                return
+        self._evict()
+
+    def _disk_paths(self):
+        return glob.glob(os.path.join(self.directory, '*', '*.json'))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """期限切れの要約と、上限を超えた分の最終利用時刻の古い要約を削除する"""
+        now = time.time()
+        entries = []
+        for path in self._disk_paths():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        entries.sort()
+        expired = [path for mtime, path in entries if mtime + self.ttl <= now]
+        remaining = len(entries) - len(expired)
+        excess = [path for _, path in entries[len(expired):]][:max(0, remaining - self.max_entries)]
+        for path in expired + excess:
+            self._remove(path)
+        with self._lock:
+            self._entry_count = remaining - len(excess)
+            self.evictions += len(expired) + len(excess)
+        logging.info(f"要約キャッシュから{len(expired) + len(excess)}件を削除しました（残り {self._entry_count}件）")
+
+    def stats(self):
+        """要約キャッシュのヒット数・ミス数を返す（Redisを使う場合は全ワーカーの合計も含める）"""
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+        client = self._get_redis()
+        if client is not None:
+            try:
+                shared = {name.decode(): int(value) for name, value in client.hgetall(REDIS_STATS_KEY).items()}
+                shared_total = shared.get('hits', 0) + shared.get('misses', 0)
+                stats['shared'] = {
+                    'hits': shared.get('hits', 0),
+                    'misses': shared.get('misses', 0),
+                    'hit_rate': shared.get('hits', 0) / shared_total if shared_total else 0.0,
+                    'size': client.zcard(REDIS_LRU_KEY),
+                }
+            except Exception as e:
+                logging.warning(f"要約キャッシュ（Redis）の集計を取得できませんでした: {e}")
+        return stats
+
+# プロセスで共有するキャッシュ（無効の場合はNone）
+summary_cache = SummaryCache() if SUMMARY_CACHE_ENABLED else None
@@ -1,26 +1,130 @@
 import logging
+import os
+import time
+import uuid
+from functools import partial
+from celery import chord, group
+from celery.exceptions import Retry
+from celery.signals import worker_process_shutdown
 from celery_app import app
-from app import scrape_website, filter_content_by_keyword
+from app import HEADERS, scrape_website, process_page, filter_content_by_keyword
+from async_fetcher import fetch_urls
+from pipeline import can_start_parse_workers, fetch_urls_pipeline, shutdown_parse_executor
+import crawler
+from sinks import get_sink, close_sinks
+from http_cache import is_not_modified
+from near_dup import is_near_duplicate
+from fetch_limits import is_fetch_limited, is_truncated
+from url_index import url_index
+from result_store import result_store, result_status, STORED_STATUSES, NEAR_DUPLICATE
+from rate_limiter import rate_limiter, crawl_interval, domain_key
+from robots_cache import robots_cache
+from summarizer import summarize_records, get_summary_client, prefilter_summary, LOCAL_MODEL
+from config import (FETCH_ENGINE, FETCH_CONCURRENCY, FETCH_PER_HOST, RATE_LIMIT_MAX_SLEEP, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES,
+                    SUMMARY_CLIENT, SUMMARY_BATCH_SIZE, SUMMARY_LANGUAGE, SUMMARY_STYLE, SUMMARY_LENGTH, SCRAPE_CHUNK_SIZE)
 
-@app.task
-def scrape_url(url, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False):
-    """単一URLのスクレイピングを行うタスク"""
+@app.task(bind=True)
+def scrape_url(self, url, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False, parser=None, use_cache=True,
+               sink=None, reserved=False):
+    """単一URLのスクレイピングを行うタスク
+
+    ページの内容は返さず、保存先・ステータス・件数などの小さな要約（result_envelope）を返す
+    （ページの内容は保存先と結果のストアにある）。
+    summarizeがTrueの場合は、要約のキュー（summarize_batch）に送り、要約を待たずに返す。
+    ドメインのレート制限で長く待つ必要がある場合は、ワーカーを占有しないよう
+    待ち時間の後にタスクを再実行する（reservedは予約済みの再実行であることを表す）。
+    """
+    if not reserved:
+        ua = user_agent or HEADERS['User-Agent']
+        interval = crawl_interval(delay, robots_cache.get_rules(url, {**HEADERS, 'User-Agent': ua}), ua)
+        wait = rate_limiter.reserve(url, interval)
+        if wait > RATE_LIMIT_MAX_SLEEP:
+            logging.info(f"{url} のドメインのレート制限により、{wait:.2f}秒後に再実行します。")
+            raise self.retry(args=self.request.args, kwargs={**self.request.kwargs, 'reserved': True}, countdown=wait, max_retries=None)
+        if wait > 0:
+            time.sleep(wait)
+    
     logging.info(f"スケジュールされたタスク: {url} のスクレイピングを開始します...")
     
-    # スクレイピングの実行
+    started = time.perf_counter()
+    result, filtered_result, fetched_at = scrape_and_record(url, output_dir, min_text_length, delay, user_agent, keyword, summarize,
+                                                            parser, use_cache, sink)
+    return result_envelope(url, result, filtered_result, fetched_at, time.perf_counter() - started)
+
+def scrape_and_record(url, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False, parser=None,
+                      use_cache=True, sink=None):
+    """URLを取得して結果のストアとURLのインデックスに記録し、(結果, キーワードでフィルタリングした結果, 取得時刻)を返す
+
+    レート制限の予約は呼び出し側で済ませておく。
+    """
+    # スクレイピングの実行（レート制限の予約は済んでいる）
     result = scrape_website(
         url=url,
         output_dir=output_dir,
         min_text_length=min_text_length,
         delay=delay,
-        user_agent=user_agent
+        user_agent=user_agent,
+        parser=parser,
+        use_cache=use_cache,
+        rate_limit=False,
+        sink=sink
     )
     
+    fetched_at = time.time()
+    if result_store:
+        result_store.record(url, result, fetched_at=fetched_at)
+    
     if not result:
         logging.error(f"{url} のスクレイピングに失敗しました。")
+        return None, None, fetched_at
+    
+    if url_index:
+        url_index.record_result(url, result)
+    
+    filtered_result = filter_by_keyword(result, keyword)
+    if summarize:
+        enqueue_summaries([(url, fetched_at, filtered_result)], output_dir, sink)
+    return result, filtered_result, fetched_at
+
+def result_envelope(url, result, filtered_result, fetched_at, duration=None):
+    """タスクの戻り値にする結果の要約を返す（ページの内容は含めない）
+
+    ステータス・取得時刻・所要時間（秒）に加え、保存したページ（本文を切り詰めたページを含む）は
+    保存先（location。ファイルのパスかレコードのID）・タイトル・本文の文字数・画像とリンクの数・
+    キーワードに一致したか（一致したキーワード）を、ほぼ同じ内容のページは保存済みのスナップショット（duplicate_of）を、
+    上限を超えて取得をやめたページは読んだバイト数（received_bytes）を含める。
+    """
+    status = result_status(result)
+    envelope = {'url': url, 'status': status, 'fetched_at': fetched_at}
+    if duration is not None:
+        envelope['duration'] = round(duration, 3)
+    if status in STORED_STATUSES:
+        envelope.update({
+            'location': result.get('location'),
+            'title': result.get('title'),
+            'content_length': len(result.get('content') or ''),
+            'image_count': len(result.get('images') or []),
+            'link_count': len(result.get('links') or []),
+            'matched': bool(filtered_result),
+            'matched_keywords': sorted((filtered_result or {}).get('matched_keywords') or []),
+        })
+    elif status == NEAR_DUPLICATE:
+        envelope['duplicate_of'] = result.get('duplicate_of')
+    elif is_fetch_limited(result):
+        envelope['received_bytes'] = result.get('received_bytes')
+    return envelope
+
+def filter_by_keyword(result, keyword):
+    """キーワードフィルタリング（指定されている場合）"""
+    if is_not_modified(result):
+        logging.info(f"{result['url']} は前回の取得から更新されていません。")
+        return result
+    if is_near_duplicate(result):
+        logging.info(f"{result['url']} は保存済みのスナップショット（{result['duplicate_of']}）とほぼ同じ内容です。")
+        return result
+    if is_fetch_limited(result):
         return None
     
-    # キーワードフィルタリング（指定されている場合）
     if keyword:
         logging.info(f"キーワード '{keyword}' でフィルタリングします...")
         filtered_result = filter_content_by_keyword(result, keyword)
@@ -33,12 +137,322 @@ def scrape_url(url, output_dir='data', min_text_length=50, delay=1, user_agent=N
     
     return result
 
+def _summarizable(result):
+    """要約するページかどうか（保存してキーワードにも一致したページ）"""
+    return bool(result) and not is_not_modified(result) and not is_near_duplicate(result) and not is_fetch_limited(result)
+
+def attach_summary(record, summary, model, output_dir='data', sink=None):
+    """要約を結果のストアと保存先に追加する"""
+    if result_store:
+        result_store.record_summary(record['url'], record['fetched_at'], summary, model)
+    # JSON LinesとParquetでは、ページのレコードとは別のsummaryのレコードとして追記する
+    get_sink(output_dir, sink).write({'url': record['url'], 'summary': summary, 'model': model}, kind='summary')
+
+def enqueue_summaries(entries, output_dir='data', sink=None):
+    """(URL, 取得時刻, 結果)のリストのうち要約するページを、SUMMARY_BATCH_SIZE件ずつ要約のキューに送る（要約するページ数を返す）
+
+    SCRAPER_SUMMARY_ENGINEがlocal / autoの場合は、抽出型の要約で済むページをここで要約し、
+    Geminiで要約するページだけをキューに送る（summarizer.prefilter_summaryを参照）。
+    """
+    records = [
+        {'url': url, 'fetched_at': fetched_at, 'title': result.get('title'), 'description': result.get('description'),
+         'content': result.get('content')}
+        for url, fetched_at, result in entries if _summarizable(result)
+    ]
+    queued = []
+    for record in records:
+        summary, needs_llm = prefilter_summary(record, SUMMARY_STYLE, SUMMARY_LENGTH)
+        if needs_llm:
+            queued.append(record)
+        elif summary:
+            attach_summary(record, summary, LOCAL_MODEL, output_dir, sink)
+    for start in range(0, len(queued), SUMMARY_BATCH_SIZE):
+        summarize_batch.delay(queued[start:start + SUMMARY_BATCH_SIZE], output_dir=output_dir, sink=sink)
+    return len(records)
+
+@app.task
+def summarize_batch(records, output_dir='data', sink=None):
+    """ページをまとめて要約し、結果のストアと保存先に要約を追加するタスク（キューはSUMMARY_QUEUE）
+
+    recordsはURL・取得時刻・タイトル・説明・本文の辞書のリスト。要約は並行して行い、
+    APIのレート制限（SCRAPER_SUMMARY_RPM）と429の再試行はsummarizer.summarize_recordsが行う。
+    抽出型の要約で済むかの判定はキューに送る前に済んでいるため、ここではGeminiで要約する。
+    """
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key and SUMMARY_CLIENT != 'fake':
+        logging.error("Gemini APIキーが指定されていません。環境変数GEMINI_API_KEYで設定してください。")
+        return {'summarized': 0, 'failed': len(records)}
+    
+    client = get_summary_client(api_key)
+    summaries = summarize_records(records, api_key, language=SUMMARY_LANGUAGE, max_length=SUMMARY_LENGTH, style=SUMMARY_STYLE,
+                                  client=client, engine='gemini')
+    
+    stats = {'summarized': 0, 'failed': 0}
+    for record, summary in zip(records, summaries):
+        if not summary:
+            stats['failed'] += 1
+            continue
+        stats['summarized'] += 1
+        attach_summary(record, summary, client.model_name, output_dir, sink)
+    get_sink(output_dir, sink).flush()
+    
+    logging.info(f"{len(records)}件のページを要約しました: {stats}")
+    return stats
+
+def page_fetcher(output_dir='data', min_text_length=50, parser=None, sink=None, pipeline=False, **kwargs):
+    """URLのリストを取得して保存し、結果のリストを返す関数を返す（kwargsはAsyncFetcherの引数）
+
+    pipelineがTrueの場合は取得と解析を分けたパイプライン、Falseの場合は解析もスレッドで行うAsyncFetcher。
+    preforkのワーカー（デーモンのプロセス）では解析のワーカーのプールを作れないため、pipelineがTrueでもAsyncFetcherを使う。
+    """
+    if pipeline and not can_start_parse_workers():
+        logging.warning("デーモンのプロセス（preforkのワーカー）では解析のワーカーのプールを作れないため、パイプラインの代わりに"
+                        "非同期の取得（async）を使用します。パイプラインは -P threads か -P solo のワーカーで実行してください。")
+        pipeline = False
+    if pipeline:
+        return partial(fetch_urls_pipeline, output_dir=output_dir, min_text_length=min_text_length, parser=parser, sink=sink, **kwargs)
+    handler = partial(process_page, output_dir=output_dir, min_text_length=min_text_length, parser=parser, sink=sink)
+    return partial(fetch_urls, handler=handler, **kwargs)
+
 @app.task
-def scrape_scheduled_urls(urls, **kwargs):
-    """複数URLのスクレイピングを行うタスク"""
-    results = []
-    for url in urls:
-        result = scrape_url.delay(url, **kwargs)
-        results.append(result.id)
-    
-    return results
+def scrape_urls_async(urls, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False, parser=None,
+                      use_cache=True, concurrency=FETCH_CONCURRENCY, per_host=FETCH_PER_HOST, sink=None, pipeline=False):
+    """複数URLを1つのタスク内で非同期に並行取得するタスク
+
+    同じドメインへのリクエストはdelay秒（またはrobots.txtのCrawl-delay）の間隔で行い、異なるホストは並行して取得する。
+    pipelineがTrueの場合は、解析をプロセスのプールで行うパイプライン（pipeline.fetch_urls_pipeline）で取得する。
+    結果はURLと同じ順番の結果の要約（result_envelope）のリスト。
+    summarizeがTrueの場合は、保存したページを要約のキュー（summarize_batch）に送る。
+    """
+    logging.info(f"スケジュールされたタスク: {len(urls)}件のURLを非同期で取得します...")
+    
+    headers = HEADERS.copy()
+    if user_agent:
+        headers['User-Agent'] = user_agent
+    
+    fetch = page_fetcher(output_dir, min_text_length, parser, sink, pipeline, headers=headers, concurrency=concurrency, per_host=per_host,
+                         delay=delay, use_cache=use_cache)
+    results = fetch(urls)
+    fetched_at = time.time()
+    if url_index:
+        for url, result in zip(urls, results):
+            url_index.record_result(url, result)
+    if result_store:
+        for url, result in zip(urls, results):
+            result_store.record(url, result, fetched_at=fetched_at)
+    get_sink(output_dir, sink).flush()
+    
+    filtered_results = [filter_by_keyword(result, keyword) if result else None for result in results]
+    if summarize:
+        enqueue_summaries([(url, fetched_at, result) for url, result in zip(urls, filtered_results)], output_dir, sink)
+    return [result_envelope(url, result, filtered_result, fetched_at)
+            for url, result, filtered_result in zip(urls, results, filtered_results)]
+
+@app.task
+def crawl_site(urls, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False, parser=None,
+               use_cache=True, concurrency=FETCH_CONCURRENCY, per_host=FETCH_PER_HOST, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES,
+               same_domain=True, include=None, exclude=None, sink=None, pipeline=False):
+    """シードURLからリンクを幅優先でたどってクロールするタスク
+
+    ページは非同期でまとめて取得し（pipelineがTrueの場合はパイプラインで取得し）、深さmax_depthまで、最大max_pagesページを保存する。
+    same_domain・include・excludeでたどるURLの範囲を指定できる（crawler.CrawlScopeを参照）。
+    summarizeがTrueの場合は、保存したページをSUMMARY_BATCH_SIZE件ごとに要約のキュー（summarize_batch）に送る。
+    結果のリストは大きくなるため、件数の集計だけを返す。
+    """
+    logging.info(f"スケジュールされたタスク: {len(urls)}件のシードURLからクロールを開始します...")
+    
+    headers = HEADERS.copy()
+    if user_agent:
+        headers['User-Agent'] = user_agent
+    
+    fetch = page_fetcher(output_dir, min_text_length, parser, sink, pipeline, headers=headers, concurrency=concurrency, per_host=per_host,
+                         delay=delay, use_cache=use_cache)
+    scope = crawler.CrawlScope(urls, same_domain=same_domain, include=include, exclude=exclude)
+    
+    stats = {'pages': 0, 'saved': 0, 'truncated': 0, 'not_modified': 0, 'near_duplicate': 0, 'oversized': 0, 'deadline_exceeded': 0,
+             'failed': 0, 'matched': 0, 'max_depth': 0, 'summary_queued': 0}
+    pending_summaries = []
+    for url, depth, result in crawler.crawl(urls, fetch, max_depth=max_depth, max_pages=max_pages, scope=scope):
+        stats['pages'] += 1
+        stats['max_depth'] = max(stats['max_depth'], depth)
+        fetched_at = time.time()
+        if result_store:
+            result_store.record(url, result, fetched_at=fetched_at)
+        if not result:
+            stats['failed'] += 1
+        elif is_not_modified(result):
+            stats['not_modified'] += 1
+        elif is_near_duplicate(result):
+            stats['near_duplicate'] += 1
+        elif is_fetch_limited(result):
+            stats[result['status']] += 1
+        else:
+            stats['truncated' if is_truncated(result) else 'saved'] += 1
+            filtered_result = filter_by_keyword(result, keyword)
+            if filtered_result:
+                stats['matched'] += 1
+                if summarize:
+                    pending_summaries.append((url, fetched_at, filtered_result))
+        # クロールの終了を待たずに、たまった分から要約を始める
+        if len(pending_summaries) >= SUMMARY_BATCH_SIZE:
+            stats['summary_queued'] += enqueue_summaries(pending_summaries, output_dir, sink)
+            pending_summaries = []
+    
+    stats['summary_queued'] += enqueue_summaries(pending_summaries, output_dir, sink)
+    get_sink(output_dir, sink).flush()
+    logging.info(f"クロールが完了しました: {stats}")
+    return stats
+
+def chunk_urls(urls, size=SCRAPE_CHUNK_SIZE):
+    """URLをsize件ずつのチャンクに分ける
+
+    ドメイン順に並べてからチャンクに1件ずつ配るため、同じドメインのURLはなるべく別のチャンクに入り、
+    チャンクの中で同じドメインのレート制限を待たずに済む。
+    """
+    count = max(1, -(-len(urls) // size))
+    ordered = sorted(urls, key=domain_key)
+    return [ordered[index::count] for index in range(count)]
+
+def new_run_stats():
+    """実行の集計の初期値（durationsはURLごとの取得と保存にかかった秒数）
+
+    truncatedは本文を切り詰めて保存したページ、oversized・deadline_exceededは上限を超えて取得をやめたページの数。
+    """
+    return {'urls': 0, 'saved': 0, 'truncated': 0, 'not_modified': 0, 'near_duplicate': 0, 'oversized': 0, 'deadline_exceeded': 0,
+            'failed': 0, 'matched': 0, 'bytes': 0, 'durations': []}
+
+def add_run_result(stats, result, filtered_result, duration):
+    """URLの結果を実行の集計に加える（bytesは保存した本文のUTF-8のバイト数）"""
+    stats['urls'] += 1
+    stats['durations'].append(round(duration, 3))
+    if not result:
+        stats['failed'] += 1
+    elif is_not_modified(result):
+        stats['not_modified'] += 1
+    elif is_near_duplicate(result):
+        stats['near_duplicate'] += 1
+    elif is_fetch_limited(result):
+        stats[result['status']] += 1
+    else:
+        stats['truncated' if is_truncated(result) else 'saved'] += 1
+        stats['bytes'] += len((result.get('content') or '').encode('utf-8'))
+        if filtered_result:
+            stats['matched'] += 1
+
+def merge_run_stats(chunk_stats, elapsed):
+    """チャンクごとの集計を1つの実行の集計にまとめる（所要時間は合計・平均・中央値・95パーセンタイル・最大）"""
+    stats = new_run_stats()
+    durations = stats.pop('durations')
+    for chunk in chunk_stats:
+        for name, value in chunk.items():
+            if name == 'durations':
+                durations.extend(value)
+            else:
+                stats[name] += value
+    durations.sort()
+    stats['pages'] = stats['saved'] + stats['truncated'] + stats['not_modified'] + stats['near_duplicate']
+    stats['chunks'] = len(chunk_stats)
+    stats['elapsed'] = round(elapsed, 3)
+    stats['pages_per_second'] = round(stats['pages'] / elapsed, 3) if elapsed > 0 else 0.0
+    if durations:
+        stats['duration_total'] = round(sum(durations), 3)
+        stats['duration_avg'] = round(sum(durations) / len(durations), 3)
+        stats['duration_p50'] = durations[len(durations) // 2]
+        stats['duration_p95'] = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        stats['duration_max'] = durations[-1]
+    return stats
+
+@app.task(bind=True)
+def scrape_url_chunk(self, urls, output_dir='data', min_text_length=50, delay=1, user_agent=None, keyword=None, summarize=False, parser=None,
+                     use_cache=True, sink=None, stats=None, reserved=False):
+    """URLのチャンクを順に取得し、件数・バイト数・所要時間の集計を返すタスク（scrape_scheduled_urlsのchordのヘッダー）
+
+    ドメインのレート制限の待ち時間がRATE_LIMIT_MAX_SLEEP秒を超える場合は、scrape_urlと同じく
+    ワーカーを占有しないよう、残りのURLとそこまでの集計（stats）を渡して待ち時間の後にタスクを再実行する
+    （reservedは先頭のURLが予約済みであることを表す。再実行はタスクIDが変わらないため、chordの集計にそのまま入る）。
+    """
+    ua = user_agent or HEADERS['User-Agent']
+    stats = stats or new_run_stats()
+    for index, url in enumerate(urls):
+        result = filtered_result = None
+        try:
+            if not (reserved and index == 0):
+                interval = crawl_interval(delay, robots_cache.get_rules(url, {**HEADERS, 'User-Agent': ua}), ua)
+                wait = rate_limiter.reserve(url, interval)
+                if wait > RATE_LIMIT_MAX_SLEEP:
+                    logging.info(f"{url} のドメインのレート制限により、残りの{len(urls) - index}件を{wait:.2f}秒後に再実行します。")
+                    get_sink(output_dir, sink).flush()
+                    raise self.retry(args=(urls[index:],), kwargs={**self.request.kwargs, 'stats': stats, 'reserved': True},
+                                     countdown=wait, max_retries=None)
+                if wait > 0:
+                    time.sleep(wait)
+            started = time.perf_counter()
+            result, filtered_result, _ = scrape_and_record(url, output_dir, min_text_length, delay, user_agent, keyword, summarize,
+                                                           parser, use_cache, sink)
+        except Retry:
+            raise
+        except Exception as e:
+            # 1件の失敗で実行全体の集計（chordのコールバック）が止まらないようにする
+            logging.error(f"{url} のスクレイピング中に例外が発生しました: {e}")
+            started = time.perf_counter()
+        add_run_result(stats, result, filtered_result, time.perf_counter() - started)
+    get_sink(output_dir, sink).flush()
+    return stats
+
+@app.task
+def aggregate_run(chunk_stats, run_id, started_at):
+    """チャンクの集計をまとめて、実行の集計を結果のストアに記録するタスク（scrape_scheduled_urlsのchordのコールバック）"""
+    stats = merge_run_stats(chunk_stats, time.time() - started_at)
+    if result_store:
+        result_store.finish_run(run_id, stats)
+    logging.info(f"スケジュール実行 {run_id} が完了しました: {stats}")
+    return stats
+
+@app.task
+def scrape_scheduled_urls(urls, engine=None, crawl=False, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES, skip_fresh=True, **kwargs):
+    """複数URLのスクレイピングを行うタスク
+
+    crawlがTrueの場合はURLをシードとしてcrawl_siteでリンクをたどる。
+    engineが'async'の場合はURLごとにタスクを作らず、scrape_urls_asyncでまとめて取得する。
+    'pipeline'の場合も同じだが、解析はプロセスのプールで行う（pipeline.pyを参照）。
+    それ以外の場合はURLをSCRAPE_CHUNK_SIZE件ずつのチャンク（scrape_url_chunk）に分けてchordで並行に取得し、
+    コールバック（aggregate_run）で実行全体の集計を結果のストアのrunsに記録する。
+    同じページを指すURLと、最近取得したURL（url_indexを参照）はキューに入れない。
+    skip_freshがFalseの場合（Web UIの「今すぐ実行」）は、最近取得したURLも取得する。
+    戻り値は{'task_ids': 起動したタスクのIDのリスト, 'skipped': スキップしたURL（url_index.partition_urlsを参照）}。
+    chordで取得した場合のタスクIDは実行のID（コールバックのタスクIDと同じ）。
+    """
+    skipped = []
+    if url_index:
+        urls, skipped = url_index.partition_urls(urls, skip_fresh)
+        if not urls:
+            logging.info("取得するURLがないため、スケジュール実行をスキップします。")
+            return {'task_ids': [], 'skipped': skipped}
+    
+    engine = engine or FETCH_ENGINE
+    if crawl:
+        result = crawl_site.delay(urls, max_depth=max_depth, max_pages=max_pages, pipeline=engine == 'pipeline', **kwargs)
+        return {'task_ids': [result.id], 'skipped': skipped}
+    
+    if engine in ('async', 'pipeline'):
+        result = scrape_urls_async.delay(urls, pipeline=engine == 'pipeline', **kwargs)
+        return {'task_ids': [result.id], 'skipped': skipped}
+    
+    run_id = uuid.uuid4().hex
+    started_at = time.time()
+    if result_store:
+        result_store.start_run(run_id, len(urls), started_at)
+    
+    chunks = chunk_urls(urls)
+    header = group([scrape_url_chunk.s(chunk, **kwargs) for chunk in chunks])
+    result = chord(header)(aggregate_run.s(run_id, started_at).set(task_id=run_id))
+    logging.info(f"スケジュール実行 {run_id}: {len(urls)}件のURLを{len(chunks)}個のチャンクで取得します...")
+    return {'task_ids': [result.id], 'skipped': skipped}
+
+@worker_process_shutdown.connect
+def close_sinks_on_shutdown(**kwargs):
+    """ワーカープロセスの終了時に、保存先と結果のストアのバッファに残っているレコードを書き込み、解析のワーカーを終了する"""
+    close_sinks()
+    shutdown_parse_executor()
+    if result_store:
+        result_store.close()
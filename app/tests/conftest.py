@@ -0,0 +1,5 @@
+import os
+import sys
+
+# appのモジュールはフラットにimportする（python app.pyなどと同じ）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
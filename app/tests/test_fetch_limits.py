@@ -0,0 +1,80 @@
+"""fetch_limits.read_bodyの上限と期限のテスト（ローカルのサーバーを相手にする）"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from fetch_limits import DEADLINE_EXCEEDED, OVERSIZED, FetchLimitExceeded, read_body, request_timeout, start_deadline
+
+PAGE = b'<html><body>' + b'<p>page</p>' * 2000 + b'</body></html>'
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if self.path == '/drip':
+            # 1バイトずつ0.5秒おきに送る（読み込みのタイムアウトにはかからない）
+            self.send_header('Content-Length', '1000')
+            self.end_headers()
+            self._drip(lambda byte: byte)
+        elif self.path == '/drip-chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self._drip(lambda byte: b'1\r\n' + byte + b'\r\n')
+        else:
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+
+    def _drip(self, frame):
+        try:
+            for _ in range(1000):
+                self.wfile.write(frame(b'x'))
+                self.wfile.flush()
+                time.sleep(0.5)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture(scope='module')
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def get(url):
+    return requests.get(url, stream=True, timeout=request_timeout(connect=5, read=30, deadline=30))
+
+@pytest.mark.parametrize('path', ['/drip', '/drip-chunked'])
+def test_drip_stops_at_deadline(base_url, path):
+    started = time.monotonic()
+    with pytest.raises(FetchLimitExceeded) as error:
+        read_body(get(base_url + path), deadline=start_deadline(2))
+    elapsed = time.monotonic() - started
+    assert error.value.status == DEADLINE_EXCEEDED
+    assert 0 < error.value.received < 10
+    assert elapsed < 3
+
+def test_reads_whole_page(base_url):
+    body, truncated = read_body(get(base_url + '/page'), deadline=start_deadline(10))
+    assert body == PAGE
+    assert not truncated
+
+def test_truncate(base_url):
+    body, truncated = read_body(get(base_url + '/page'), max_bytes=1000, deadline=start_deadline(10), oversize='truncate')
+    assert body == PAGE[:1000]
+    assert truncated
+
+def test_skip_by_content_length(base_url):
+    with pytest.raises(FetchLimitExceeded) as error:
+        read_body(get(base_url + '/page'), max_bytes=1000, deadline=start_deadline(10), oversize='skip')
+    assert error.value.status == OVERSIZED
+    assert error.value.received == 0
@@ -0,0 +1,91 @@
+"""パーサーバックエンド（html.parser / lxml / selectolax）の抽出結果の比較
+
+壊れたHTMLでは、HTML5の仕様どおりに解析するlxml・selectolax（lexbor）と、タグを書かれたとおりに
+入れ子にするhtml.parserとで結果が変わる。同じになる場合は一致を、変わる場合はその違いを確かめる。
+app/dataのページ（正しいHTML）では、すべてのバックエンドで同じ結果になることを確かめる。
+"""
+import importlib.util
+
+import pytest
+
+from bench_parsers import load_fixture_pages
+from extractor import extract_content
+from parsers import parse_html
+
+PARAGRAPH = 'スキマバイトのアプリを運営する企業は、登録者数が前年の二倍を超えたと発表した。'
+
+# どのバックエンドでも同じ結果になる壊れたHTML
+PARITY_CASES = {
+    'cdata': f'<html><head><title>T</title></head><body><p>{PARAGRAPH}</p><![CDATA[ CDATAの中身 ]]>'
+             f'<p>{PARAGRAPH}後ろ</p></body></html>',
+    'stray_end_tags': f'<html><body></div><p>{PARAGRAPH}</span>本文</p></b></body></html>',
+    'missing_head_body': f'<title>T</title><meta name="description" content="説明"><p>{PARAGRAPH}</p>'
+                         f'<a href="/x">リンク</a><img src="a.jpg">',
+    'nested_a': f'<html><body><p>{PARAGRAPH}</p><a href="/a">A<a href="/b">B</a></a></body></html>',
+    'text_in_table': f'<html><body><table>{PARAGRAPH}<tr><td>セル</td></tr></table></body></html>',
+    'unquoted_attrs': f'<html><body><p>{PARAGRAPH}</p><a href=/a/b?x=1&y=2>リンク</a><img src=/i.jpg alt=画像></body></html>',
+}
+
+def backend_params(*backends):
+    """バックエンドのパラメーター（パッケージがなければスキップ。parse_htmlはhtml.parserで代わりに解析してしまうため）"""
+    modules = {'lxml': 'lxml', 'selectolax': 'selectolax'}
+    return [
+        pytest.param(backend, marks=pytest.mark.skipif(
+            backend in modules and importlib.util.find_spec(modules[backend]) is None, reason=f"{backend}がありません"))
+        for backend in backends
+    ]
+
+def extract(html, backend):
+    return extract_content(parse_html(html, backend), 'https://example.com/articles/1', 10)
+
+# app/dataの保存済みレコードから再構成したページ（bench_parsers.pyと同じ）
+FIXTURE_PAGES = load_fixture_pages()
+
+def test_fixture_pages_exist():
+    assert FIXTURE_PAGES
+
+@pytest.mark.parametrize('name, url, page', FIXTURE_PAGES, ids=[name for name, _, _ in FIXTURE_PAGES])
+@pytest.mark.parametrize('backend', backend_params('lxml', 'selectolax'))
+def test_parity_on_fixture_pages(name, url, page, backend):
+    assert extract_content(parse_html(page, backend), url) == extract_content(parse_html(page, 'html.parser'), url)
+
+@pytest.mark.parametrize('name', sorted(PARITY_CASES))
+@pytest.mark.parametrize('backend', backend_params('lxml', 'selectolax'))
+def test_parity_on_malformed_html(name, backend):
+    html = PARITY_CASES[name]
+    assert extract(html, backend) == extract(html, 'html.parser')
+
+def test_cdata_is_not_content():
+    data = extract(PARITY_CASES['cdata'], 'html.parser')
+    assert 'CDATA' not in data['content']
+    assert data['content'] == f"{PARAGRAPH}\n\n{PARAGRAPH}後ろ"
+
+@pytest.mark.parametrize('backend', backend_params('lxml', 'selectolax'))
+def test_unclosed_p(backend):
+    # html.parserは閉じていない<p>を入れ子にするため、外側の段落が後ろの段落のテキストも含む。
+    # HTML5では次の<p>・<div>の前で閉じる
+    html = (f'<html><head><title>T</title></head><body><p>{PARAGRAPH}一つ目<p>{PARAGRAPH}二つ目'
+            f'<div>{PARAGRAPH}三つ目</div></body></html>')
+    first, second, third = (f"{PARAGRAPH}{suffix}" for suffix in ('一つ目', '二つ目', '三つ目'))
+    assert extract(html, 'html.parser')['content'] == f"{first}{second}{third}\n\n{second}{third}"
+    assert extract(html, backend)['content'] == f"{first}\n\n{second}"
+
+@pytest.mark.parametrize('backend', backend_params('lxml', 'selectolax'))
+def test_markup_in_title(backend):
+    # <title>の中身はHTML5ではテキスト（RCDATA）なので、タグも文字のまま残る。html.parserはタグとして解析する
+    html = f'<html><head><title>記事 <b>速報</b> &amp; 続報</title></head><body><p>{PARAGRAPH}</p></body></html>'
+    expected = extract(html, 'html.parser')
+    data = extract(html, backend)
+    assert expected['title'] == '記事 速報 & 続報'
+    assert data['title'] == '記事 <b>速報</b> & 続報'
+    assert {**data, 'title': expected['title']} == expected
+
+@pytest.mark.parametrize('backend', backend_params('lxml', 'selectolax'))
+def test_unclosed_title(backend):
+    # 閉じていない<title>は、HTML5では文書の最後までがタイトルになり、本文がなくなる
+    html = f'<html><head><title>題名</head><body><p>{PARAGRAPH}</p></body></html>'
+    assert extract(html, 'html.parser')['title'] == '題名'
+    assert extract(html, 'html.parser')['content'] == PARAGRAPH
+    data = extract(html, backend)
+    assert data['title'] == f"題名</head><body><p>{PARAGRAPH}</p></body></html>"
+    assert data['content'] == ''
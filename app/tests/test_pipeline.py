@@ -0,0 +1,58 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import async_fetcher
+import pipeline
+from bench_io_worker import start_mock_site
+
+@pytest.fixture(scope='module')
+def base_url():
+    server, url = start_mock_site(0)
+    yield url
+    server.shutdown()
+
+class CountingFetcher(pipeline.PipelineFetcher):
+    """読み終えた本文のうち、_fetch_oneがまだ返っていないもの（メモリにある本文）を数える"""
+
+    held = 0
+    held_max = 0
+
+    async def _fetch_one(self, url):
+        try:
+            return await super()._fetch_one(url)
+        finally:
+            CountingFetcher.held -= 1
+
+def test_queue_bounds_held_bodies(monkeypatch, base_url):
+    read_body_async = async_fetcher.read_body_async
+
+    async def counting_read_body(*args, **kwargs):
+        result = await read_body_async(*args, **kwargs)
+        CountingFetcher.held += 1
+        CountingFetcher.held_max = max(CountingFetcher.held_max, CountingFetcher.held)
+        return result
+
+    def slow_store(url, data, fingerprint, output_dir, sink, normalized):
+        # 解析と保存が取得より遅い状態にする
+        time.sleep(0.01)
+        return {'url': url, 'status': 'saved'}
+
+    # 解析のワーカーはプロセスの代わりにスレッドにする（プロセスの起動を待たない）
+    monkeypatch.setattr(async_fetcher, 'read_body_async', counting_read_body)
+    monkeypatch.setattr(pipeline, 'get_parse_executor', lambda workers: ThreadPoolExecutor(workers))
+    monkeypatch.setattr(pipeline, 'store_page', slow_store)
+
+    CountingFetcher.held = CountingFetcher.held_max = 0
+    queue_size, concurrency = 2, 10
+    urls = [f"{base_url}/articles/{index}" for index in range(200)]
+    fetcher = CountingFetcher(workers=1, queue_size=queue_size, store_workers=1, concurrency=concurrency, per_host=concurrency,
+                              check_robots=False, use_cache=False)
+    results = asyncio.run(fetcher.fetch_all(urls))
+
+    assert [result['url'] for result in results] == urls
+    assert CountingFetcher.held == 0
+    assert CountingFetcher.held_max <= queue_size + concurrency, CountingFetcher.held_max
+    assert fetcher.stats['backpressure'] > 0
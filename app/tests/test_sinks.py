@@ -0,0 +1,14 @@
+import csv
+import json
+
+from sinks import save_to_csv
+
+def test_csv_serializes_lists_and_dicts(tmp_path):
+    filename = tmp_path / 'page_filtered.csv'
+    matched = {'タイミー': {'content': 6, 'title': 1}}
+    save_to_csv({'url': 'https://example.com/', 'images': ['a.jpg', 'b.jpg'], 'matched_keywords': matched}, filename)
+    with open(filename, encoding='utf-8', newline='') as f:
+        row = next(csv.DictReader(f))
+    assert row['images'] == 'a.jpg,b.jpg'
+    assert row['matched_keywords'] == '{"タイミー": {"content": 6, "title": 1}}'
+    assert json.loads(row['matched_keywords']) == matched
@@ -0,0 +1,23 @@
+from url_index import UrlIndex
+
+def test_partition_reports_skipped_urls(tmp_path):
+    index = UrlIndex(str(tmp_path / 'urls.sqlite3'))
+    index.record('https://example.com/fresh')
+    urls = ['https://example.com/fresh', 'https://example.com/new', 'https://example.com/new/?utm_source=x']
+
+    selected, skipped = index.partition_urls(urls)
+    assert selected == ['https://example.com/new']
+    assert skipped == [
+        {'url': 'https://example.com/fresh', 'reason': 'recently_fetched'},
+        {'url': 'https://example.com/new/?utm_source=x', 'reason': 'duplicate'},
+    ]
+    assert index.filter_urls(urls) == selected
+
+def test_manual_run_keeps_recently_fetched_urls(tmp_path):
+    index = UrlIndex(str(tmp_path / 'urls.sqlite3'))
+    index.record('https://example.com/fresh')
+    urls = ['https://example.com/fresh', 'http://example.com/fresh']
+
+    selected, skipped = index.partition_urls(urls, skip_fresh=False)
+    assert selected == ['https://example.com/fresh']
+    assert skipped == [{'url': 'http://example.com/fresh', 'reason': 'duplicate'}]
@@ -0,0 +1,160 @@
+"""保存したページの全文検索インデックス（文字bigram、SQLiteのFTS5）
+
+タイトル・説明・本文をnormalize_japanese_textと同じ正規化（小文字化、半角カナの全角化、
+全角英数字の半角化、カタカナのひらがな化）をしてから文字bigramに分割し、結果のストアと同じデータベースの
+FTS5テーブルに取得ID（fetches.id）をキーにして登録する。単語に区切れない日本語でも
+部分文字列で検索でき、カナや全角・半角の表記揺れも一致する。
+
+保存済みのJSONファイルとJSON Linesのセグメントは、次のコマンドで結果のストアに取り込める:
+    python text_index.py --import data
+"""
+import argparse
+import logging
+import re
+import sqlite3
+
+from normalizer import normalize_for_match
+from config import TEXT_INDEX_MAX_CANDIDATES
+
+# 検索の対象にする列と、順位付け（BM25）の重み
+COLUMNS = ('title', 'description', 'content')
+COLUMN_WEIGHTS = (5.0, 2.0, 1.0)
+
+# 本文はフィールドのテキストを保存せず、bigramの転置インデックスだけを持つ（contentless）
+SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS fetch_text USING fts5 (title, description, content, content='', tokenize='ascii', prefix='1')",
+)
+
+# 記号と空白で区切った文字の並び（この中でbigramを作る）
+_RUN = re.compile(r'[^\W_]+')
+
+def normalize_for_index(text):
+    """インデックスと検索語に共通の正規化を行う（保存済みのレコードは正規化テキストのキャッシュを使う）"""
+    return normalize_for_match(text)
+
+def bigram_tokens(text):
+    """正規化したテキストの文字bigramのリストを返す
+
+    文字の並びごとに隣り合う2文字を順に並べ、最後の1文字も加える
+    （1文字の検索語を前方一致で探せるように、どの文字もいずれかのトークンの先頭になる）。
+    トークンの位置は連続するため、検索語のbigramをフレーズとして探すと部分文字列の一致になる。
+    """
+    tokens = []
+    for run in _RUN.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return tokens
+
+def index_values(record):
+    """レコードのタイトル・説明・本文をインデックス用のトークン列（空白区切り）にする"""
+    return tuple(' '.join(bigram_tokens(normalize_for_index(record.get(column)))) for column in COLUMNS)
+
+def match_query(query):
+    """検索語をFTS5の検索式にする（空白で区切った語はすべて含むもの。語がなければNone）
+
+    2文字以上の語はbigramのフレーズ、1文字の語はその文字で始まるトークンの前方一致にする。
+    """
+    phrases = []
+    for run in _RUN.findall(normalize_for_index(query)):
+        if len(run) == 1:
+            phrases.append(f'"{run}"*')
+        else:
+            phrases.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+    return ' AND '.join(phrases) or None
+
+def create_index(connection):
+    """インデックスのテーブルを作成する（FTS5が使えない場合はFalse）"""
+    try:
+        for statement in SCHEMA:
+            connection.execute(statement)
+        return True
+    except sqlite3.OperationalError as e:
+        logging.warning(f"SQLiteのFTS5が使えないため、全文検索インデックスを無効にします: {e}")
+        return False
+
+def add(connection, fetch_id, record):
+    """保存したページをインデックスに登録する"""
+    connection.execute('INSERT INTO fetch_text (rowid, title, description, content) VALUES (?, ?, ?, ?)',
+                       (fetch_id,) + index_values(record))
+
+def search(connection, query, limit=20, offset=0, domain=None, max_candidates=TEXT_INDEX_MAX_CANDIDATES):
+    """検索語を含むページを関連度の高い順に返す（同じページの複数のスナップショットは最も関連度の高いもの1件にする）
+
+    「の」のようにほとんどのページに含まれる語でもすぐに返せるよう、検索語を含む新しいページから
+    max_candidates件だけを取り出して関連度（BM25）で並べる。
+    """
+    expression = match_query(query)
+    if expression is None:
+        return []
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    condition = ' AND fetches.domain = ?' if domain else ''
+    params = [expression] + ([domain.lower()] if domain else [])
+    # FTS5はrowid（取得ID）の降順に一致を返せるため、候補の件数で打ち切れる
+    rows = connection.execute(
+        'SELECT fetches.id, fetches.page_id, fetches.url, pages.canonical_url, fetches.domain, fetches.fetched_at, '
+        f'fetches.title, fetches.description, bm25(fetch_text, {weights}) '
+        'FROM fetch_text JOIN fetches ON fetches.id = fetch_text.rowid JOIN pages ON pages.id = fetches.page_id '
+        f'WHERE fetch_text MATCH ?{condition} ORDER BY fetch_text.rowid DESC LIMIT ?',
+        params + [max_candidates]
+    ).fetchall()
+    rows.sort(key=lambda row: row[-1])
+
+    hits = []
+    pages = set()
+    for fetch_id, page_id, url, canonical_url, row_domain, fetched_at, title, description, score in rows:
+        if page_id in pages:
+            continue
+        pages.add(page_id)
+        hits.append({
+            'id': fetch_id,
+            'url': url,
+            'canonical_url': canonical_url,
+            'domain': row_domain,
+            'fetched_at': fetched_at,
+            'title': title,
+            'description': description,
+            # bm25()は関連度が高いほど小さい負の値になるため、符号を反転する
+            'score': round(-score, 4),
+        })
+        if len(hits) >= offset + limit:
+            break
+    return hits[offset:offset + limit]
+
+def import_records(input_dir, store):
+    """保存済みのJSONファイルとJSON Linesのセグメントを結果のストアに取り込む（取り込んだ件数を返す）"""
+    from datetime import datetime
+    from parquet_export import load_json_records
+    from sinks import read_records
+
+    count = 0
+    for source in (load_json_records(input_dir), read_records(input_dir)):
+        for record in source:
+            if record.get('kind', 'page') != 'page' or record.get('status'):
+                continue
+            store.record(record['url'], record, fetched_at=datetime.fromisoformat(record['saved_at']).timestamp())
+            count += 1
+    store.flush()
+    return count
+
+def main():
+    from result_store import result_store
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='保存したページの全文検索')
+    parser.add_argument('query', nargs='*', help='検索語（空白で区切るとすべてを含むページ）')
+    parser.add_argument('--import', dest='import_dir', metavar='DIR', help='保存済みのJSONファイルとJSON Linesのセグメントを取り込む')
+    parser.add_argument('--limit', '-n', type=int, default=20, help='表示する件数（デフォルト: 20）')
+    args = parser.parse_args()
+
+    if result_store is None:
+        logging.error("結果のストアが無効です（SCRAPER_RESULT_STOREを確認してください）。")
+        return
+    if args.import_dir:
+        count = import_records(args.import_dir, result_store)
+        logging.info(f"{count}件のページを取り込みました: {args.import_dir}")
+    if args.query:
+        for hit in result_store.search(' '.join(args.query), limit=args.limit):
+            print(f"{hit['score']:8.3f}  {hit['title'] or ''}  {hit['url']}")
+
+if __name__ == '__main__':
+    main()
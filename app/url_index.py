@@ -0,0 +1,138 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import URL_INDEX_ENABLED, URL_INDEX_PATH, URL_INDEX_REFETCH_AFTER, URL_TRACKING_PARAMS
+from http_cache import is_not_modified
+from fetch_limits import is_fetch_limited
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_TRACKING_NAMES = frozenset(name.strip().lower() for name in URL_TRACKING_PARAMS if name.strip() and not name.strip().endswith('*'))
+_TRACKING_PREFIXES = tuple(name.strip().lower()[:-1] for name in URL_TRACKING_PARAMS if name.strip().endswith('*'))
+
+def _is_tracking_param(name):
+    name = name.lower()
+    return name in _TRACKING_NAMES or name.startswith(_TRACKING_PREFIXES)
+
+def canonicalize_url(url):
+    """同じページを指すURLを1つの形にそろえる
+
+    - スキームとホスト名を小文字にし、デフォルトのポート番号を取り除く
+    - フラグメントと末尾のスラッシュを取り除く（ルートの「/」は残す）
+    - トラッキング用のクエリパラメータを取り除き、残りを名前順に並べる
+    """
+    parsed_url = urlsplit(url.strip())
+    scheme = parsed_url.scheme.lower()
+    host = (parsed_url.hostname or '').lower()
+    if ':' in host:
+        host = f"[{host}]"
+    try:
+        port = parsed_url.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+
+    path = parsed_url.path.rstrip('/') or '/'
+    params = [(name, value) for name, value in parse_qsl(parsed_url.query, keep_blank_values=True) if not _is_tracking_param(name)]
+    query = urlencode(sorted(params))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def url_key(url):
+    """重複判定のキーを返す（正規化したURLからスキームを除いたもの。httpとhttpsは同じページとみなす）"""
+    canonical_url = canonicalize_url(url)
+    return canonical_url.split('://', 1)[-1]
+
+class UrlIndex:
+    """正規化したURLごとの最終取得時刻を保存するインデックス（SQLite）
+
+    スケジュール実行やクロールでURLをキューに入れる前に確認し、
+    refetch_after秒以内に取得したURL（別の表記や、ページが示す
+    rel=canonical・og:urlのURLを含む）は取得しない。
+    """
+
+    def __init__(self, path=URL_INDEX_PATH, refetch_after=URL_INDEX_REFETCH_AFTER):
+        self.path = path
+        self.refetch_after = refetch_after
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # fork後の子プロセスでは親の接続を使わずに開き直す
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS urls ('
+                'key TEXT PRIMARY KEY, url TEXT NOT NULL, canonical_url TEXT, fetched_at REAL NOT NULL)'
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def last_fetched(self, url):
+        """URLを最後に取得した時刻を返す（未取得ならNone）"""
+        with self._lock:
+            row = self._connect().execute('SELECT fetched_at FROM urls WHERE key = ?', (url_key(url),)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, url, now=None):
+        """refetch_after秒以内に取得済みかどうかを返す"""
+        fetched_at = self.last_fetched(url)
+        return fetched_at is not None and (now or time.time()) - fetched_at < self.refetch_after
+
+    def record(self, url, canonical_url=None, fetched_at=None):
+        """URLを取得したことを記録する（ページが示す正規URLも同時に記録する）"""
+        fetched_at = fetched_at or time.time()
+        rows = [(url_key(url), url, canonical_url, fetched_at)]
+        if canonical_url and url_key(canonical_url) != rows[0][0]:
+            rows.append((url_key(canonical_url), canonical_url, canonical_url, fetched_at))
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)', rows)
+
+    def record_result(self, url, result):
+        """スクレイピングの結果を記録する（失敗したURLと、上限を超えて取得をやめたURLは記録せず、次回も取得する）"""
+        if not result or is_fetch_limited(result):
+            return
+        canonical_url = None if is_not_modified(result) else result.get('canonical_url')
+        self.record(url, canonical_url)
+
+    def filter_urls(self, urls, skip_fresh=True):
+        """取得が必要なURLだけを返す（同じページを指すURLは最初の1つだけにする）"""
+        return self.partition_urls(urls, skip_fresh)[0]
+
+    def partition_urls(self, urls, skip_fresh=True):
+        """(取得が必要なURLのリスト, スキップしたURLのリスト)を返す
+
+        スキップしたURLは{'url': URL, 'reason': 'duplicate' / 'recently_fetched'}の辞書。
+        skip_freshがFalseの場合は、最近取得したURLもスキップしない（同じページを指すURLは最初の1つだけにする）。
+        """
+        now = time.time()
+        keys = set()
+        selected = []
+        skipped = []
+        for url in urls:
+            key = url_key(url)
+            if key in keys:
+                skipped.append({'url': url, 'reason': 'duplicate'})
+                continue
+            if skip_fresh and self.is_fresh(url, now):
+                skipped.append({'url': url, 'reason': 'recently_fetched'})
+                continue
+            keys.add(key)
+            selected.append(url)
+        if skipped:
+            logging.info(f"重複または最近取得したURLを{len(skipped)}件スキップしました: {[entry['url'] for entry in skipped]}")
+        return selected, skipped
+
+# プロセスで共有するインデックス（無効の場合はNone）
+url_index = UrlIndex() if URL_INDEX_ENABLED else None
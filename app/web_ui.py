@@ -3,9 +3,13 @@ import os
 import json
 import threading
 import time
-from config import DEFAULT_URLS, SCHEDULE_INTERVALS, DEFAULT_SCHEDULE
+from datetime import datetime
+from config import DEFAULT_URLS, SCHEDULE_INTERVALS, DEFAULT_SCHEDULE, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES
 from celery_app import app as celery_app
 from tasks import scrape_url, scrape_scheduled_urls
+from rate_limiter import rate_limiter
+from result_store import result_store
+from summary_cache import summary_cache
 from pyngrok import ngrok
 
 app = Flask(__name__)
@@ -17,6 +21,11 @@ public_url = None
 # 設定ファイルのパス
 CONFIG_FILE = 'scheduler_config.json'
 
+@app.template_filter('datetime')
+def format_timestamp(timestamp):
+    """UNIX時刻を日時の文字列にする"""
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
 def load_config():
     """設定ファイルを読み込む"""
     if os.path.exists(CONFIG_FILE):
@@ -29,7 +38,10 @@ def load_config():
         'min_text_length': 50,
         'delay': 1,
         'keyword': None,
-        'summarize': False
+        'summarize': False,
+        'crawl': False,
+        'max_depth': CRAWL_MAX_DEPTH,
+        'max_pages': CRAWL_MAX_PAGES
     }
 
 def save_config(config):
@@ -51,12 +63,20 @@ def index():
     # ngrok URLを取得
     ngrok_url = app.config.get('NGROK_URL', None)
     
+    # 最近の結果と件数（結果のストアが無効の場合は表示しない）
+    recent_results = result_store.recent(limit=20) if result_store else []
+    result_counts = result_store.counts() if result_store else None
+    recent_runs = result_store.runs(limit=10) if result_store else []
+    
     return render_template('index.html', 
                           config=config, 
                           schedule_intervals=SCHEDULE_INTERVALS,
                           schedule_name=schedule_name,
                           active_tasks=[],
-                          ngrok_url=ngrok_url)
+                          ngrok_url=ngrok_url,
+                          recent_results=recent_results,
+                          result_counts=result_counts,
+                          recent_runs=recent_runs)
 
 @app.route('/update_config', methods=['POST'])
 def update_config():
@@ -83,7 +103,10 @@ def update_config():
         'min_text_length': int(request.form.get('min_text_length', 50)),
         'delay': float(request.form.get('delay', 1)),
         'keyword': request.form.get('keyword') or None,
-        'summarize': 'summarize' in request.form
+        'summarize': 'summarize' in request.form,
+        'crawl': 'crawl' in request.form,
+        'max_depth': int(request.form.get('max_depth', CRAWL_MAX_DEPTH)),
+        'max_pages': int(request.form.get('max_pages', CRAWL_MAX_PAGES))
     })
     
     save_config(config)
@@ -100,6 +123,9 @@ def update_config():
                 'delay': config['delay'],
                 'keyword': config['keyword'],
                 'summarize': config['summarize'],
+                'crawl': config.get('crawl', False),
+                'max_depth': config.get('max_depth', CRAWL_MAX_DEPTH),
+                'max_pages': config.get('max_pages', CRAWL_MAX_PAGES),
             }
         }
     }
@@ -118,7 +144,12 @@ def run_now():
         min_text_length=config['min_text_length'],
         delay=config['delay'],
         keyword=config['keyword'],
-        summarize=config['summarize']
+        summarize=config['summarize'],
+        crawl=config.get('crawl', False),
+        max_depth=config.get('max_depth', CRAWL_MAX_DEPTH),
+        max_pages=config.get('max_pages', CRAWL_MAX_PAGES),
+        # 手動の実行では、最近取得したURLも取得する
+        skip_fresh=False
     )
     
     # JSONレスポンスを返す場合
@@ -130,11 +161,15 @@ def run_now():
 
 @app.route('/task_status/<task_id>')
 def task_status(task_id):
-    """タスクのステータスを取得する"""
+    """タスクのステータスを取得する
+
+    タスクの結果（結果の要約や集計の辞書・リスト）はそのままJSONで返し、例外などは文字列にする。
+    """
     task = celery_app.AsyncResult(task_id)
+    info = task.info
     response = {
         'state': task.state,
-        'info': str(task.info) if task.info else None
+        'info': info if isinstance(info, (dict, list)) or info is None else str(info)
     }
     return jsonify(response)
 
@@ -158,6 +193,112 @@ def stop_task(task_id):
     
     return redirect(url_for('index'))
 
+@app.route('/rate_limit_stats')
+def rate_limit_stats():
+    """ドメインごとのリクエスト数と待ち時間を返す"""
+    return jsonify(rate_limiter.metrics())
+
+@app.route('/summary_cache_stats')
+def summary_cache_stats():
+    """全ワーカーの要約のキャッシュのヒット数・ミス数・ヒット率を返す（sharedに入る。Redisで共有する場合だけ）
+
+    要約はワーカーのプロセスで行うため、Web UIのプロセスの集計（hits・misses）は常に0になる。
+    共有のバックエンド（SCRAPER_SUMMARY_CACHE_REDIS_URL）がない場合は、0ではなくエラーを返す。
+    """
+    if summary_cache is None:
+        return jsonify({'error': '要約のキャッシュが無効です（SCRAPER_SUMMARY_CACHEを確認してください）'}), 404
+    if not summary_cache.redis_url:
+        return jsonify({'error': 'ワーカー間で共有する要約のキャッシュがありません。'
+                                 'ワーカーとWeb UIにSCRAPER_SUMMARY_CACHE_REDIS_URLを設定してください'}), 404
+    stats = summary_cache.stats()
+    if 'shared' not in stats:
+        return jsonify({'error': '要約のキャッシュ（Redis）の集計を取得できませんでした'}), 503
+    return jsonify(stats)
+
+def _result_store_required():
+    if result_store is None:
+        return jsonify({'error': '結果のストアが無効です（SCRAPER_RESULT_STOREを確認してください）'}), 404
+    return None
+
+@app.route('/results')
+def results():
+    """最近の取得結果を新しい順に返す（domainで絞り込み、beforeに前のページの最後のfetched_atを指定してページ送り）"""
+    error = _result_store_required()
+    if error:
+        return error
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(result_store.recent(limit=limit, domain=request.args.get('domain'), before=request.args.get('before', type=float)))
+
+@app.route('/results/history')
+def result_history():
+    """URLの取得履歴を新しい順に返す"""
+    error = _result_store_required()
+    if error:
+        return error
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'urlを指定してください'}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(result_store.history(url, limit=limit))
+
+@app.route('/results/<int:fetch_id>')
+def result_detail(fetch_id):
+    """取得結果を画像とリンクのURLを含めて返す"""
+    error = _result_store_required()
+    if error:
+        return error
+    detail = result_store.fetch_detail(fetch_id)
+    if detail is None:
+        return jsonify({'error': '結果が見つかりません'}), 404
+    return jsonify(detail)
+
+@app.route('/results/counts')
+def result_counts():
+    """ステータスごとの取得件数とページ数を返す（domainを指定するとそのドメインだけ）"""
+    error = _result_store_required()
+    if error:
+        return error
+    domain = request.args.get('domain')
+    response = result_store.counts(domain)
+    if not domain:
+        response['domains'] = result_store.domains()
+    return jsonify(response)
+
+@app.route('/runs')
+def runs():
+    """スケジュール実行と、その集計（件数・バイト数・所要時間）を新しい順に返す"""
+    error = _result_store_required()
+    if error:
+        return error
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify(result_store.runs(limit=limit))
+
+@app.route('/runs/<run_id>')
+def run_detail(run_id):
+    """スケジュール実行の集計を返す（結果のストアが無効の場合はコールバックのタスクの結果）"""
+    if result_store is None:
+        task = celery_app.AsyncResult(run_id)
+        return jsonify({'id': run_id, 'status': task.state, 'stats': task.result if task.successful() else None})
+    run = result_store.run(run_id)
+    if run is None:
+        return jsonify({'error': '実行が見つかりません'}), 404
+    return jsonify(run)
+
+@app.route('/search')
+def search():
+    """保存したページを全文検索し、関連度の高い順に返す（qは空白で区切るとすべてを含むページ）"""
+    error = _result_store_required()
+    if error:
+        return error
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'qを指定してください'}), 400
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    started = time.perf_counter()
+    hits = result_store.search(query, limit=limit, offset=offset, domain=request.args.get('domain'))
+    return jsonify({'query': query, 'hits': hits, 'took_ms': round((time.perf_counter() - started) * 1000, 2)})
+
 def start_ngrok():
     """ngrokトンネルを開始し、公開URLを取得する"""
     global public_url